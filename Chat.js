@@ -37,9 +37,44 @@ const Chat = () => {
 
   useEffect(() => { scrollToBottom(); }, [messages]);
 
+  // Long-poll message events instead of re-fetching the conversation on a timer
   useEffect(() => {
-    const interval = setInterval(() => selectedUser && loadMessages(), 2000);
-    return () => clearInterval(interval);
+    if (!selectedUser) return;
+    let cancelled = false;
+    let after = null;
+
+    const pollEvents = async () => {
+      while (!cancelled) {
+        try {
+          const res = await axios.get('/chat/events', {
+            params: after === null ? {} : { after }
+          });
+          if (cancelled) break;
+          if (res.status === 204) {
+            // No long-poll slot free on the server: reload on a timer and start over
+            const retryAfter = Number(res.headers['retry-after']) || 5;
+            await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+            if (cancelled) break;
+            after = null;
+            loadMessages();
+            continue;
+          }
+          const { events, last_event_id, resync } = res.data;
+          after = last_event_id;
+          const relevant = events.some(e =>
+            e.sender_id === selectedUser._id || e.recipient_id === selectedUser._id
+          );
+          if (resync || relevant) loadMessages();
+        } catch (err) {
+          console.error(err);
+          await new Promise(resolve => setTimeout(resolve, 5000));
+        }
+      }
+    };
+
+    loadMessages();
+    pollEvents();
+    return () => { cancelled = true; };
   }, [selectedUser]);
 
   useEffect(() => {
@@ -9,276 +9,420 @@ from sklearn.ensemble import IsolationForest
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
+import argparse
 import joblib
 import os
 import json
-from collections import defaultdict, deque
+import shutil
+from concurrent.futures import Future
 import threading
 import time
+import uuid
+
+from behavior_store import BehaviorStore, RollingMean, SharedBehaviorStore
+from forest_engine import FlatIsolationForest
+from model_retraining import FeatureReservoir
+from threat_scoring import MicroBatchScorer
+
+ANOMALY_TYPES = ('high_freq', 'unusual_time', 'bot_like', 'suspicious_content')
+
+# Model, scaler and PCA artifacts, in that order, within a version directory
+ARTIFACT_FILES = ('threat_detection_model.pkl', 'scaler.pkl', 'pca.pkl')
+
+class ActiveModel(NamedTuple):
+    """A model version ready for scoring, installed and replaced as one reference"""
+    model: IsolationForest
+    scaler: StandardScaler
+    pca: PCA
+    forest: Optional[FlatIsolationForest]
+    # Scaler and PCA folded into one (weights, bias) affine map
+    projection: Optional[Tuple[np.ndarray, np.ndarray]]
+    version: Optional[str]
+    created_at: Optional[str]
 
 class ThreatDetector:
     """AI-powered threat detection using machine learning"""
     
-    def __init__(self):
-        self.model = None
-        self.scaler = StandardScaler()
-        self.pca = PCA(n_components=10)
-        self.is_trained = False
-        self.model_path = 'models/threat_detection_model.pkl'
-        self.scaler_path = 'models/scaler.pkl'
-        self.pca_path = 'models/pca.pkl'
-        
-        # User behavior tracking
-        self.user_behavior = defaultdict(lambda: {
-            'message_frequency': deque(maxlen=100),
-            'message_lengths': deque(maxlen=100),
-            'time_patterns': deque(maxlen=100),
-            'ip_addresses': set(),
-            'last_activity': None,
-            'suspicious_count': 0
-        })
+    def __init__(self, model_dir: Optional[str] = None, behavior=None):
+        self.active = None
+        self.model_dir = model_dir or os.getenv('THREAT_MODEL_DIR', 'models')
+        self.manifest_path = os.path.join(self.model_dir, 'manifest.json')
+        self.keep_versions = int(os.getenv('THREAT_MODEL_KEEP_VERSIONS', 3))
+        
+        # Artifacts are loaded on the first score, never trained here
+        self.model_loaded = False
+        self.model_lock = threading.Lock()
+        
+        # Feature rows of scored messages, sampled for retraining
+        self.reservoir = FeatureReservoir(int(os.getenv('THREAT_RETRAIN_SAMPLE_SIZE', 10000)))
+        self.retrain_min_samples = int(os.getenv('THREAT_RETRAIN_MIN_SAMPLES', 1000))
+        # A retrained model must flag this share of held-out synthetic anomalies,
+        # and at most that share of held-out synthetic normal behavior, to be used
+        self.retrain_min_recall = float(os.getenv('THREAT_RETRAIN_MIN_RECALL', 0.5))
+        self.retrain_max_false_positives = float(os.getenv('THREAT_RETRAIN_MAX_FALSE_POSITIVES', 0.25))
+        
+        # Batches up to THREAT_FLAT_MAX_BATCH rows are scored by the flattened
+        # forest, larger ones by sklearn, whose per-row cost is lower
+        self.model_engine = os.getenv('THREAT_MODEL_ENGINE', 'flat').lower()
+        self.flat_max_batch = int(os.getenv('THREAT_FLAT_MAX_BATCH', 128))
+        
+        # Concurrent scores share one vectorized model call
+        self.batch_scorer = MicroBatchScorer(
+            self.score_features,
+            max_batch=int(os.getenv('THREAT_SCORE_BATCH_SIZE', 64)),
+            max_wait=float(os.getenv('THREAT_SCORE_BATCH_WAIT_MS', 2)) / 1000
+        )
+        
+        # User behavior tracking; in process memory, fixed in size by
+        # THREAT_BEHAVIOR_MAX_USERS, unless a shared store is passed in
+        if behavior is None:
+            behavior = BehaviorStore(
+                max_users=int(os.getenv('THREAT_BEHAVIOR_MAX_USERS', 50000)),
+                idle_seconds=float(os.getenv('THREAT_BEHAVIOR_IDLE_SECONDS', 86400))
+            )
+        self.behavior = behavior
         
         # Global threat indicators
         self.global_threat_level = 0.0
-        self.threat_history = deque(maxlen=1000)
-        
-        # Load or train model
-        self._initialize_model()
+        self.recent_threats = RollingMean(10)
+        self.threat_events = 0
+    
+    @property
+    def is_trained(self) -> bool:
+        return self.active is not None
+    
+    @property
+    def model(self) -> Optional[IsolationForest]:
+        return self.active.model if self.active else None
+    
+    @property
+    def scaler(self) -> Optional[StandardScaler]:
+        return self.active.scaler if self.active else None
+    
+    @property
+    def pca(self) -> Optional[PCA]:
+        return self.active.pca if self.active else None
+    
+    @property
+    def forest(self) -> Optional[FlatIsolationForest]:
+        return self.active.forest if self.active else None
+    
+    @property
+    def projection(self) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        return self.active.projection if self.active else None
     
-    def _initialize_model(self):
-        """Initialize or load the threat detection model"""
+    @property
+    def model_version(self) -> Optional[str]:
+        return self.active.version if self.active else None
+    
+    def read_manifest(self) -> Optional[Dict]:
+        """The published model version, None when no version has been published"""
         try:
-            # Create models directory if it doesn't exist
-            os.makedirs('models', exist_ok=True)
-            
-            # Try to load existing model
-            if os.path.exists(self.model_path) and os.path.exists(self.scaler_path):
-                self.model = joblib.load(self.model_path)
-                self.scaler = joblib.load(self.scaler_path)
-                self.pca = joblib.load(self.pca_path)
-                self.is_trained = True
-                print("Loaded existing threat detection model")
-            else:
-                # Train new model with synthetic data
-                self._train_model_with_synthetic_data()
-                
+            with open(self.manifest_path) as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"Error reading model manifest: {e}")
+            return None
+    
+    def artifact_paths(self, version: Optional[str] = None) -> List[str]:
+        """Model, scaler and PCA paths of a version, by default the published one"""
+        if version is None:
+            version = (self.read_manifest() or {}).get('version')
+        # Models built before versioning sit directly in the model directory
+        directory = os.path.join(self.model_dir, 'versions', version) if version else self.model_dir
+        return [os.path.join(directory, name) for name in ARTIFACT_FILES]
+    
+    def has_artifacts(self) -> bool:
+        """Whether a built model is present in the model directory"""
+        return all(os.path.exists(path) for path in self.artifact_paths())
+    
+    def _ensure_model(self):
+        """Load the model artifacts on first use"""
+        if self.model_loaded:
+            return
+        with self.model_lock:
+            if not self.model_loaded:
+                self._load_model()
+                self.model_loaded = True
+    
+    def _load_model(self):
+        """Memory-map the built model, falling back to rule-based scoring when there is none
+        
+        With mmap_mode the arrays are read from the page cache, so every
+        worker on a host shares one copy instead of unpickling its own.
+        """
+        try:
+            if not self.has_artifacts():
+                print(f"No threat detection model in {self.model_dir}; using rule-based scoring "
+                      f"until one is built with 'python ai_threat.py build'")
+                return
+            self._load_version(self.read_manifest() or {})
+            
         except Exception as e:
-            print(f"Error initializing model: {e}")
-            self._train_model_with_synthetic_data()
+            print(f"Error loading model: {e}")
+    
+    def _load_version(self, manifest: Dict):
+        """Memory-map the artifacts of the version a manifest names and install them"""
+        paths = self.artifact_paths(manifest.get('version'))
+        model, scaler, pca = (joblib.load(path, mmap_mode='r') for path in paths)
+        self._install_model(model, scaler, pca, manifest)
+        print(f"Loaded threat detection model {manifest.get('version', '(unversioned)')}")
+    
+    def reload_if_changed(self) -> bool:
+        """Install the published version if this detector runs another one; True when it swapped"""
+        manifest = self.read_manifest()
+        if not manifest or manifest['version'] == self.model_version:
+            return False
+        with self.model_lock:
+            if manifest['version'] == self.model_version:
+                return False
+            self._load_version(manifest)
+            self.model_loaded = True
+        return True
+    
+    def _install_model(self, model, scaler, pca, manifest: Optional[Dict] = None):
+        """Make a fitted model the one used for scoring
+        
+        Everything scoring needs is derived first and then swapped in with one
+        assignment, so a concurrent score uses either the old model or the new
+        one and never waits for the swap.
+        """
+        forest = FlatIsolationForest.from_sklearn(model) if self.model_engine == 'flat' else None
+        projection = self._fuse_preprocessing(scaler, pca)
+        
+        # The fused map must reproduce the two transforms it replaces
+        probe = np.vstack([self._generate_normal_behavior_data(32, seed=0),
+                           self._generate_anomalous_behavior_data(8, seed=0)])
+        expected = pca.transform(scaler.transform(probe))
+        if not np.allclose(probe @ projection[0] + projection[1], expected, rtol=1e-9, atol=1e-9):
+            print("Fused preprocessing does not match the scaler and PCA; scoring with them directly")
+            projection = None
+        
+        manifest = manifest or {}
+        self.active = ActiveModel(model, scaler, pca, forest, projection,
+                                  manifest.get('version'), manifest.get('created_at'))
+    
+    @staticmethod
+    def _fuse_preprocessing(scaler, pca) -> Tuple[np.ndarray, np.ndarray]:
+        """Weights and bias with X @ weights + bias equal to pca.transform(scaler.transform(X))"""
+        n_features = pca.components_.shape[1]
+        shift = scaler.mean_ if scaler.with_mean else np.zeros(n_features)
+        scale = scaler.scale_ if scaler.with_std else np.ones(n_features)
+        components = pca.components_.T
+        if pca.whiten:
+            components = components / np.sqrt(pca.explained_variance_)
+        
+        weights = components / scale[:, None]
+        bias = -(shift / scale + pca.mean_) @ components
+        return np.ascontiguousarray(weights), bias
     
-    def _train_model_with_synthetic_data(self):
+    def transform_features(self, features: np.ndarray, active: Optional[ActiveModel] = None) -> np.ndarray:
+        """Scale and project feature rows the way the model was trained"""
+        active = active or self.active
+        if active.projection is not None:
+            weights, bias = active.projection
+            return np.asarray(features, dtype=float) @ weights + bias
+        return active.pca.transform(active.scaler.transform(features))
+    
+    @staticmethod
+    def _fit_model(X: np.ndarray) -> Tuple[IsolationForest, StandardScaler, PCA]:
+        """Fit a new scaler, PCA and isolation forest, leaving the model in use untouched"""
+        scaler = StandardScaler()
+        pca = PCA(n_components=10)
+        X_pca = pca.fit_transform(scaler.fit_transform(X))
+        
+        model = IsolationForest(
+            contamination=0.1,
+            random_state=42,
+            n_estimators=100
+        )
+        model.fit(X_pca)
+        return model, scaler, pca
+    
+    def _publish_model(self, model, scaler, pca, source: str, samples: int) -> Dict:
+        """Write the artifacts as a new version and point the manifest at it
+        
+        Artifacts are written uncompressed, which is what lets them be
+        memory-mapped, into a staging directory that is renamed into versions/
+        once complete; the manifest is then replaced by rename too, so a reader
+        following it never sees a partly written version. Only the newest
+        THREAT_MODEL_KEEP_VERSIONS versions are kept; a worker still mapping an
+        older one keeps its pages until it moves on.
+        """
+        created_at = datetime.utcnow()
+        version = f"{created_at:%Y%m%dT%H%M%S%f}-{uuid.uuid4().hex[:6]}"
+        versions_dir = os.path.join(self.model_dir, 'versions')
+        staging = os.path.join(versions_dir, f".{version}.tmp")
+        os.makedirs(staging)
+        for artifact, name in zip((model, scaler, pca), ARTIFACT_FILES):
+            joblib.dump(artifact, os.path.join(staging, name))
+        os.rename(staging, os.path.join(versions_dir, version))
+        
+        manifest = {'version': version, 'created_at': created_at.isoformat(), 'source': source, 'samples': samples}
+        staged_manifest = f"{self.manifest_path}.{version}.tmp"
+        with open(staged_manifest, 'w') as staged:
+            json.dump(manifest, staged)
+        os.replace(staged_manifest, self.manifest_path)
+        
+        # Version names start with their creation time, so they sort oldest first
+        versions = sorted(name for name in os.listdir(versions_dir) if not name.startswith('.') and name != version)
+        for old in versions[:len(versions) - self.keep_versions + 1]:
+            shutil.rmtree(os.path.join(versions_dir, old), ignore_errors=True)
+        return manifest
+    
+    def _train_model_with_synthetic_data(self, normal_samples: int = 1000, anomalous_samples: int = 200):
         """Train the model with synthetic data for initial deployment"""
         try:
             print("Training threat detection model with synthetic data...")
             
             # Generate synthetic training data
-            normal_data = self._generate_normal_behavior_data(1000)
-            anomalous_data = self._generate_anomalous_behavior_data(200)
+            normal_data = self._generate_normal_behavior_data(normal_samples)
+            anomalous_data = self._generate_anomalous_behavior_data(anomalous_samples)
             
             # Combine data
             X = np.vstack([normal_data, anomalous_data])
-            y = np.hstack([np.ones(len(normal_data)), -np.ones(len(anomalous_data))])
-            
-            # Preprocess data
-            X_scaled = self.scaler.fit_transform(X)
-            X_pca = self.pca.fit_transform(X_scaled)
             
-            # Train Isolation Forest
-            self.model = IsolationForest(
-                contamination=0.1,
-                random_state=42,
-                n_estimators=100
-            )
-            self.model.fit(X_pca)
+            # Scale, project and train the Isolation Forest
+            model, scaler, pca = self._fit_model(X)
             
             # Save models
-            joblib.dump(self.model, self.model_path)
-            joblib.dump(self.scaler, self.scaler_path)
-            joblib.dump(self.pca, self.pca_path)
+            manifest = self._publish_model(model, scaler, pca, 'synthetic', len(X))
+            self._install_model(model, scaler, pca, manifest)
             
-            self.is_trained = True
-            print("Threat detection model trained successfully")
+            self.model_loaded = True
+            print(f"Threat detection model {manifest['version']} trained successfully")
             
         except Exception as e:
+            # Scoring stays on the previous model, or the rules without one
             print(f"Error training model: {e}")
-            # Fallback to simple rule-based detection
-            self.is_trained = False
     
-    def _generate_normal_behavior_data(self, n_samples: int) -> np.ndarray:
-        """Generate synthetic normal behavior data"""
-        np.random.seed(42)
+    def _generate_normal_behavior_data(self, n_samples: int, seed: int = 42) -> np.ndarray:
+        """Generate synthetic normal behavior data, one vectorized draw per feature"""
+        rng = np.random.default_rng(seed)
         
-        # Normal behavior patterns
-        data = []
-        for _ in range(n_samples):
+        return np.column_stack([
             # Message frequency (messages per hour)
-            msg_freq = np.random.normal(5, 2)
-            msg_freq = max(0, msg_freq)
-            
+            np.maximum(0, rng.normal(5, 2, n_samples)),
             # Average message length
-            avg_length = np.random.normal(50, 20)
-            avg_length = max(10, avg_length)
-            
+            np.maximum(10, rng.normal(50, 20, n_samples)),
             # Time pattern (hour of day)
-            time_pattern = np.random.normal(12, 4)
-            time_pattern = max(0, min(23, time_pattern))
-            
+            np.clip(rng.normal(12, 4, n_samples), 0, 23),
             # Message length variance
-            length_variance = np.random.normal(100, 50)
-            length_variance = max(10, length_variance)
-            
+            np.maximum(10, rng.normal(100, 50, n_samples)),
             # Response time (seconds)
-            response_time = np.random.exponential(30)
-            
+            rng.exponential(30, n_samples),
             # Session duration (minutes)
-            session_duration = np.random.normal(30, 15)
-            session_duration = max(5, session_duration)
-            
+            np.maximum(5, rng.normal(30, 15, n_samples)),
             # Number of unique recipients
-            unique_recipients = np.random.poisson(3)
-            unique_recipients = max(1, unique_recipients)
-            
+            np.maximum(1, rng.poisson(3, n_samples)),
             # Login frequency (logins per day)
-            login_freq = np.random.normal(2, 1)
-            login_freq = max(0.5, login_freq)
-            
+            np.maximum(0.5, rng.normal(2, 1, n_samples)),
             # Geographic consistency (simulated)
-            geo_consistency = np.random.normal(0.8, 0.1)
-            geo_consistency = max(0, min(1, geo_consistency))
-            
+            np.clip(rng.normal(0.8, 0.1, n_samples), 0, 1),
             # Device consistency (simulated)
-            device_consistency = np.random.normal(0.9, 0.05)
-            device_consistency = max(0, min(1, device_consistency))
-            
-            data.append([
-                msg_freq, avg_length, time_pattern, length_variance,
-                response_time, session_duration, unique_recipients,
-                login_freq, geo_consistency, device_consistency
-            ])
-        
-        return np.array(data)
-    
-    def _generate_anomalous_behavior_data(self, n_samples: int) -> np.ndarray:
-        """Generate synthetic anomalous behavior data"""
-        np.random.seed(123)
-        
-        data = []
-        for _ in range(n_samples):
-            # Anomalous patterns
-            anomaly_type = np.random.choice(['high_freq', 'unusual_time', 'bot_like', 'suspicious_content'])
-            
-            if anomaly_type == 'high_freq':
-                # Extremely high message frequency
-                msg_freq = np.random.normal(50, 10)
-                avg_length = np.random.normal(20, 5)
-                time_pattern = np.random.normal(12, 2)
-                length_variance = np.random.normal(50, 10)
-                response_time = np.random.exponential(1)
-                session_duration = np.random.normal(5, 2)
-                unique_recipients = np.random.poisson(20)
-                login_freq = np.random.normal(10, 2)
-                geo_consistency = np.random.normal(0.3, 0.1)
-                device_consistency = np.random.normal(0.4, 0.1)
-                
-            elif anomaly_type == 'unusual_time':
-                # Unusual time patterns
-                msg_freq = np.random.normal(2, 1)
-                avg_length = np.random.normal(100, 30)
-                time_pattern = np.random.choice([2, 3, 4, 22, 23])  # Very early/late hours
-                length_variance = np.random.normal(200, 50)
-                response_time = np.random.exponential(300)
-                session_duration = np.random.normal(120, 30)
-                unique_recipients = np.random.poisson(1)
-                login_freq = np.random.normal(0.5, 0.2)
-                geo_consistency = np.random.normal(0.2, 0.1)
-                device_consistency = np.random.normal(0.3, 0.1)
-                
-            elif anomaly_type == 'bot_like':
-                # Bot-like behavior
-                msg_freq = np.random.normal(30, 5)
-                avg_length = np.random.normal(15, 3)
-                time_pattern = np.random.normal(12, 1)
-                length_variance = np.random.normal(10, 2)
-                response_time = np.random.exponential(0.1)
-                session_duration = np.random.normal(2, 0.5)
-                unique_recipients = np.random.poisson(50)
-                login_freq = np.random.normal(20, 5)
-                geo_consistency = np.random.normal(0.1, 0.05)
-                device_consistency = np.random.normal(0.95, 0.02)
-                
-            else:  # suspicious_content
-                # Suspicious content patterns
-                msg_freq = np.random.normal(8, 3)
-                avg_length = np.random.normal(200, 50)
-                time_pattern = np.random.normal(12, 3)
-                length_variance = np.random.normal(500, 100)
-                response_time = np.random.exponential(60)
-                session_duration = np.random.normal(15, 5)
-                unique_recipients = np.random.poisson(2)
-                login_freq = np.random.normal(1, 0.5)
-                geo_consistency = np.random.normal(0.4, 0.2)
-                device_consistency = np.random.normal(0.6, 0.2)
-            
-            # Ensure positive values
-            msg_freq = max(0, msg_freq)
-            avg_length = max(5, avg_length)
-            time_pattern = max(0, min(23, time_pattern))
-            length_variance = max(5, length_variance)
-            response_time = max(0.1, response_time)
-            session_duration = max(1, session_duration)
-            unique_recipients = max(1, unique_recipients)
-            login_freq = max(0.1, login_freq)
-            geo_consistency = max(0, min(1, geo_consistency))
-            device_consistency = max(0, min(1, device_consistency))
-            
-            data.append([
-                msg_freq, avg_length, time_pattern, length_variance,
-                response_time, session_duration, unique_recipients,
-                login_freq, geo_consistency, device_consistency
-            ])
+            np.clip(rng.normal(0.9, 0.05, n_samples), 0, 1)
+        ])
+    
+    def _generate_anomalous_behavior_data(self, n_samples: int, seed: int = 123) -> np.ndarray:
+        """Generate synthetic anomalous behavior data
+        
+        Each row draws an anomaly type; every feature is then drawn for all rows
+        at once from the parameters of the row's type.
+        """
+        rng = np.random.default_rng(seed)
+        types = rng.integers(len(ANOMALY_TYPES), size=n_samples)
+        
+        def normal(params):
+            mean, std = np.asarray(params, dtype=float).T
+            return rng.normal(mean[types], std[types])
         
-        return np.array(data)
+        def exponential(scales):
+            return rng.exponential(np.asarray(scales, dtype=float)[types])
+        
+        def poisson(rates):
+            return rng.poisson(np.asarray(rates, dtype=float)[types])
+        
+        # Parameters are listed in ANOMALY_TYPES order: high_freq, unusual_time,
+        # bot_like, suspicious_content
+        msg_freq = normal([(50, 10), (2, 1), (30, 5), (8, 3)])
+        avg_length = normal([(20, 5), (100, 30), (15, 3), (200, 50)])
+        time_pattern = normal([(12, 2), (0, 0), (12, 1), (12, 3)])
+        unusual_time = types == ANOMALY_TYPES.index('unusual_time')
+        # Very early/late hours
+        time_pattern[unusual_time] = rng.choice([2, 3, 4, 22, 23], size=int(unusual_time.sum()))
+        length_variance = normal([(50, 10), (200, 50), (10, 2), (500, 100)])
+        response_time = exponential([1, 300, 0.1, 60])
+        session_duration = normal([(5, 2), (120, 30), (2, 0.5), (15, 5)])
+        unique_recipients = poisson([20, 1, 50, 2])
+        login_freq = normal([(10, 2), (0.5, 0.2), (20, 5), (1, 0.5)])
+        geo_consistency = normal([(0.3, 0.1), (0.2, 0.1), (0.1, 0.05), (0.4, 0.2)])
+        device_consistency = normal([(0.4, 0.1), (0.3, 0.1), (0.95, 0.02), (0.6, 0.2)])
+        
+        # Ensure positive values
+        return np.column_stack([
+            np.maximum(0, msg_freq),
+            np.maximum(5, avg_length),
+            np.clip(time_pattern, 0, 23),
+            np.maximum(5, length_variance),
+            np.maximum(0.1, response_time),
+            np.maximum(1, session_duration),
+            np.maximum(1, unique_recipients),
+            np.maximum(0.1, login_freq),
+            np.clip(geo_consistency, 0, 1),
+            np.clip(device_consistency, 0, 1)
+        ])
     
     def analyze_message_metadata(self, sender_id: str, recipient_id: str, 
                                message_length: int, timestamp: datetime) -> float:
         """Analyze message metadata for threat detection"""
         try:
-            # Update user behavior tracking
-            self._update_user_behavior(sender_id, message_length, timestamp)
-            
-            # Extract features
-            features = self._extract_features(sender_id, recipient_id, message_length, timestamp)
-            
-            if not self.is_trained:
-                # Fallback to rule-based detection
-                return self._rule_based_threat_score(features)
-            
-            # Use ML model for prediction
-            features_scaled = self.scaler.transform([features])
-            features_pca = self.pca.transform(features_scaled)
-            
-            # Get anomaly score
-            anomaly_score = self.model.decision_function(features_pca)[0]
-            
-            # Convert to threat score (0-100)
-            threat_score = max(0, min(100, (1 - anomaly_score) * 50))
-            
-            # Update global threat level
-            self._update_global_threat_level(threat_score)
-            
-            return threat_score
+            return self.submit_message_metadata(sender_id, recipient_id, message_length, timestamp).result()
             
         except Exception as e:
             print(f"Error analyzing message metadata: {e}")
             return 0.0
     
+    def submit_message_metadata(self, sender_id: str, recipient_id: str, message_length: int,
+                                timestamp: datetime, track_behavior: bool = True) -> Future:
+        """Track a message and queue its score; the future resolves to the threat score
+        
+        Pass track_behavior=False for a message already recorded through record_messages.
+        """
+        self._ensure_model()
+        
+        # Update user behavior tracking
+        if track_behavior:
+            self._update_user_behavior(sender_id, message_length, timestamp)
+        
+        # Extract features
+        features = self._extract_features(sender_id, recipient_id, message_length, timestamp)
+        self.reservoir.add(features)
+        
+        if not self.is_trained:
+            # Fallback to rule-based detection
+            future = Future()
+            future.set_result(self._rule_based_threat_score(features))
+            return future
+        
+        # Use ML model for prediction, batched with concurrent sends
+        future = self.batch_scorer.submit(features)
+        
+        # Update global threat level
+        future.add_done_callback(lambda done: done.exception() or self._update_global_threat_level(done.result()))
+        
+        return future
+    
     def analyze_user_activity(self, user_id: str, messages: List[Dict]) -> float:
         """Analyze overall user activity for threat assessment"""
         try:
             if not messages:
                 return 0.0
             
+            self._ensure_model()
+            
             # Calculate activity metrics
             total_messages = len(messages)
             avg_message_length = np.mean([len(msg.get('content', '')) for msg in messages])
@@ -313,10 +457,7 @@ class ThreatDetector:
             ]
             
             if self.is_trained:
-                features_scaled = self.scaler.transform([features])
-                features_pca = self.pca.transform(features_scaled)
-                anomaly_score = self.model.decision_function(features_pca)[0]
-                threat_score = max(0, min(100, (1 - anomaly_score) * 50))
+                threat_score = self.batch_scorer.score(features)
             else:
                 threat_score = self._rule_based_threat_score(features)
             
@@ -326,48 +467,127 @@ class ThreatDetector:
             print(f"Error analyzing user activity: {e}")
             return 0.0
     
-    def _update_user_behavior(self, user_id: str, message_length: int, timestamp: datetime):
-        """Update user behavior tracking"""
+    def analyze_users_activity(self, activity: Dict[str, List[Dict]]) -> Dict[str, float]:
+        """Score many users' recent activity with one model call
+        
+        ``activity`` maps users to their latest messages, newest first, as
+        returned by get_users_recent_activity. Scores match analyze_user_activity
+        on the same messages.
+        """
         try:
-            behavior = self.user_behavior[user_id]
+            user_ids = [user_id for user_id, messages in activity.items() if messages]
+            if not user_ids:
+                return {}
             
-            # Update message frequency (messages per hour)
-            current_hour = timestamp.hour
-            behavior['message_frequency'].append(current_hour)
+            self._ensure_model()
+            features = self._activity_features([activity[user_id] for user_id in user_ids])
             
-            # Update message lengths
-            behavior['message_lengths'].append(message_length)
+            if self.is_trained:
+                threat_scores = self.score_features(features)
+            else:
+                threat_scores = [self._rule_based_threat_score(list(row)) for row in features]
+            
+            return {user_id: float(score) for user_id, score in zip(user_ids, threat_scores)}
             
-            # Update time patterns
-            behavior['time_patterns'].append(current_hour)
+        except Exception as e:
+            print(f"Error analyzing users activity: {e}")
+            return {}
+    
+    @staticmethod
+    def _activity_features(activities: List[List[Dict]]) -> np.ndarray:
+        """Activity feature rows for many users, built from per-user sums over all their messages at once"""
+        counts = np.array([len(messages) for messages in activities])
+        owner = np.repeat(np.arange(len(activities)), counts)
+        messages = [message for user_messages in activities for message in user_messages]
+        users = len(activities)
+        
+        lengths = np.array([message['content_length'] for message in messages], dtype=float)
+        micros = np.array([message['timestamp'] for message in messages], dtype='datetime64[us]').astype(np.int64)
+        hours = (micros // 3_600_000_000 % 24).astype(float)
+        _, recipients = np.unique([str(message['recipient_id']) for message in messages], return_inverse=True)
+        
+        # Averages and the population variance of the hour of day
+        avg_message_length = np.bincount(owner, lengths, users) / counts
+        mean_hour = np.bincount(owner, hours, users) / counts
+        time_variance = np.maximum(np.bincount(owner, hours ** 2, users) / counts - mean_hour ** 2, 0)
+        
+        # Distinct (user, recipient) pairs per user
+        stride = recipients.max() + 1
+        pairs = np.unique(owner * stride + recipients)
+        unique_recipients = np.bincount(pairs // stride, minlength=users)
+        
+        # Mean gap between consecutive messages: newest to oldest over n - 1 gaps
+        first = np.cumsum(counts) - counts
+        span = (micros[first + counts - 1] - micros[first]) / 1e6
+        avg_frequency = np.where(counts > 1, span / np.maximum(counts - 1, 1), 0)
+        
+        defaults = np.tile([0.8, 0.9, 2.0, 30.0, 100.0], (users, 1))
+        return np.column_stack([
+            counts / 10,
+            avg_message_length / 100,
+            time_variance / 100,
+            unique_recipients / 10,
+            avg_frequency / 3600,
+            defaults
+        ])
+    
+    def score_features(self, features: np.ndarray) -> np.ndarray:
+        """Threat scores (0-100) for a matrix of feature rows in one vectorized pass"""
+        # One model for the whole batch, even if a new version is swapped in meanwhile
+        active = self.active
+        features_pca = self.transform_features(features, active)
+        if active.forest is not None and len(features_pca) <= self.flat_max_batch:
+            anomaly_scores = active.forest.decision_function(features_pca)
+        else:
+            anomaly_scores = active.model.decision_function(features_pca)
+        return np.clip((1 - anomaly_scores) * 50, 0, 100)
+    
+    def _update_user_behavior(self, user_id: str, message_length: int, timestamp: datetime):
+        """Update user behavior tracking"""
+        try:
+            # Message count, running length statistics and last activity
+            self.behavior.record(user_id, message_length, timestamp)
             
-            # Update last activity
-            behavior['last_activity'] = timestamp
+        except Exception as e:
+            print(f"Error updating user behavior: {e}")
+    
+    def record_messages(self, messages: List[Tuple[str, int, datetime]]):
+        """Track a batch of (sender_id, message_length, timestamp) records in one behavior store write"""
+        try:
+            self.behavior.record_many(messages)
             
         except Exception as e:
             print(f"Error updating user behavior: {e}")
     
+    def mark_suspicious(self, user_id: str):
+        """Count a message scored above the threat threshold against its sender"""
+        try:
+            self.behavior.mark_suspicious(user_id)
+            
+        except Exception as e:
+            print(f"Error marking user suspicious: {e}")
+    
     def _extract_features(self, sender_id: str, recipient_id: str, 
                          message_length: int, timestamp: datetime) -> List[float]:
         """Extract features for threat detection"""
         try:
-            behavior = self.user_behavior[sender_id]
+            message_count, mean_length, variance, last_activity = self.behavior.window_stats(sender_id)
             
             # Message frequency (messages per hour)
-            if len(behavior['message_frequency']) > 1:
-                msg_freq = len(behavior['message_frequency']) / max(1, 
-                    (timestamp - behavior['last_activity']).total_seconds() / 3600)
+            if message_count > 1:
+                msg_freq = message_count / max(1, 
+                    (timestamp - last_activity).total_seconds() / 3600)
             else:
                 msg_freq = 1.0
             
             # Average message length
-            avg_length = np.mean(behavior['message_lengths']) if behavior['message_lengths'] else message_length
+            avg_length = mean_length if message_count else message_length
             
             # Time pattern (current hour)
             time_pattern = timestamp.hour
             
             # Message length variance
-            length_variance = np.var(behavior['message_lengths']) if len(behavior['message_lengths']) > 1 else 0
+            length_variance = variance
             
             # Response time (simulated)
             response_time = 30.0  # Default response time
@@ -446,13 +666,10 @@ class ThreatDetector:
     def _update_global_threat_level(self, threat_score: float):
         """Update global threat level"""
         try:
-            self.threat_history.append(threat_score)
+            self.threat_events += 1
             
-            # Calculate rolling average
-            if len(self.threat_history) > 10:
-                self.global_threat_level = np.mean(list(self.threat_history)[-10:])
-            else:
-                self.global_threat_level = np.mean(list(self.threat_history))
+            # Rolling average of the last 10 scores
+            self.global_threat_level = self.recent_threats.add(threat_score)
                 
         except Exception as e:
             print(f"Error updating global threat level: {e}")
@@ -464,15 +681,15 @@ class ThreatDetector:
     def get_user_threat_summary(self, user_id: str) -> Dict[str, Any]:
         """Get threat summary for a specific user"""
         try:
-            behavior = self.user_behavior[user_id]
+            behavior = self.behavior.summary(user_id)
             
             return {
                 'user_id': user_id,
-                'message_count': len(behavior['message_frequency']),
-                'avg_message_length': np.mean(behavior['message_lengths']) if behavior['message_lengths'] else 0,
+                'message_count': behavior['message_count'],
+                'avg_message_length': behavior['avg_message_length'],
                 'suspicious_count': behavior['suspicious_count'],
                 'last_activity': behavior['last_activity'].isoformat() if behavior['last_activity'] else None,
-                'unique_ips': len(behavior['ip_addresses']),
+                'unique_ips': 0,  # IP addresses are not tracked
                 'threat_level': 'HIGH' if behavior['suspicious_count'] > 5 else 'MEDIUM' if behavior['suspicious_count'] > 2 else 'LOW'
             }
             
@@ -480,50 +697,62 @@ class ThreatDetector:
             print(f"Error getting user threat summary: {e}")
             return {'user_id': user_id, 'threat_level': 'UNKNOWN'}
     
-    def retrain_model(self, new_data: List[Dict]):
-        """Retrain model with new data"""
+    def _check_model(self, model, scaler, pca) -> Optional[str]:
+        """Why a candidate model must not replace the current one, None when it passes"""
+        def flagged(X: np.ndarray) -> float:
+            return float((model.decision_function(pca.transform(scaler.transform(X))) < 0).mean())
+        
+        # Seeds differ from the training baseline's, so these rows are held out
+        recall = flagged(self._generate_anomalous_behavior_data(500, seed=7))
+        false_positives = flagged(self._generate_normal_behavior_data(500, seed=8))
+        if recall < self.retrain_min_recall:
+            return f"flags {recall:.0%} of synthetic anomalies, {self.retrain_min_recall:.0%} required"
+        if false_positives > self.retrain_max_false_positives:
+            return f"flags {false_positives:.0%} of synthetic normal behavior, " \
+                   f"{self.retrain_max_false_positives:.0%} allowed"
+        return None
+    
+    def retrain_model(self, new_data: Optional[List[Dict]] = None) -> bool:
+        """Retrain on the sampled feature rows of recent messages plus new_data
+        
+        The sample is mixed with the synthetic baseline the model is built
+        from, since live rows alone leave most context features constant. The
+        new model is fitted on fresh objects while scoring carries on with
+        the current one, and is only published and swapped in if it still
+        separates held-out synthetic anomalies from normal behavior. It fits
+        on the calling thread; ModelRetrainer runs it in the background.
+        """
         try:
-            if not new_data:
-                return False
-            
             # Extract features from new data
-            X_new = []
-            for data_point in new_data:
-                features = self._extract_features(
+            for data_point in new_data or []:
+                self.reservoir.add(self._extract_features(
                     data_point['sender_id'],
                     data_point['recipient_id'],
                     data_point['message_length'],
                     data_point['timestamp']
-                )
-                X_new.append(features)
-            
-            X_new = np.array(X_new)
+                ))
             
-            # Combine with existing data
-            if self.is_trained:
-                # Load existing training data (simplified)
-                X_existing = self._generate_normal_behavior_data(500)
-                X_combined = np.vstack([X_existing, X_new])
-            else:
-                X_combined = X_new
+            X = self.reservoir.sample()
+            if len(X) < self.retrain_min_samples:
+                print(f"Not retraining: {len(X)} sampled messages, {self.retrain_min_samples} needed")
+                return False
             
             # Retrain model
-            X_scaled = self.scaler.fit_transform(X_combined)
-            X_pca = self.pca.fit_transform(X_scaled)
+            baseline = np.vstack([self._generate_normal_behavior_data(1000),
+                                  self._generate_anomalous_behavior_data(200)])
+            model, scaler, pca = self._fit_model(np.vstack([X, baseline]))
             
-            self.model = IsolationForest(
-                contamination=0.1,
-                random_state=42,
-                n_estimators=100
-            )
-            self.model.fit(X_pca)
+            problem = self._check_model(model, scaler, pca)
+            if problem:
+                print(f"Discarding retrained model: it {problem}")
+                return False
             
             # Save updated model
-            joblib.dump(self.model, self.model_path)
-            joblib.dump(self.scaler, self.scaler_path)
-            joblib.dump(self.pca, self.pca_path)
+            manifest = self._publish_model(model, scaler, pca, 'reservoir', len(X))
+            self._install_model(model, scaler, pca, manifest)
+            self.model_loaded = True
             
-            print("Model retrained successfully")
+            print(f"Model retrained successfully as {manifest['version']}")
             return True
             
         except Exception as e:
@@ -535,14 +764,67 @@ class ThreatDetector:
         try:
             return {
                 'is_trained': self.is_trained,
+                'model_loaded': self.model_loaded,
+                'model_dir': self.model_dir,
+                'batching': self.batch_scorer.get_statistics(),
                 'model_type': 'Isolation Forest',
+                'model_engine': self.model_engine,
+                'model_version': self.model_version,
                 'global_threat_level': self.global_threat_level,
-                'total_threat_events': len(self.threat_history),
-                'tracked_users': len(self.user_behavior),
+                'total_threat_events': self.threat_events,
+                'tracked_users': len(self.behavior),
+                'behavior_store': self.behavior.get_statistics(),
                 'model_accuracy': 'N/A (unsupervised)',
-                'last_retrain': datetime.utcnow().isoformat()
+                'last_retrain': self.active.created_at if self.active else None,
+                'retraining_samples': len(self.reservoir)
             }
             
         except Exception as e:
             print(f"Error getting model statistics: {e}")
             return {'error': str(e)}
+
+_detector = None
+_detector_lock = threading.Lock()
+
+def get_threat_detector() -> ThreatDetector:
+    """Process-wide detector shared by the app and blueprints; its model loads on the first score"""
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            behavior = None
+            # Workers share behavior through the storage backend unless THREAT_BEHAVIOR_STORE=memory
+            if os.getenv('THREAT_BEHAVIOR_STORE', 'shared').lower() == 'shared':
+                from storage_backend import create_database
+                behavior = SharedBehaviorStore(
+                    create_database(),
+                    cache_ttl=float(os.getenv('THREAT_BEHAVIOR_CACHE_TTL', 1)),
+                    max_cached=int(os.getenv('THREAT_BEHAVIOR_MAX_USERS', 50000))
+                )
+            _detector = ThreatDetector(behavior=behavior)
+        return _detector
+
+def build_model(model_dir: Optional[str] = None, force: bool = False,
+                normal_samples: int = 1000, anomalous_samples: int = 200) -> bool:
+    """Train the model on synthetic data and write its artifacts
+    
+    This is the only path that trains at deploy time; run it once per host
+    before the workers start. Existing artifacts are kept unless forced.
+    """
+    detector = ThreatDetector(model_dir)
+    if detector.has_artifacts() and not force:
+        print(f"Threat detection model already built in {detector.model_dir}")
+        return True
+    detector._train_model_with_synthetic_data(normal_samples, anomalous_samples)
+    return detector.is_trained
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TacticalLink threat detection model")
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--model-dir', default=None, help='defaults to THREAT_MODEL_DIR or ./models')
+    parser.add_argument('--force', action='store_true', help='rebuild even if a model is already built')
+    parser.add_argument('--normal-samples', type=int, default=1000)
+    parser.add_argument('--anomalous-samples', type=int, default=200)
+    args = parser.parse_args()
+    
+    built = build_model(args.model_dir, args.force, args.normal_samples, args.anomalous_samples)
+    raise SystemExit(0 if built else 1)
@@ -15,11 +15,15 @@ import threading
 import time
 
 # Import our modules
-from database import Database
+from storage_backend import create_database
 from encryption import EncryptionManager
-from ai_threat import ThreatDetector
-from message_scheduler import MessageScheduler
-from models import User, Message, ThreatLog
+from ai_threat import get_threat_detector
+from message_scheduler import get_message_scheduler
+from message_delivery import delivery_hub
+from model_retraining import ModelRetrainer
+from presence import PresenceCoalescer
+from threat_scoring import ThreatSweep, get_threat_pipeline
+from models import User, Message
 
 
 # Load environment variables
@@ -35,10 +39,26 @@ jwt = JWTManager(app)
 CORS(app)
 
 # Initialize components
-db = Database()
+db = create_database()
 encryption_manager = EncryptionManager()
-threat_detector = ThreatDetector()
-message_scheduler = MessageScheduler()
+threat_detector = get_threat_detector()
+threat_pipeline = get_threat_pipeline()
+threat_sweep = ThreatSweep(db, threat_detector)
+message_scheduler = get_message_scheduler()
+delivery_hub.attach(db)
+delivery_hub.attach(message_scheduler.db)
+
+# Every worker runs the scheduler; expired messages and each round of the cleanup jobs are shared out through leases
+message_scheduler.start()
+
+# Every worker follows the published threat model; one per round retrains it
+model_retrainer = ModelRetrainer(
+    threat_detector, db,
+    retrain_interval=float(os.getenv('AI_MODEL_RETRAIN_INTERVAL', 86400)),
+    poll_interval=float(os.getenv('THREAT_MODEL_POLL_INTERVAL', 30))
+)
+model_retrainer.start()
+presence = PresenceCoalescer(db, flush_interval=float(os.getenv('PRESENCE_FLUSH_INTERVAL', 10)))
 
 # Global variables for real-time threat monitoring
 threat_scores = {}
@@ -109,8 +129,8 @@ def login():
         if not user:
             return jsonify({'error': 'Invalid credentials'}), 401
         
-        # Update last login
-        db.update_last_login(user['_id'])
+        # Record last login (flushed in bulk by the presence coalescer)
+        presence.record_login(user['_id'])
         
         # Add to active users
         active_users.add(user['_id'])
@@ -146,6 +166,8 @@ def send_message():
         if not recipient_id or not message_content:
             return jsonify({'error': 'Missing required fields'}), 400
         
+        presence.record_activity(current_user_id)
+        
         # Get recipient's public key
         recipient = db.get_user_by_id(recipient_id)
         if not recipient:
@@ -177,28 +199,22 @@ def send_message():
                 message_id, self_destruct_time, read_once
             )
         
-        # AI Threat Detection
-        threat_score = threat_detector.analyze_message_metadata(
+        # AI Threat Detection runs off the send path; reply with the sender's
+        # last scored message and let the pipeline log threats
+        threat_score = threat_pipeline.provisional_score(current_user_id)
+        threat_pipeline.enqueue(
             sender_id=current_user_id,
             recipient_id=recipient_id,
             message_length=len(message_content),
-            timestamp=datetime.utcnow()
+            reason="High message frequency or suspicious pattern",
+            message_id=message_id
         )
         
-        # Log threat if score is high
-        if threat_score > 70:
-            threat_log = ThreatLog(
-                user_id=current_user_id,
-                threat_score=threat_score,
-                reason="High message frequency or suspicious pattern",
-                timestamp=datetime.utcnow()
-            )
-            db.create_threat_log(threat_log)
-        
         return jsonify({
             'message': 'Message sent successfully',
             'message_id': message_id,
-            'threat_score': threat_score
+            'threat_score': threat_score,
+            'threat_score_provisional': True
         }), 201
         
     except Exception as e:
@@ -256,6 +272,25 @@ def receive_messages():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/chat/events', methods=['GET'])
+@jwt_required()
+def poll_message_events():
+    """Long-poll for new and deleted message events"""
+    try:
+        current_user_id = get_jwt_identity()
+        after = request.args.get('after')
+        timeout = min(request.args.get('timeout', 25, type=float), 55)
+        
+        presence.record_activity(current_user_id)
+        result = delivery_hub.wait_for_events(current_user_id, after, timeout)
+        if result is None:
+            # No free long-poll slot on this worker; the client reloads and retries later
+            return '', 204, {'Retry-After': os.getenv('MESSAGE_POLL_RETRY_SECONDS', '5')}
+        return jsonify(result), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # Self-destruct endpoint
 @app.route('/delete/message/<message_id>', methods=['DELETE'])
 @jwt_required()
@@ -341,6 +376,91 @@ def admin_dashboard():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/admin/metrics/destruction', methods=['GET'])
+@jwt_required()
+def destruction_metrics():
+    """Get self-destruct lag metrics for this worker"""
+    try:
+        current_user_id = get_jwt_identity()
+        
+        user = db.get_user_by_id(current_user_id)
+        if not user or not user.get('is_admin', False):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify(message_scheduler.get_destruction_metrics()), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/metrics/threat-scoring', methods=['GET'])
+@jwt_required()
+def threat_scoring_metrics():
+    """Get threat scoring queue depth and lag for this worker"""
+    try:
+        current_user_id = get_jwt_identity()
+        
+        user = db.get_user_by_id(current_user_id)
+        if not user or not user.get('is_admin', False):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        return jsonify({
+            **threat_pipeline.get_statistics(),
+            'sweep': threat_sweep.get_statistics(),
+            'retraining': model_retrainer.get_statistics()
+        }), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/threat-logs/<log_id>/resolve', methods=['POST'])
+@jwt_required()
+def resolve_threat_log(log_id):
+    """Mark a threat log resolved"""
+    try:
+        current_user_id = get_jwt_identity()
+        
+        user = db.get_user_by_id(current_user_id)
+        if not user or not user.get('is_admin', False):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        if not db.resolve_threat_log(log_id, current_user_id):
+            return jsonify({'error': 'Threat log not found or already resolved'}), 404
+        
+        return jsonify({'message': 'Threat log resolved', 'log_id': log_id}), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/admin/destruction-queue', methods=['GET'])
+@jwt_required()
+def destruction_queue():
+    """Page through or summarize messages awaiting self-destruction"""
+    try:
+        current_user_id = get_jwt_identity()
+        
+        user = db.get_user_by_id(current_user_id)
+        if not user or not user.get('is_admin', False):
+            return jsonify({'error': 'Admin access required'}), 403
+        
+        sender_id = request.args.get('sender_id')
+        recipient_id = request.args.get('recipient_id')
+        
+        # ?summary=<seconds> returns counts per time bucket instead of messages
+        summary = request.args.get('summary', type=int)
+        if summary:
+            return jsonify({
+                'bucket_seconds': summary,
+                'buckets': message_scheduler.summarize_destruction_queue(summary, sender_id, recipient_id)
+            }), 200
+        
+        limit = min(max(request.args.get('limit', 100, type=int), 1), 1000)
+        return jsonify(message_scheduler.get_destruction_queue(
+            limit, request.args.get('cursor'), sender_id, recipient_id
+        )), 200
+        
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/chat/conversation/<recipient_id>', methods=['GET'])
 @jwt_required()
 def get_conversation(recipient_id):
@@ -473,27 +593,14 @@ def websocket_status():
 # Background task for threat monitoring
 def threat_monitoring_task():
     """Background task for continuous threat monitoring"""
+    interval = float(os.getenv('THREAT_ANALYSIS_INTERVAL', 30))
     while True:
         try:
-            # Analyze all active users
-            for user_id in active_users.copy():
-                recent_messages = db.get_user_recent_messages(user_id, limit=10)
-                threat_score = threat_detector.analyze_user_activity(
-                    user_id, recent_messages
-                )
-                threat_scores[user_id] = threat_score
-                
-                # Log high threat scores
-                if threat_score > 80:
-                    threat_log = ThreatLog(
-                        user_id=user_id,
-                        threat_score=threat_score,
-                        reason="Automated threat detection - high risk",
-                        timestamp=datetime.utcnow()
-                    )
-                    db.create_threat_log(threat_log)
+            # Analyze all active users with one query and one model call;
+            # the sweep logs high threat scores
+            threat_scores.update(threat_sweep.run(active_users.copy()))
             
-            time.sleep(30)  # Check every 30 seconds
+            time.sleep(interval)
             
         except Exception as e:
             print(f"Error in threat monitoring: {e}")
@@ -505,9 +612,6 @@ if __name__ == '__main__':
     threat_thread = threading.Thread(target=threat_monitoring_task, daemon=True)
     threat_thread.start()
     
-    # Start message scheduler
-    message_scheduler.start()
-    
     # Run Flask app
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port, debug=True)
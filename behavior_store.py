@@ -0,0 +1,286 @@
+"""
+TacticalLink Behavior Store
+Fixed-memory per-user message statistics for threat feature extraction
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+EPOCH = datetime(1970, 1, 1)
+
+def _micros(timestamp: datetime) -> int:
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+class BehaviorStore:
+    """Sliding-window message length statistics per user in preallocated arrays
+    
+    Every tracked user owns one row of a (max_users, window) ring buffer of
+    message lengths, next to a running count, mean and sum of squared
+    deviations (Welford, with the value leaving the window removed). Recording
+    a message and reading the mean and variance are O(1); the running values
+    are recomputed from the row each time it wraps so rounding cannot drift.
+    
+    Rows are reused in least-recently-active order. Users idle for longer than
+    idle_seconds are evicted as new users arrive, and once all max_users rows
+    are taken the least recently active user gives up its row, so memory stays
+    fixed. The arrays are zero-filled, so rows never used cost no resident memory.
+    """
+    
+    def __init__(self, max_users: int = 50000, window: int = 100, idle_seconds: float = 86400):
+        self.max_users = max_users
+        self.window = window
+        self.idle_micros = int(idle_seconds * 1_000_000)
+        self.lengths = np.zeros((max_users, window), dtype=np.float32)
+        self.counts = np.zeros(max_users, dtype=np.int32)
+        self.heads = np.zeros(max_users, dtype=np.int32)
+        self.means = np.zeros(max_users)
+        self.m2 = np.zeros(max_users)
+        self.last_activity = np.zeros(max_users, dtype=np.int64)
+        self.suspicious = np.zeros(max_users, dtype=np.int32)
+        # user_id -> row, least recently active first
+        self.rows = OrderedDict()
+        self.free_rows = list(range(max_users - 1, -1, -1))
+        self.lock = threading.Lock()
+        self.stats = {'evicted_idle': 0, 'evicted_lru': 0}
+    
+    def __len__(self) -> int:
+        return len(self.rows)
+    
+    def record(self, user_id: str, message_length: int, timestamp: datetime):
+        """Add a message to a user's window"""
+        now = _micros(timestamp)
+        value = float(message_length)
+        with self.lock:
+            row = self._row(user_id, now)
+            count, head = int(self.counts[row]), int(self.heads[row])
+            mean, m2 = float(self.means[row]), float(self.m2[row])
+            
+            if count < self.window:
+                count += 1
+                delta = value - mean
+                mean += delta / count
+                m2 += delta * (value - mean)
+            else:
+                # Replace the oldest value in place
+                oldest, previous_mean = float(self.lengths[row, head]), mean
+                mean += (value - oldest) / count
+                m2 += (value - oldest) * (value - mean + oldest - previous_mean)
+            
+            self.lengths[row, head] = value
+            head = (head + 1) % self.window
+            if head == 0:
+                values = self.lengths[row, :count].astype(float)
+                mean = float(values.mean())
+                m2 = float(((values - mean) ** 2).sum())
+            
+            self.counts[row], self.heads[row] = count, head
+            self.means[row], self.m2[row] = mean, m2
+            self.last_activity[row] = now
+            self.rows.move_to_end(user_id)
+    
+    def record_many(self, messages: List[Tuple[str, int, datetime]]):
+        """Add (user_id, message_length, timestamp) records to their users' windows in order"""
+        for user_id, message_length, timestamp in messages:
+            self.record(user_id, message_length, timestamp)
+    
+    def mark_suspicious(self, user_id: str):
+        """Count a suspicious event against a tracked user"""
+        with self.lock:
+            row = self.rows.get(user_id)
+            if row is not None:
+                self.suspicious[row] += 1
+    
+    def window_stats(self, user_id: str) -> Tuple[int, Optional[float], float, Optional[datetime]]:
+        """(messages in window, mean length, population variance of length, last activity) of a user"""
+        with self.lock:
+            row = self.rows.get(user_id)
+            if row is None:
+                return 0, None, 0.0, None
+            count = int(self.counts[row])
+            variance = max(float(self.m2[row]) / count, 0.0) if count > 1 else 0.0
+            return count, float(self.means[row]), variance, self._last_activity(row)
+    
+    def summary(self, user_id: str) -> Dict:
+        """Message count, mean length, suspicious events and last activity of a user"""
+        with self.lock:
+            row = self.rows.get(user_id)
+            if row is None:
+                return {'message_count': 0, 'avg_message_length': 0, 'suspicious_count': 0, 'last_activity': None}
+            return {
+                'message_count': int(self.counts[row]),
+                'avg_message_length': float(self.means[row]),
+                'suspicious_count': int(self.suspicious[row]),
+                'last_activity': self._last_activity(row)
+            }
+    
+    def _last_activity(self, row: int) -> datetime:
+        return EPOCH + timedelta(microseconds=int(self.last_activity[row]))
+    
+    def _row(self, user_id: str, now: int) -> int:
+        """Row of a user, claiming one for a new user"""
+        row = self.rows.get(user_id)
+        if row is not None:
+            return row
+        
+        # Least recently active users come first, so idle ones are at the front
+        while self.rows and self.last_activity[next(iter(self.rows.values()))] < now - self.idle_micros:
+            self.free_rows.append(self.rows.popitem(last=False)[1])
+            self.stats['evicted_idle'] += 1
+        if not self.free_rows:
+            self.free_rows.append(self.rows.popitem(last=False)[1])
+            self.stats['evicted_lru'] += 1
+        
+        row = self.free_rows.pop()
+        self.counts[row] = self.heads[row] = self.suspicious[row] = 0
+        self.means[row] = self.m2[row] = 0.0
+        self.rows[user_id] = row
+        return row
+    
+    def get_statistics(self) -> Dict:
+        """Occupancy, memory and eviction statistics"""
+        with self.lock:
+            arrays = (self.lengths, self.counts, self.heads, self.means, self.m2, self.last_activity, self.suspicious)
+            return {
+                **self.stats,
+                'tracked_users': len(self.rows),
+                'max_users': self.max_users,
+                'window': self.window,
+                'memory_budget_bytes': sum(array.nbytes for array in arrays)
+            }
+
+class SharedBehaviorStore:
+    """Per-user behavior windows kept in the storage backend, shared by all workers
+    
+    Recording a message is one atomic write (a $push with $slice and an $inc
+    on Mongo, an upsert on SQLite) that returns the user's updated window, so
+    every worker scores against all of a user's traffic whichever worker
+    received it, and the windows survive restarts. record_many writes a whole
+    batch of messages in one bulk write and reads the windows back in one
+    query. Suspicious events are counted in the same stored aggregate. The
+    aggregates a write returns are cached locally; reads within cache_ttl
+    seconds of it are answered from the cache, so scoring a batch costs two
+    round trips however many messages it holds.
+    """
+    
+    def __init__(self, db, window: int = 100, cache_ttl: float = 1.0, max_cached: int = 50000):
+        self.db = db
+        self.window = window
+        self.cache_ttl = cache_ttl
+        self.max_cached = max_cached
+        # user_id -> (fetched at, window stats, summary), least recently used first
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'writes': 0, 'write_errors': 0, 'cache_hits': 0, 'cache_misses': 0}
+    
+    def __len__(self) -> int:
+        return len(self.cache)
+    
+    def record(self, user_id: str, message_length: int, timestamp: datetime):
+        """Add a message to a user's shared window"""
+        behavior = self.db.record_user_behavior(user_id, message_length, timestamp, self.window)
+        with self.lock:
+            if behavior is None:
+                self.stats['write_errors'] += 1
+                return
+            self.stats['writes'] += 1
+            self._cache(user_id, behavior)
+    
+    def record_many(self, messages: List[Tuple[str, int, datetime]]):
+        """Add a batch of (user_id, message_length, timestamp) records in one write to the store"""
+        if not messages:
+            return
+        behaviors = self.db.record_users_behavior(messages, self.window)
+        with self.lock:
+            if not behaviors:
+                self.stats['write_errors'] += 1
+                return
+            self.stats['writes'] += 1
+            for user_id, behavior in behaviors.items():
+                self._cache(user_id, behavior)
+    
+    def mark_suspicious(self, user_id: str):
+        """Count a suspicious event against a recorded user in the shared aggregate"""
+        behavior = self.db.mark_user_suspicious(user_id)
+        if behavior is not None:
+            with self.lock:
+                self._cache(user_id, behavior)
+    
+    def window_stats(self, user_id: str) -> Tuple[int, Optional[float], float, Optional[datetime]]:
+        """(messages in window, mean length, population variance of length, last activity) of a user"""
+        return self._lookup(user_id)[0]
+    
+    def summary(self, user_id: str) -> Dict:
+        """Message count, mean length, suspicious events and last activity of a user"""
+        return dict(self._lookup(user_id)[1])
+    
+    def _lookup(self, user_id: str) -> Tuple:
+        with self.lock:
+            cached = self.cache.get(user_id)
+            if cached and time.monotonic() - cached[0] < self.cache_ttl:
+                self.stats['cache_hits'] += 1
+                self.cache.move_to_end(user_id)
+                return cached[1:]
+            self.stats['cache_misses'] += 1
+        
+        behavior = self.db.get_user_behavior(user_id) or {'lengths': [], 'last_activity': None}
+        with self.lock:
+            return self._cache(user_id, behavior)[1:]
+    
+    def _cache(self, user_id: str, behavior: Dict) -> Tuple:
+        """Cache the stats of an aggregate from the store; called with the lock held"""
+        lengths = np.asarray(behavior['lengths'], dtype=float)
+        count, last_activity = len(lengths), behavior['last_activity']
+        mean = float(lengths.mean()) if count else None
+        variance = float(lengths.var()) if count > 1 else 0.0
+        entry = (
+            time.monotonic(),
+            (count, mean, variance, last_activity),
+            {'message_count': count, 'avg_message_length': mean or 0,
+             'suspicious_count': behavior.get('suspicious_count') or 0, 'last_activity': last_activity}
+        )
+        self.cache[user_id] = entry
+        self.cache.move_to_end(user_id)
+        if len(self.cache) > self.max_cached:
+            self.cache.popitem(last=False)
+        return entry
+    
+    def get_statistics(self) -> Dict:
+        """Write and cache statistics"""
+        with self.lock:
+            return {
+                **self.stats,
+                'shared': True,
+                'cached_users': len(self.cache),
+                'max_cached': self.max_cached,
+                'window': self.window,
+                'cache_ttl_seconds': self.cache_ttl
+            }
+
+class RollingMean:
+    """Mean of the last ``window`` values with O(1) updates"""
+    
+    __slots__ = ('values', 'total', 'count', 'head')
+    
+    def __init__(self, window: int = 10):
+        self.values = [0.0] * window
+        self.total = 0.0
+        self.count = 0
+        self.head = 0
+    
+    def add(self, value: float) -> float:
+        """Add a value and return the mean of the window"""
+        if self.count == len(self.values):
+            self.total -= self.values[self.head]
+        else:
+            self.count += 1
+        self.values[self.head] = value
+        self.total += value
+        self.head = (self.head + 1) % len(self.values)
+        if self.head == 0:
+            self.total = sum(self.values)
+        return self.total / self.count
@@ -0,0 +1,61 @@
+"""
+TacticalLink Clock
+Time source for the message scheduler, replaceable by a virtual clock in simulations
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+class SystemClock:
+    """Wall-clock UTC time and real waits"""
+    
+    def now(self) -> datetime:
+        return datetime.utcnow()
+    
+    def monotonic(self) -> float:
+        """Seconds from an arbitrary origin that never go back, for measuring intervals"""
+        return time.monotonic()
+    
+    def wait(self, condition: threading.Condition, timeout: Optional[float] = None):
+        """Wait on a held condition for up to timeout seconds"""
+        condition.wait(timeout)
+
+class VirtualClock:
+    """Manually advanced time for simulations and tests
+    
+    A wait with a timeout advances the clock by the timeout instead of
+    sleeping, so a waiter reaches its deadline immediately; a wait without a
+    timeout still blocks until notified.
+    """
+    
+    def __init__(self, start: Optional[datetime] = None):
+        self.current = start or datetime.utcnow()
+        self.started = self.current
+        self.lock = threading.Lock()
+    
+    def now(self) -> datetime:
+        with self.lock:
+            return self.current
+    
+    def monotonic(self) -> float:
+        """Virtual seconds elapsed since the clock was created"""
+        with self.lock:
+            return (self.current - self.started).total_seconds()
+    
+    def advance(self, seconds: float):
+        with self.lock:
+            self.current += timedelta(seconds=seconds)
+    
+    def advance_to(self, when: datetime):
+        """Move the clock forward to when; it never moves back"""
+        with self.lock:
+            if when > self.current:
+                self.current = when
+    
+    def wait(self, condition: threading.Condition, timeout: Optional[float] = None):
+        if timeout is None:
+            condition.wait()
+        else:
+            self.advance(timeout)
@@ -3,33 +3,947 @@ TacticalLink Database Manager
 MongoDB operations for users, messages, and threat logs
 """
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument, UpdateOne
 from pymongo.errors import DuplicateKeyError, ConnectionFailure
-from bson import ObjectId
+from bson import ObjectId, encode
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import Iterator, List, Dict, Any, Optional, Tuple
+import heapq
+import itertools
 import os
 from dotenv import load_dotenv
 from models import User, Message, ThreatLog, SessionKey
+from storage_backend import StorageBackend, EXPIRY_MODE_POLL, EXPIRY_MODE_TTL, PENDING_DESTRUCTION_FIELDS
+from log_migration import RESOLVED_THREAT_LOGS, SYSTEM_LOGS, is_timeseries
 
 load_dotenv()
 
-class Database:
+# Message storage layouts
+MESSAGE_STORAGE_DOCUMENT = 'document'
+MESSAGE_STORAGE_BUCKET = 'bucket'
+MESSAGE_STORAGE_PARTITIONED = 'partitioned'
+
+# Partition granularities for MESSAGE_STORAGE_PARTITIONED
+PARTITION_FORMATS = {
+    'day': ('%Y%m%d', timedelta(days=1)),
+    'hour': ('%Y%m%d%H', timedelta(hours=1))
+}
+
+# Fields of a user's behavior aggregate returned by the user_behavior methods
+USER_BEHAVIOR_PROJECTION = {"_id": 0, "lengths": 1, "message_count": 1, "last_activity": 1, "suspicious_count": 1}
+
+def _purge_deleted_batch(collection, cutoff: datetime, batch_size: int):
+    """Hard-delete up to batch_size messages soft-deleted before cutoff, returning (documents, bytes)"""
+    batch = list(collection.aggregate([
+        {"$match": {"is_deleted": True, "deleted_at": {"$lt": cutoff}}},
+        {"$sort": {"deleted_at": 1}},
+        {"$limit": batch_size},
+        {"$project": {"size": {"$bsonSize": "$$ROOT"}}}
+    ]))
+    if not batch:
+        return 0, 0
+    result = collection.delete_many({"_id": {"$in": [d['_id'] for d in batch]}, "is_deleted": True})
+    return result.deleted_count, sum(d['size'] for d in batch)
+
+def _delete_live_documents(collection, object_ids: List[ObjectId], now: datetime) -> List[ObjectId]:
+    """Soft-delete the live documents among object_ids with one update_many
+    
+    The write is tagged with a fresh token so the documents this call flipped
+    can be told apart from ones another worker deleted concurrently.
+    """
+    token = ObjectId()
+    collection.update_many(
+        {"_id": {"$in": object_ids}, "is_deleted": False},
+        {"$set": {"is_deleted": True, "deleted_at": now, "deleted_by": token}}
+    )
+    return [d['_id'] for d in collection.find({"_id": {"$in": object_ids}, "deleted_by": token}, {"_id": 1})]
+
+def _participant_filter(sender_id: Optional[str], recipient_id: Optional[str], prefix: str = "") -> Dict:
+    query = {}
+    if sender_id:
+        query[f"{prefix}sender_id"] = sender_id
+    if recipient_id:
+        query[f"{prefix}recipient_id"] = recipient_id
+    return query
+
+def _destruction_summary_stages(destruct_at: str, read_once: str, bucket_seconds: int) -> List[Dict]:
+    """Stages counting messages per bucket_seconds of destruct_at, soonest first
+    
+    Buckets start at whole multiples of bucket_seconds since the epoch, as
+    on SQLite; $dateTrunc would align them to its own reference date instead.
+    """
+    return [
+        {"$group": {
+            "_id": {"$subtract": [destruct_at, {"$mod": [{"$toLong": destruct_at}, bucket_seconds * 1000]}]},
+            "count": {"$sum": 1},
+            "read_once": {"$sum": {"$cond": [{"$eq": [read_once, True]}, 1, 0]}}
+        }},
+        {"$sort": {"_id": 1}}
+    ]
+
+def _destruction_summary(groups) -> List[Dict]:
+    return [{'bucket_start': g['_id'], 'count': g['count'], 'read_once': g['read_once']} for g in groups]
+
+def _message_statistics_stages(now: datetime, day_start: datetime, timestamp: str) -> List[Dict]:
+    """Stages counting live messages of the last 24 hours per hour before now, split by whether sent today
+    
+    At most 48 groups leave the server, whatever the message volume.
+    """
+    return [
+        {"$group": {
+            "_id": {
+                "hours_ago": {"$floor": {"$divide": [{"$subtract": [now, timestamp]}, 3600 * 1000]}},
+                "today": {"$gte": [timestamp, day_start]}
+            },
+            "count": {"$sum": 1}
+        }}
+    ]
+
+def _message_statistics(total: int, now: datetime, groups) -> Dict:
+    """Dashboard statistics from the groups of _message_statistics_stages, merged across collections"""
+    hourly = [0] * 24
+    messages_today = 0
+    for group in groups:
+        hours_ago = int(group['_id']['hours_ago'])
+        if 0 <= hours_ago < 24:
+            hourly[hours_ago] += group['count']
+        if group['_id']['today']:
+            messages_today += group['count']
+    return {
+        "total_messages": total,
+        "messages_today": messages_today,
+        "hourly_stats": [
+            {"hour": (now - timedelta(hours=i + 1)).hour, "count": count} for i, count in enumerate(hourly)
+        ]
+    }
+
+def _recent_activity_stages(user_ids: List[str], limit: int, prefix: str = "") -> List[Dict]:
+    """Stages keeping the latest ``limit`` messages of each user in user_ids, newest first
+    
+    A message counts for its sender and its recipient when they are among
+    user_ids, and only the fields the threat sweep reads are kept. $topN
+    (MongoDB 5.2+) holds at most ``limit`` messages per user while grouping,
+    so memory follows the limit rather than a user's whole history.
+    """
+    return [
+        {"$project": {
+            "_id": 0,
+            "user_id": {"$setIntersection": [
+                [f"${prefix}sender_id", f"${prefix}recipient_id"], {"$literal": user_ids}
+            ]},
+            "recipient_id": f"${prefix}recipient_id",
+            "timestamp": f"${prefix}timestamp",
+            "content_length": {"$strLenCP": {"$ifNull": [f"${prefix}content", ""]}}
+        }},
+        {"$unwind": "$user_id"},
+        {"$group": {"_id": "$user_id", "messages": {"$topN": {
+            "n": limit,
+            "sortBy": {"timestamp": -1},
+            "output": {"recipient_id": "$recipient_id", "timestamp": "$timestamp", "content_length": "$content_length"}
+        }}}}
+    ]
+
+def _recent_activity(collection, user_ids: List[str], limit: int) -> Dict[str, List[Dict]]:
+    """Latest live messages per user from a one-document-per-message collection"""
+    pipeline = [
+        {"$match": {
+            "$or": [{"sender_id": {"$in": user_ids}}, {"recipient_id": {"$in": user_ids}}],
+            "is_deleted": False
+        }},
+        *_recent_activity_stages(user_ids, limit)
+    ]
+    return {group['_id']: group['messages'] for group in collection.aggregate(pipeline, allowDiskUse=True)}
+
+def _destruct_at_update(destruct_at: Optional[datetime]) -> Dict:
+    return {"$unset": {"destruct_at": 1}} if destruct_at is None else {"$set": {"destruct_at": destruct_at}}
+
+def _set_live_destruct_at(collection, deadlines: Dict[ObjectId, Optional[datetime]]) -> List[ObjectId]:
+    """Set or clear destruct_at on the live documents among deadlines' keys
+    
+    One update_many when every message shares a deadline, otherwise one
+    unordered bulk_write. Which documents were updated is only read back when
+    some of them did not match.
+    """
+    object_ids = list(deadlines)
+    values = set(deadlines.values())
+    if len(values) == 1:
+        result = collection.update_many(
+            {"_id": {"$in": object_ids}, "is_deleted": False},
+            _destruct_at_update(values.pop())
+        )
+    else:
+        result = collection.bulk_write([
+            UpdateOne({"_id": object_id, "is_deleted": False}, _destruct_at_update(destruct_at))
+            for object_id, destruct_at in deadlines.items()
+        ], ordered=False)
+    
+    if result.matched_count == len(object_ids):
+        return object_ids
+    return [d['_id'] for d in collection.find({"_id": {"$in": object_ids}, "is_deleted": False}, {"_id": 1})]
+
+class MessageBucketStore:
+    """Bucket-pattern message storage
+    
+    Packs up to ``bucket_size`` messages of one conversation and time window
+    into a single ``message_buckets`` document. Message IDs take the form
+    ``<bucket_id>:<position>`` so single-message reads and updates address the
+    array slot directly without a per-message index.
+    """
+    
+    def __init__(self, db, bucket_size: int = 200, bucket_span: int = 3600):
+        self.collection = db.message_buckets
+        self.bucket_size = bucket_size
+        self.bucket_span = bucket_span
+    
+    def create_indexes(self):
+        """Create bucket collection indexes"""
+        self.collection.create_index([("conversation_id", 1), ("bucket_start", 1), ("count", 1)])
+        self.collection.create_index([("participants", 1), ("bucket_start", -1)])
+        self.collection.create_index(
+            "next_destruct_at",
+            partialFilterExpression={"next_destruct_at": {"$type": "date"}}
+        )
+    
+    @staticmethod
+    def conversation_id(user1_id: str, user2_id: str) -> str:
+        """Order-independent key for the conversation between two users"""
+        return ':'.join(sorted([user1_id, user2_id]))
+    
+    @staticmethod
+    def split_message_id(message_id: str):
+        """Split a bucketed message ID into (bucket ObjectId, array position)"""
+        bucket_id, position = message_id.rsplit(':', 1)
+        return ObjectId(bucket_id), int(position)
+    
+    def _bucket_start(self, timestamp: datetime) -> datetime:
+        epoch = int((timestamp - datetime(1970, 1, 1)).total_seconds())
+        return datetime.utcfromtimestamp(epoch - epoch % self.bucket_span)
+    
+    @staticmethod
+    def _next_destruct_stage() -> Dict:
+        """Pipeline stage recomputing the earliest pending destruction and deleted count of a bucket"""
+        pending = {"$filter": {
+            "input": "$messages",
+            "cond": {"$and": [
+                {"$eq": ["$$this.is_deleted", False]},
+                {"$gt": ["$$this.destruct_at", None]}
+            ]}
+        }}
+        return {"$set": {
+            "next_destruct_at": {"$let": {
+                "vars": {"pending": pending},
+                "in": {"$ifNull": [{"$min": "$$pending.destruct_at"}, "$$REMOVE"]}
+            }},
+            "deleted_count": {"$size": {"$filter": {
+                "input": "$messages",
+                "cond": {"$eq": ["$$this.is_deleted", True]}
+            }}}
+        }}
+    
+    def append(self, message: Message) -> str:
+        """Append a message to its conversation bucket, opening a new bucket when full"""
+        message_dict = message.to_dict()
+        update = {
+            "$push": {"messages": message_dict},
+            "$inc": {"count": 1},
+            "$setOnInsert": {
+                "participants": sorted([message.sender_id, message.recipient_id]),
+                "deleted_count": 0
+            },
+            "$min": {"first_timestamp": message.timestamp},
+            "$max": {"last_timestamp": message.timestamp}
+        }
+        if message.destruct_at:
+            update["$min"]["next_destruct_at"] = message.destruct_at
+        
+        bucket = self.collection.find_one_and_update(
+            {
+                "conversation_id": self.conversation_id(message.sender_id, message.recipient_id),
+                "bucket_start": self._bucket_start(message.timestamp),
+                "count": {"$lt": self.bucket_size}
+            },
+            update,
+            projection={"count": 1},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return f"{bucket['_id']}:{bucket['count'] - 1}"
+    
+    def get_message(self, message_id: str) -> Optional[Dict]:
+        """Read a single message out of its bucket"""
+        bucket_id, position = self.split_message_id(message_id)
+        bucket = self.collection.find_one(
+            {"_id": bucket_id},
+            {"messages": {"$slice": [position, 1]}}
+        )
+        if not bucket or not bucket.get('messages'):
+            return None
+        message = bucket['messages'][0]
+        message['_id'] = message_id
+        return message
+    
+    def get_messages(self, message_ids: List[str]) -> List[Dict]:
+        """Read messages out of their buckets with one aggregation"""
+        slots = [self.split_message_id(message_id) for message_id in message_ids]
+        if not slots:
+            return []
+        return self._unwind(
+            {"_id": {"$in": list({bucket_id for bucket_id, _ in slots})}},
+            {"$or": [{"_id": bucket_id, "position": position} for bucket_id, position in slots]},
+            {"_id": 1, "position": 1}
+        )
+    
+    def update_message(self, message_id: str, fields: Dict, only_if_live: bool = False) -> bool:
+        """Set fields on a single message inside its bucket"""
+        bucket_id, position = self.split_message_id(message_id)
+        query = {"_id": bucket_id}
+        if only_if_live:
+            query[f"messages.{position}.is_deleted"] = False
+        update = {"$set": {f"messages.{position}.{key}": value for key, value in fields.items()}}
+        if fields.get('is_deleted'):
+            update["$inc"] = {"deleted_count": 1}
+        elif fields.get('destruct_at'):
+            update["$min"] = {"next_destruct_at": fields['destruct_at']}
+        result = self.collection.update_one(query, update)
+        return result.matched_count > 0
+    
+    def delete_messages(self, message_ids: List[str], now: datetime) -> List[str]:
+        """Soft-delete live messages; each slot needs its own conditional update"""
+        return [
+            message_id for message_id in message_ids
+            if self.update_message(message_id, {"is_deleted": True, "deleted_at": now}, only_if_live=True)
+        ]
+    
+    def set_destruct_at(self, deadlines: Dict[str, Optional[datetime]]) -> List[str]:
+        """Set or clear self-destruct times of live messages; each slot needs its own conditional update"""
+        return [
+            message_id for message_id, destruct_at in deadlines.items()
+            if self.update_message(message_id, {"destruct_at": destruct_at}, only_if_live=True)
+        ]
+    
+    def _unwind(self, match: Dict, message_match: Dict, sort: Dict, limit: Optional[int] = None) -> List[Dict]:
+        pipeline = [
+            {"$match": match},
+            {"$unwind": {"path": "$messages", "includeArrayIndex": "position"}},
+            {"$match": message_match},
+            {"$sort": sort}
+        ]
+        if limit:
+            pipeline.append({"$limit": limit})
+        
+        messages = []
+        for unwound in self.collection.aggregate(pipeline):
+            message = unwound['messages']
+            message['_id'] = f"{unwound['_id']}:{unwound['position']}"
+            messages.append(message)
+        return messages
+    
+    def get_pending_messages(self, user_id: str) -> List[Dict]:
+        """Unread, live messages for a recipient, oldest first"""
+        now = datetime.utcnow()
+        live = {"recipient_id": user_id, "is_read": False, "is_deleted": False}
+        return self._unwind(
+            {"participants": user_id, "messages": {"$elemMatch": live}},
+            {
+                **{f"messages.{key}": value for key, value in live.items()},
+                "$or": [
+                    {"messages.destruct_at": {"$gt": now}},
+                    {"messages.destruct_at": None}
+                ]
+            },
+            {"messages.timestamp": 1}
+        )
+    
+    def _collect(self, query: Dict, direction: int, limit: int) -> List[Dict]:
+        """Walk buckets in time order and stop once ``limit`` live messages are covered
+        
+        Buckets sharing the cut-off ``bucket_start`` are still read so messages
+        from overflow buckets of the same window are ordered correctly.
+        """
+        collected = []
+        cutoff = None
+        cursor = self.collection.find(query).sort("bucket_start", direction).batch_size(8)
+        for bucket in cursor:
+            if cutoff is not None and bucket['bucket_start'] != cutoff:
+                break
+            for position, message in enumerate(bucket.get('messages', [])):
+                if message.get('is_deleted'):
+                    continue
+                message['_id'] = f"{bucket['_id']}:{position}"
+                collected.append(message)
+            if cutoff is None and len(collected) >= limit:
+                cutoff = bucket['bucket_start']
+        cursor.close()
+        collected.sort(key=lambda m: m['timestamp'], reverse=direction < 0)
+        return collected[:limit]
+    
+    def get_user_recent_messages(self, user_id: str, limit: int = 50) -> List[Dict]:
+        """Most recent live messages sent or received by a user"""
+        return self._collect({"participants": user_id}, -1, limit)
+    
+    def get_users_recent_activity(self, user_ids: List[str], limit: int) -> Dict[str, List[Dict]]:
+        """Latest live messages of each user, unwound from their buckets in one pipeline"""
+        pipeline = [
+            {"$match": {"participants": {"$in": user_ids}}},
+            {"$unwind": "$messages"},
+            {"$match": {"messages.is_deleted": False}},
+            *_recent_activity_stages(user_ids, limit, prefix="messages.")
+        ]
+        return {group['_id']: group['messages'] for group in self.collection.aggregate(pipeline, allowDiskUse=True)}
+    
+    def get_conversation_messages(self, user1_id: str, user2_id: str, limit: int = 100) -> List[Dict]:
+        """Live messages of a conversation, oldest first"""
+        return self._collect({"conversation_id": self.conversation_id(user1_id, user2_id)}, 1, limit)
+    
+    def get_expired_messages(self, now: datetime, since: Optional[datetime] = None, limit: int = 0) -> List[Dict]:
+        """Live messages whose destruction time has passed"""
+        due = {"$lt": now, "$gte": since} if since else {"$lt": now}
+        return self._unwind(
+            {"next_destruct_at": {"$lt": now}},
+            {"messages.destruct_at": due, "messages.is_deleted": False},
+            {"messages.destruct_at": 1},
+            limit
+        )
+    
+    def get_messages_pending_destruction(self, now: datetime) -> List[Dict]:
+        """Live messages scheduled to self-destruct in the future"""
+        return self._unwind(
+            {"next_destruct_at": {"$type": "date"}},
+            {"messages.destruct_at": {"$gt": now}, "messages.is_deleted": False},
+            {"messages.destruct_at": 1}
+        )
+    
+    def iter_pending_destruction(self, now: datetime, after: Optional[Tuple[datetime, str]], limit: int,
+                                 sender_id: Optional[str], recipient_id: Optional[str]) -> Iterator[Dict]:
+        """Live messages scheduled to self-destruct in the future, by (destruct_at, bucket, position)"""
+        message_match = {
+            "messages.destruct_at": {"$gt": now},
+            "messages.is_deleted": False,
+            **_participant_filter(sender_id, recipient_id, "messages.")
+        }
+        if after:
+            after_at, (bucket_id, position) = after[0], self.split_message_id(after[1])
+            message_match["$or"] = [
+                {"messages.destruct_at": {"$gt": after_at}},
+                {"messages.destruct_at": after_at, "_id": {"$gt": bucket_id}},
+                {"messages.destruct_at": after_at, "_id": bucket_id, "position": {"$gt": position}}
+            ]
+        
+        pipeline = [
+            {"$match": self._pending_bucket_match(sender_id, recipient_id)},
+            {"$unwind": {"path": "$messages", "includeArrayIndex": "position"}},
+            {"$match": message_match},
+            {"$sort": {"messages.destruct_at": 1, "_id": 1, "position": 1}}
+        ]
+        if limit:
+            pipeline.append({"$limit": limit})
+        pipeline.append({"$project": {"position": 1, **{f"messages.{f}": 1 for f in PENDING_DESTRUCTION_FIELDS}}})
+        
+        for unwound in self.collection.aggregate(pipeline, allowDiskUse=True):
+            message = unwound['messages']
+            message['_id'] = f"{unwound['_id']}:{unwound['position']}"
+            yield message
+    
+    def summarize_pending_destruction(self, now: datetime, bucket_seconds: int,
+                                      sender_id: Optional[str], recipient_id: Optional[str]) -> List[Dict]:
+        """Counts of messages pending destruction per bucket_seconds of destruct_at"""
+        return _destruction_summary(self.collection.aggregate([
+            {"$match": self._pending_bucket_match(sender_id, recipient_id)},
+            {"$unwind": "$messages"},
+            {"$match": {
+                "messages.destruct_at": {"$gt": now},
+                "messages.is_deleted": False,
+                **_participant_filter(sender_id, recipient_id, "messages.")
+            }},
+            *_destruction_summary_stages("$messages.destruct_at", "$messages.read_once", bucket_seconds)
+        ]))
+    
+    @staticmethod
+    def _pending_bucket_match(sender_id: Optional[str], recipient_id: Optional[str]) -> Dict:
+        match = {"next_destruct_at": {"$type": "date"}}
+        participants = [user_id for user_id in (sender_id, recipient_id) if user_id]
+        if participants:
+            match["participants"] = {"$all": participants}
+        return match
+    
+    def count_expired_messages(self, now: datetime) -> int:
+        """Number of live messages past their destruction time"""
+        result = list(self.collection.aggregate([
+            {"$match": {"next_destruct_at": {"$lt": now}}},
+            {"$project": {"expired": {"$size": {"$filter": {
+                "input": "$messages",
+                "cond": {"$and": [
+                    {"$eq": ["$$this.is_deleted", False]},
+                    {"$gt": ["$$this.destruct_at", None]},
+                    {"$lt": ["$$this.destruct_at", now]}
+                ]}
+            }}}}},
+            {"$group": {"_id": None, "total": {"$sum": "$expired"}}}
+        ]))
+        return result[0]['total'] if result else 0
+    
+    def cleanup_expired_messages(self) -> int:
+        """Soft-delete expired messages inside their buckets"""
+        now = datetime.utcnow()
+        expired = self.count_expired_messages(now)
+        if not expired:
+            return 0
+        self.collection.update_many(
+            {"next_destruct_at": {"$lt": now}},
+            [
+                {"$set": {"messages": {"$map": {
+                    "input": "$messages",
+                    "in": {"$cond": [
+                        {"$and": [
+                            {"$eq": ["$$this.is_deleted", False]},
+                            {"$gt": ["$$this.destruct_at", None]},
+                            {"$lt": ["$$this.destruct_at", now]}
+                        ]},
+                        {"$mergeObjects": ["$$this", {"is_deleted": True, "deleted_at": now}]},
+                        "$$this"
+                    ]}
+                }}}},
+                self._next_destruct_stage()
+            ]
+        )
+        return expired
+    
+    @staticmethod
+    def _tombstone(message: Dict) -> Dict:
+        """Deleted message stripped down to what bucket readers still look at"""
+        return {
+            "sender_id": message.get('sender_id'),
+            "recipient_id": message.get('recipient_id'),
+            "timestamp": message.get('timestamp'),
+            "is_read": message.get('is_read', False),
+            "is_deleted": True,
+            "deleted_at": message.get('deleted_at'),
+            "compacted": True
+        }
+    
+    def purge_deleted_messages(self, cutoff: datetime, batch_size: int = 500,
+                               resume_after: Optional[str] = None) -> Dict:
+        """Reclaim deleted messages without shifting array positions
+        
+        Buckets whose messages are all deleted are removed. Elsewhere deleted
+        messages are replaced by tombstones, so the position-based IDs of the
+        surviving messages stay valid. Whole buckets are processed, so a batch
+        may exceed batch_size.
+        """
+        query = {"$expr": {"$gt": ["$deleted_count", {"$ifNull": ["$compacted_count", 0]}]}}
+        if resume_after:
+            query["_id"] = {"$gt": ObjectId(resume_after)}
+        
+        documents = size = 0
+        done = True
+        cursor = self.collection.find(query).sort("_id", 1).batch_size(8)
+        for bucket in cursor:
+            if documents >= batch_size:
+                done = False
+                break
+            resume_after = str(bucket['_id'])
+            messages = bucket.get('messages', [])
+            purgeable = [
+                position for position, message in enumerate(messages)
+                if message.get('is_deleted') and not message.get('compacted')
+                and message.get('deleted_at') and message['deleted_at'] < cutoff
+            ]
+            if not purgeable:
+                continue
+            
+            compacted = sum(1 for message in messages if message.get('compacted'))
+            if compacted + len(purgeable) == len(messages):
+                # Guarded on count so a concurrent append is never lost
+                result = self.collection.delete_one({"_id": bucket['_id'], "count": bucket['count']})
+                if result.deleted_count:
+                    documents += len(purgeable)
+                    size += len(encode(bucket))
+                continue
+            
+            tombstones = {position: self._tombstone(messages[position]) for position in purgeable}
+            self.collection.update_one(
+                {"_id": bucket['_id']},
+                {
+                    "$set": {f"messages.{position}": tombstone for position, tombstone in tombstones.items()},
+                    "$inc": {"compacted_count": len(purgeable)}
+                }
+            )
+            documents += len(purgeable)
+            size += sum(len(encode(messages[p])) - len(encode(t)) for p, t in tombstones.items())
+        cursor.close()
+        
+        return {'documents': documents, 'bytes': size, 'resume_after': None if done else resume_after, 'done': done}
+    
+    def get_message_statistics(self) -> Dict:
+        """Message counts for the admin dashboard, computed from bucket counters"""
+        now = datetime.utcnow()
+        totals = list(self.collection.aggregate([
+            {"$group": {"_id": None, "total": {"$sum": {"$subtract": ["$count", "$deleted_count"]}}}}
+        ]))
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        since = min(day_start, now - timedelta(hours=24))
+        groups = self.collection.aggregate([
+            {"$match": {"last_timestamp": {"$gte": since}}},
+            {"$unwind": "$messages"},
+            {"$match": {"messages.timestamp": {"$gte": since, "$lt": now}, "messages.is_deleted": False}},
+            *_message_statistics_stages(now, day_start, "$messages.timestamp")
+        ])
+        return _message_statistics(totals[0]['total'] if totals else 0, now, groups)
+
+class MessagePartitionRouter:
+    """Time-partitioned message storage
+    
+    Writes each message into a per-day or per-hour collection such as
+    ``messages_20240101`` and fans queries out to only the partitions a time
+    range needs. Retention drops whole partitions instead of deleting rows.
+    Message IDs take the form ``<partition suffix>:<ObjectId>``.
+    """
+    
+    def __init__(self, db, granularity: str = 'day', retention: timedelta = timedelta(days=30),
+                 refresh_interval: int = 60):
+        if granularity not in PARTITION_FORMATS:
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+        self.db = db
+        self.suffix_format, self.partition_span = PARTITION_FORMATS[granularity]
+        self.retention = retention
+        self.refresh_interval = refresh_interval
+        self.known_partitions = set()
+        self.indexed_partitions = set()
+        self.last_refresh = None
+    
+    def create_indexes(self):
+        """Create indexes on every existing partition"""
+        for name in self._partitions(refresh=True):
+            self._ensure_indexes(name)
+    
+    def _ensure_indexes(self, name: str):
+        if name in self.indexed_partitions:
+            return
+        collection = self.db[name]
+        collection.create_index([("recipient_id", 1), ("is_read", 1), ("timestamp", 1)])
+        collection.create_index([("sender_id", 1), ("timestamp", -1)])
+        collection.create_index([("sender_id", 1), ("recipient_id", 1), ("timestamp", 1)])
+        collection.create_index("destruct_at", partialFilterExpression={"is_deleted": False})
+        collection.create_index("deleted_at", partialFilterExpression={"is_deleted": True})
+        self.indexed_partitions.add(name)
+    
+    def partition_name(self, timestamp: datetime) -> str:
+        """Collection name of the partition holding a timestamp"""
+        return f"messages_{timestamp.strftime(self.suffix_format)}"
+    
+    def partition_start(self, name: str) -> datetime:
+        """Start of the time range covered by a partition"""
+        return datetime.strptime(name[len('messages_'):], self.suffix_format)
+    
+    def _partitions(self, refresh: bool = False) -> List[str]:
+        """Known partitions in chronological order, including the current one"""
+        now = datetime.utcnow()
+        if refresh or not self.last_refresh or (now - self.last_refresh).total_seconds() > self.refresh_interval:
+            pattern = r'^messages_\d{%d}$' % len(now.strftime(self.suffix_format))
+            self.known_partitions = set(self.db.list_collection_names(filter={"name": {"$regex": pattern}}))
+            self.last_refresh = now
+        
+        # Other workers may have opened the current partition since the last refresh
+        self.known_partitions.add(self.partition_name(now))
+        return sorted(self.known_partitions)
+    
+    def _partitions_between(self, start: Optional[datetime], end: Optional[datetime]) -> List[str]:
+        """Partitions overlapping [start, end)"""
+        names = []
+        for name in self._partitions():
+            partition_start = self.partition_start(name)
+            if start and partition_start + self.partition_span <= start:
+                continue
+            if end and partition_start >= end:
+                continue
+            names.append(name)
+        return names
+    
+    def split_message_id(self, message_id: str):
+        """Split a partitioned message ID into (collection, ObjectId)"""
+        suffix, object_id = message_id.split(':', 1)
+        return self.db[f"messages_{suffix}"], ObjectId(object_id)
+    
+    @staticmethod
+    def _with_ids(name: str, messages) -> List[Dict]:
+        suffix = name[len('messages_'):]
+        result = []
+        for message in messages:
+            message['_id'] = f"{suffix}:{message['_id']}"
+            result.append(message)
+        return result
+    
+    @staticmethod
+    def _iter_with_ids(name: str, messages) -> Iterator[Dict]:
+        suffix = name[len('messages_'):]
+        for message in messages:
+            message['_id'] = f"{suffix}:{message['_id']}"
+            yield message
+    
+    def append(self, message: Message) -> str:
+        """Insert a message into the partition for its timestamp"""
+        name = self.partition_name(message.timestamp)
+        self._ensure_indexes(name)
+        self.known_partitions.add(name)
+        result = self.db[name].insert_one(message.to_dict())
+        return f"{name[len('messages_'):]}:{result.inserted_id}"
+    
+    def get_message(self, message_id: str) -> Optional[Dict]:
+        """Read a single message from its partition"""
+        collection, object_id = self.split_message_id(message_id)
+        message = collection.find_one({"_id": object_id})
+        if message:
+            message['_id'] = message_id
+        return message
+    
+    def get_messages(self, message_ids: List[str]) -> List[Dict]:
+        """Read messages with one query per partition"""
+        by_partition = {}
+        for message_id in message_ids:
+            suffix, object_id = message_id.split(':', 1)
+            by_partition.setdefault(suffix, []).append(ObjectId(object_id))
+        
+        messages = []
+        for suffix, object_ids in by_partition.items():
+            name = f"messages_{suffix}"
+            messages.extend(self._with_ids(name, self.db[name].find({"_id": {"$in": object_ids}})))
+        return messages
+    
+    def update_message(self, message_id: str, fields: Dict, only_if_live: bool = False) -> bool:
+        """Set fields on a single message"""
+        collection, object_id = self.split_message_id(message_id)
+        query = {"_id": object_id}
+        if only_if_live:
+            query["is_deleted"] = False
+        return collection.update_one(query, {"$set": fields}).matched_count > 0
+    
+    def delete_messages(self, message_ids: List[str], now: datetime) -> List[str]:
+        """Soft-delete live messages with one update_many per partition"""
+        by_partition = {}
+        for message_id in message_ids:
+            suffix, object_id = message_id.split(':', 1)
+            by_partition.setdefault(suffix, []).append(ObjectId(object_id))
+        
+        deleted = []
+        for suffix, object_ids in by_partition.items():
+            won = _delete_live_documents(self.db[f"messages_{suffix}"], object_ids, now)
+            deleted.extend(f"{suffix}:{object_id}" for object_id in won)
+        return deleted
+    
+    def set_destruct_at(self, deadlines: Dict[str, Optional[datetime]]) -> List[str]:
+        """Set or clear self-destruct times of live messages with one write per partition"""
+        by_partition = {}
+        for message_id, destruct_at in deadlines.items():
+            suffix, object_id = message_id.split(':', 1)
+            by_partition.setdefault(suffix, {})[ObjectId(object_id)] = destruct_at
+        
+        updated = []
+        for suffix, partition_deadlines in by_partition.items():
+            matched = _set_live_destruct_at(self.db[f"messages_{suffix}"], partition_deadlines)
+            updated.extend(f"{suffix}:{object_id}" for object_id in matched)
+        return updated
+    
+    def _find(self, query: Dict, sort: List, direction: int = 1, limit: int = 0,
+              start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[Dict]:
+        """Query partitions in time order, stopping once ``limit`` messages are found"""
+        partitions = self._partitions_between(start, end)
+        if direction < 0:
+            partitions.reverse()
+        
+        messages = []
+        for name in partitions:
+            cursor = self.db[name].find(query).sort(sort)
+            if limit:
+                cursor = cursor.limit(limit - len(messages))
+            messages.extend(self._with_ids(name, cursor))
+            if limit and len(messages) >= limit:
+                break
+        return messages
+    
+    def get_pending_messages(self, user_id: str) -> List[Dict]:
+        """Unread, live messages for a recipient, oldest first"""
+        return self._find({
+            "recipient_id": user_id,
+            "is_read": False,
+            "is_deleted": False,
+            "$or": [
+                {"destruct_at": {"$gt": datetime.utcnow()}},
+                {"destruct_at": None}
+            ]
+        }, [("timestamp", 1)])
+    
+    def get_user_recent_messages(self, user_id: str, limit: int = 50) -> List[Dict]:
+        """Most recent live messages sent or received by a user"""
+        return self._find({
+            "$or": [{"sender_id": user_id}, {"recipient_id": user_id}],
+            "is_deleted": False
+        }, [("timestamp", -1)], direction=-1, limit=limit)
+    
+    def get_users_recent_activity(self, user_ids: List[str], limit: int) -> Dict[str, List[Dict]]:
+        """Latest live messages of each user, one pipeline per partition newest first
+        
+        Older partitions are only read while some user still has fewer than
+        ``limit`` messages.
+        """
+        activity = {}
+        remaining = list(user_ids)
+        for name in reversed(self._partitions()):
+            for user_id, messages in _recent_activity(self.db[name], remaining, limit).items():
+                collected = activity.setdefault(user_id, [])
+                collected.extend(messages[:limit - len(collected)])
+            remaining = [user_id for user_id in remaining if len(activity.get(user_id, ())) < limit]
+            if not remaining:
+                break
+        return activity
+    
+    def get_conversation_messages(self, user1_id: str, user2_id: str, limit: int = 100) -> List[Dict]:
+        """Live messages of a conversation, oldest first"""
+        return self._find({
+            "$or": [
+                {"sender_id": user1_id, "recipient_id": user2_id},
+                {"sender_id": user2_id, "recipient_id": user1_id}
+            ],
+            "is_deleted": False
+        }, [("timestamp", 1)], limit=limit)
+    
+    def get_expired_messages(self, now: datetime, since: Optional[datetime] = None, limit: int = 0) -> List[Dict]:
+        """Live messages whose destruction time has passed, merging per-partition destruct_at ordered cursors"""
+        due = {"$lt": now, "$gte": since} if since else {"$lt": now}
+        # Partitions follow timestamp order, not destruct_at, so each returns at most its own soonest ``limit``
+        streams = []
+        for name in self._partitions_between(None, now):
+            cursor = self.db[name].find({"destruct_at": due, "is_deleted": False}).sort(
+                [("destruct_at", 1), ("_id", 1)]).limit(limit)
+            streams.append(self._iter_with_ids(name, cursor))
+        
+        merged = heapq.merge(*streams, key=lambda m: (m['destruct_at'], m['_id']))
+        return list(itertools.islice(merged, limit or None))
+    
+    def get_messages_pending_destruction(self, now: datetime) -> List[Dict]:
+        """Live messages scheduled to self-destruct in the future"""
+        messages = self._find({"destruct_at": {"$gt": now}, "is_deleted": False}, [("destruct_at", 1)])
+        messages.sort(key=lambda m: m['destruct_at'])
+        return messages
+    
+    def iter_pending_destruction(self, now: datetime, after: Optional[Tuple[datetime, str]], limit: int,
+                                 sender_id: Optional[str], recipient_id: Optional[str]) -> Iterator[Dict]:
+        """Merge per-partition (destruct_at, _id) ordered cursors into one soonest-first stream"""
+        query = {"destruct_at": {"$gt": now}, "is_deleted": False, **_participant_filter(sender_id, recipient_id)}
+        projection = {field: 1 for field in PENDING_DESTRUCTION_FIELDS}
+        streams = []
+        for name in self._partitions():
+            suffix = name[len('messages_'):]
+            partition_query = dict(query)
+            if after:
+                after_suffix, after_id = after[1].split(':', 1)
+                if suffix == after_suffix:
+                    partition_query["$or"] = [
+                        {"destruct_at": {"$gt": after[0]}},
+                        {"destruct_at": after[0], "_id": {"$gt": ObjectId(after_id)}}
+                    ]
+                else:
+                    # Ties on destruct_at are ordered by partition first
+                    partition_query["$and"] = [{"destruct_at": {"$gte" if suffix > after_suffix else "$gt": after[0]}}]
+            
+            cursor = self.db[name].find(partition_query, projection).sort([("destruct_at", 1), ("_id", 1)]).limit(limit)
+            streams.append(self._iter_with_ids(name, cursor))
+        
+        merged = heapq.merge(*streams, key=lambda m: (m['destruct_at'], m['_id']))
+        return itertools.islice(merged, limit or None)
+    
+    def summarize_pending_destruction(self, now: datetime, bucket_seconds: int,
+                                      sender_id: Optional[str], recipient_id: Optional[str]) -> List[Dict]:
+        """Counts of messages pending destruction per bucket_seconds of destruct_at, merged across partitions"""
+        pipeline = [
+            {"$match": {"destruct_at": {"$gt": now}, "is_deleted": False, **_participant_filter(sender_id, recipient_id)}},
+            *_destruction_summary_stages("$destruct_at", "$read_once", bucket_seconds)
+        ]
+        buckets = {}
+        for name in self._partitions():
+            for group in self.db[name].aggregate(pipeline):
+                totals = buckets.setdefault(group['_id'], {'_id': group['_id'], 'count': 0, 'read_once': 0})
+                totals['count'] += group['count']
+                totals['read_once'] += group['read_once']
+        return _destruction_summary(sorted(buckets.values(), key=lambda g: g['_id']))
+    
+    def count_expired_messages(self, now: datetime) -> int:
+        """Number of live messages past their destruction time"""
+        return sum(
+            self.db[name].count_documents({"destruct_at": {"$lt": now}, "is_deleted": False})
+            for name in self._partitions_between(None, now)
+        )
+    
+    def cleanup_expired_messages(self) -> int:
+        """Soft-delete expired messages in every live partition"""
+        now = datetime.utcnow()
+        return sum(
+            self.db[name].update_many(
+                {"destruct_at": {"$lt": now}, "is_deleted": False},
+                {"$set": {"is_deleted": True, "deleted_at": now}}
+            ).modified_count
+            for name in self._partitions_between(None, now)
+        )
+    
+    def purge_deleted_messages(self, cutoff: datetime, batch_size: int = 500,
+                               resume_after: Optional[str] = None) -> Dict:
+        """Hard-delete one batch of deleted messages across partitions older than cutoff"""
+        documents = size = 0
+        for name in self._partitions_between(None, cutoff):
+            deleted, reclaimed = _purge_deleted_batch(self.db[name], cutoff, batch_size - documents)
+            documents += deleted
+            size += reclaimed
+            if documents >= batch_size:
+                break
+        return {'documents': documents, 'bytes': size, 'resume_after': None, 'done': documents < batch_size}
+    
+    def drop_expired_partitions(self) -> int:
+        """Drop every partition that ended before the retention window"""
+        cutoff = datetime.utcnow() - self.retention
+        dropped = 0
+        for name in self._partitions(refresh=True):
+            if self.partition_start(name) + self.partition_span <= cutoff:
+                self.db.drop_collection(name)
+                self.known_partitions.discard(name)
+                self.indexed_partitions.discard(name)
+                dropped += 1
+        return dropped
+    
+    def get_message_statistics(self) -> Dict:
+        """Message counts for the admin dashboard"""
+        now = datetime.utcnow()
+        live = {"is_deleted": False}
+        total_messages = sum(self.db[name].count_documents(live) for name in self._partitions())
+        
+        day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        since = min(day_start, now - timedelta(hours=24))
+        pipeline = [
+            {"$match": {"timestamp": {"$gte": since, "$lt": now}, "is_deleted": False}},
+            *_message_statistics_stages(now, day_start, "$timestamp")
+        ]
+        groups = [group for name in self._partitions_between(since, now) for group in self.db[name].aggregate(pipeline)]
+        return _message_statistics(total_messages, now, groups)
+
+class Database(StorageBackend):
     """MongoDB database manager for TacticalLink"""
     
-    def __init__(self):
+    def __init__(self, mongodb_url: Optional[str] = None, database_name: str = 'tactical_link'):
+        self.mongodb_url = mongodb_url
+        self.database_name = database_name
         self.client = None
         self.db = None
+        self.message_store = None
+        self.message_listeners = []
         self.connect()
+        self._configure_message_storage()
         self.create_indexes()
     
     def connect(self):
         """Connect to MongoDB"""
         try:
             # Use Railway MongoDB URL or local fallback
-            mongodb_url = os.getenv('MONGODB_URL', 'mongodb://localhost:27017/tactical_link')
+            mongodb_url = self.mongodb_url or os.getenv('MONGODB_URL', 'mongodb://localhost:27017/tactical_link')
             self.client = MongoClient(mongodb_url, serverSelectionTimeoutMS=5000)
-            self.db = self.client.tactical_link
+            self.db = self.client[self.database_name]
             
             # Test connection
             self.client.admin.command('ping')
@@ -39,6 +953,47 @@ class Database:
             print(f"Failed to connect to MongoDB: {e}")
             raise
     
+    def _configure_message_storage(self):
+        """Select the message storage layout from MESSAGE_STORAGE_MODE"""
+        mode = os.getenv('MESSAGE_STORAGE_MODE', MESSAGE_STORAGE_DOCUMENT).lower()
+        if mode == MESSAGE_STORAGE_BUCKET:
+            self.message_store = MessageBucketStore(
+                self.db,
+                bucket_size=int(os.getenv('MESSAGE_BUCKET_SIZE', 200)),
+                bucket_span=int(os.getenv('MESSAGE_BUCKET_SPAN', 3600))
+            )
+            print("Using bucketed message storage")
+        elif mode == MESSAGE_STORAGE_PARTITIONED:
+            self.message_store = MessagePartitionRouter(
+                self.db,
+                granularity=os.getenv('MESSAGE_PARTITION_GRANULARITY', 'day').lower(),
+                retention=timedelta(days=float(os.getenv('MESSAGE_RETENTION_DAYS', 30)))
+            )
+            print("Using time-partitioned message storage")
+        elif mode != MESSAGE_STORAGE_DOCUMENT:
+            raise ValueError(f"Unknown MESSAGE_STORAGE_MODE: {mode}")
+        
+        expiry_mode = os.getenv('MESSAGE_EXPIRY_MODE', EXPIRY_MODE_POLL).lower()
+        if expiry_mode not in (EXPIRY_MODE_POLL, EXPIRY_MODE_TTL):
+            raise ValueError(f"Unknown MESSAGE_EXPIRY_MODE: {expiry_mode}")
+        if expiry_mode == EXPIRY_MODE_TTL and self.message_store:
+            # A TTL index would remove whole buckets or partitions, not single messages
+            raise ValueError("MESSAGE_EXPIRY_MODE=ttl requires MESSAGE_STORAGE_MODE=document")
+        self.expiry_mode = expiry_mode
+    
+    def _ensure_expiry_index(self, collection, field: str):
+        """Index an expiry field, as a TTL index removing documents at that time in TTL mode"""
+        ttl = self.expiry_mode == EXPIRY_MODE_TTL
+        index = collection.index_information().get(f"{field}_1")
+        if index and ('expireAfterSeconds' in index) != ttl:
+            # The expiry mode changed; an index cannot be converted in both directions
+            collection.drop_index(f"{field}_1")
+        
+        if ttl:
+            collection.create_index(field, expireAfterSeconds=0)
+        else:
+            collection.create_index(field)
+    
     def create_indexes(self):
         """Create database indexes for performance"""
         try:
@@ -51,17 +1006,43 @@ class Database:
             self.db.messages.create_index("sender_id")
             self.db.messages.create_index("recipient_id")
             self.db.messages.create_index("timestamp")
-            self.db.messages.create_index("destruct_at")
+            self._ensure_expiry_index(self.db.messages, "destruct_at")
+            self.db.messages.create_index("deleted_at", partialFilterExpression={"is_deleted": True})
             self.db.messages.create_index([("sender_id", 1), ("recipient_id", 1)])
             
+            # Bucket or partition collection indexes
+            if self.message_store:
+                self.message_store.create_indexes()
+            
             # Threat logs collection indexes
             self.db.threat_logs.create_index("user_id")
             self.db.threat_logs.create_index("timestamp")
             self.db.threat_logs.create_index("threat_score")
+            # log_migration.py scans resolved logs in _id order
+            self.db.threat_logs.create_index([("is_resolved", 1), ("_id", 1)])
             
             # Session keys collection indexes
             self.db.session_keys.create_index("key_id", unique=True)
-            self.db.session_keys.create_index("expires_at")
+            self._ensure_expiry_index(self.db.session_keys, "expires_at")
+            
+            # System logs collection indexes
+            self.db.system_logs.create_index("timestamp")
+            self.db.system_logs.create_index([("event_type", 1), ("timestamp", -1)])
+            
+            # Leases collection index (abandoned leases are removed an hour after expiry)
+            self.db.leases.create_index("expires_at", expireAfterSeconds=3600)
+            
+            # Behavior of users idle for THREAT_BEHAVIOR_IDLE_SECONDS is dropped
+            idle_seconds = int(float(os.getenv('THREAT_BEHAVIOR_IDLE_SECONDS', 86400)))
+            index = self.db.user_behavior.index_information().get("updated_at_1")
+            if index and index.get('expireAfterSeconds') != idle_seconds:
+                self.db.user_behavior.drop_index("updated_at_1")
+            self.db.user_behavior.create_index("updated_at", expireAfterSeconds=idle_seconds)
+            
+            # After log_migration.py the server expires system and resolved threat logs itself
+            self.log_retention_managed = is_timeseries(self.db, SYSTEM_LOGS)
+            if self.log_retention_managed:
+                self.db[RESOLVED_THREAT_LOGS].create_index([("user_id", 1), ("timestamp", -1)])
             
             print("Database indexes created successfully")
             
@@ -102,23 +1083,6 @@ class Database:
             print(f"Error getting user by username: {e}")
             return None
     
-    def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
-        """Authenticate user with username and password"""
-        try:
-            user = self.get_user_by_username(username)
-            if not user:
-                return None
-            
-            # Create User object to check password
-            user_obj = User.from_dict(user)
-            if user_obj.check_password(password):
-                return user
-            return None
-            
-        except Exception as e:
-            print(f"Error authenticating user: {e}")
-            return None
-    
     def update_last_login(self, user_id: str):
         """Update user's last login timestamp"""
         try:
@@ -129,6 +1093,17 @@ class Database:
         except Exception as e:
             print(f"Error updating last login: {e}")
     
+    def update_user_activity(self, activity: Dict[str, Dict[str, datetime]]) -> int:
+        """Apply coalesced activity timestamps in one bulk write"""
+        if not activity:
+            return 0
+        requests = [
+            UpdateOne({"_id": ObjectId(user_id)}, {"$max": fields})
+            for user_id, fields in activity.items()
+        ]
+        result = self.db.users.bulk_write(requests, ordered=False)
+        return result.modified_count
+    
     def get_all_users(self) -> List[Dict]:
         """Get all users (admin function)"""
         try:
@@ -155,15 +1130,22 @@ class Database:
     def create_message(self, message: Message) -> str:
         """Create a new message"""
         try:
-            message_dict = message.to_dict()
-            result = self.db.messages.insert_one(message_dict)
-            return str(result.inserted_id)
+            if self.message_store:
+                message_id = self.message_store.append(message)
+            else:
+                message_id = str(self.db.messages.insert_one(message.to_dict()).inserted_id)
+            
+            self._notify_message_listeners('insert', {**message.to_dict(), '_id': message_id})
+            return message_id
         except Exception as e:
             raise Exception(f"Error creating message: {e}")
     
     def get_message_by_id(self, message_id: str) -> Optional[Dict]:
         """Get message by ID"""
         try:
+            if self.message_store:
+                return self.message_store.get_message(message_id)
+            
             message = self.db.messages.find_one({"_id": ObjectId(message_id)})
             if message:
                 message['_id'] = str(message['_id'])
@@ -172,9 +1154,28 @@ class Database:
             print(f"Error getting message by ID: {e}")
             return None
     
+    def get_messages_by_ids(self, message_ids: List[str]) -> List[Dict]:
+        """Get messages by ID with one query"""
+        try:
+            if not message_ids:
+                return []
+            if self.message_store:
+                return self.message_store.get_messages(message_ids)
+            
+            messages = list(self.db.messages.find({"_id": {"$in": [ObjectId(m) for m in message_ids]}}))
+            for message in messages:
+                message['_id'] = str(message['_id'])
+            return messages
+        except Exception as e:
+            print(f"Error getting messages by ID: {e}")
+            return []
+    
     def get_pending_messages(self, user_id: str) -> List[Dict]:
         """Get pending messages for a user"""
         try:
+            if self.message_store:
+                return self.message_store.get_pending_messages(user_id)
+            
             messages = list(self.db.messages.find({
                 "recipient_id": user_id,
                 "is_read": False,
@@ -196,6 +1197,10 @@ class Database:
     def mark_message_as_read(self, message_id: str):
         """Mark message as read"""
         try:
+            if self.message_store:
+                self.message_store.update_message(message_id, {"is_read": True})
+                return
+            
             self.db.messages.update_one(
                 {"_id": ObjectId(message_id)},
                 {"$set": {"is_read": True}}
@@ -203,19 +1208,185 @@ class Database:
         except Exception as e:
             print(f"Error marking message as read: {e}")
     
-    def delete_message(self, message_id: str):
-        """Delete a message"""
+    def delete_message(self, message_id: str) -> bool:
+        """Delete a message, returning whether this call deleted it"""
         try:
-            self.db.messages.update_one(
-                {"_id": ObjectId(message_id)},
-                {"$set": {"is_deleted": True, "deleted_at": datetime.utcnow()}}
-            )
+            if self.message_store:
+                deleted = self.message_store.update_message(
+                    message_id,
+                    {"is_deleted": True, "deleted_at": datetime.utcnow()},
+                    only_if_live=True
+                )
+            else:
+                result = self.db.messages.update_one(
+                    {"_id": ObjectId(message_id), "is_deleted": False},
+                    {"$set": {"is_deleted": True, "deleted_at": datetime.utcnow()}}
+                )
+                deleted = result.modified_count > 0
+            
+            if deleted:
+                self._notify_message_listeners('delete', {'_id': message_id})
+            return deleted
         except Exception as e:
             print(f"Error deleting message: {e}")
+            return False
+    
+    def delete_messages(self, message_ids: List[str]) -> List[str]:
+        """Delete live messages in bulk, returning the IDs this call deleted"""
+        try:
+            if not message_ids:
+                return []
+            
+            now = datetime.utcnow()
+            if self.message_store:
+                deleted = self.message_store.delete_messages(message_ids, now)
+            else:
+                won = _delete_live_documents(self.db.messages, [ObjectId(m) for m in message_ids], now)
+                deleted = [str(object_id) for object_id in won]
+            
+            for message_id in deleted:
+                self._notify_message_listeners('delete', {'_id': message_id})
+            return deleted
+        except Exception as e:
+            print(f"Error deleting messages: {e}")
+            return []
+    
+    def set_message_destruct_at(self, message_id: str, destruct_at: Optional[datetime]):
+        """Set or clear the self-destruct time of a message"""
+        try:
+            if self.message_store:
+                self.message_store.update_message(message_id, {"destruct_at": destruct_at})
+                return
+            
+            if destruct_at is None:
+                update = {"$unset": {"destruct_at": 1}}
+            else:
+                update = {"$set": {"destruct_at": destruct_at}}
+            self.db.messages.update_one({"_id": ObjectId(message_id)}, update)
+        except Exception as e:
+            print(f"Error setting message destruct time: {e}")
+    
+    def set_messages_destruct_at(self, deadlines: Dict[str, Optional[datetime]]) -> List[str]:
+        """Set or clear self-destruct times of live messages in bulk, returning the IDs updated"""
+        try:
+            if not deadlines:
+                return []
+            
+            if self.message_store:
+                return self.message_store.set_destruct_at(deadlines)
+            
+            updated = _set_live_destruct_at(
+                self.db.messages,
+                {ObjectId(message_id): destruct_at for message_id, destruct_at in deadlines.items()}
+            )
+            return [str(object_id) for object_id in updated]
+        except Exception as e:
+            print(f"Error setting message destruct times: {e}")
+            return []
+    
+    def get_expired_messages(self, since: Optional[datetime] = None, limit: int = 0) -> List[Dict]:
+        """Get live messages whose self-destruct time has passed, soonest first"""
+        try:
+            now = datetime.utcnow()
+            if self.message_store:
+                return self.message_store.get_expired_messages(now, since, limit)
+            
+            due = {"$lt": now, "$gte": since} if since else {"$lt": now}
+            messages = list(self.db.messages.find({
+                "destruct_at": due,
+                "is_deleted": False
+            }).sort("destruct_at", 1).limit(limit))
+            
+            for message in messages:
+                message['_id'] = str(message['_id'])
+            
+            return messages
+        except Exception as e:
+            print(f"Error getting expired messages: {e}")
+            return []
+    
+    def count_expired_messages(self) -> int:
+        """Count live messages whose self-destruct time has passed"""
+        try:
+            now = datetime.utcnow()
+            if self.message_store:
+                return self.message_store.count_expired_messages(now)
+            
+            return self.db.messages.count_documents({
+                "destruct_at": {"$lt": now},
+                "is_deleted": False
+            })
+        except Exception as e:
+            print(f"Error counting expired messages: {e}")
+            return 0
+    
+    def get_messages_pending_destruction(self) -> List[Dict]:
+        """Get live messages scheduled to self-destruct in the future, soonest first"""
+        try:
+            now = datetime.utcnow()
+            if self.message_store:
+                return self.message_store.get_messages_pending_destruction(now)
+            
+            messages = list(self.db.messages.find({
+                "destruct_at": {"$gt": now},
+                "is_deleted": False
+            }).sort("destruct_at", 1))
+            
+            for message in messages:
+                message['_id'] = str(message['_id'])
+            
+            return messages
+        except Exception as e:
+            print(f"Error getting messages pending destruction: {e}")
+            return []
+    
+    def iter_messages_pending_destruction(self, after: Optional[Tuple[datetime, str]] = None, limit: int = 0,
+                                          sender_id: Optional[str] = None,
+                                          recipient_id: Optional[str] = None) -> Iterator[Dict]:
+        """Stream live messages scheduled to self-destruct in the future, soonest first"""
+        try:
+            now = datetime.utcnow()
+            if self.message_store:
+                yield from self.message_store.iter_pending_destruction(now, after, limit, sender_id, recipient_id)
+                return
+            
+            query = {"destruct_at": {"$gt": now}, "is_deleted": False, **_participant_filter(sender_id, recipient_id)}
+            if after:
+                query["$or"] = [
+                    {"destruct_at": {"$gt": after[0]}},
+                    {"destruct_at": after[0], "_id": {"$gt": ObjectId(after[1])}}
+                ]
+            cursor = self.db.messages.find(query, {field: 1 for field in PENDING_DESTRUCTION_FIELDS}) \
+                .sort([("destruct_at", 1), ("_id", 1)]).limit(limit).batch_size(500)
+            
+            for message in cursor:
+                message['_id'] = str(message['_id'])
+                yield message
+        except Exception as e:
+            print(f"Error streaming messages pending destruction: {e}")
+    
+    def summarize_messages_pending_destruction(self, bucket_seconds: int = 60, sender_id: Optional[str] = None,
+                                               recipient_id: Optional[str] = None) -> List[Dict]:
+        """Count messages pending destruction per bucket of destruct_at with one $group"""
+        try:
+            now = datetime.utcnow()
+            if self.message_store:
+                return self.message_store.summarize_pending_destruction(now, bucket_seconds, sender_id, recipient_id)
+            
+            return _destruction_summary(self.db.messages.aggregate([
+                {"$match": {"destruct_at": {"$gt": now}, "is_deleted": False, **_participant_filter(sender_id, recipient_id)}},
+                *_destruction_summary_stages("$destruct_at", "$read_once", bucket_seconds)
+            ]))
+        except Exception as e:
+            print(f"Error summarizing messages pending destruction: {e}")
+            return []
     
     def get_user_recent_messages(self, user_id: str, limit: int = 50) -> List[Dict]:
         """Get user's recent messages for threat analysis"""
         try:
+            if self.message_store:
+                return self.message_store.get_user_recent_messages(user_id, limit)
+            
             messages = list(self.db.messages.find({
                 "$or": [
                     {"sender_id": user_id},
@@ -232,9 +1403,24 @@ class Database:
             print(f"Error getting user recent messages: {e}")
             return []
     
+    def get_users_recent_activity(self, user_ids: List[str], limit: int = 10) -> Dict[str, List[Dict]]:
+        """Get the latest messages of many users with one aggregation"""
+        try:
+            if not user_ids:
+                return {}
+            if self.message_store:
+                return self.message_store.get_users_recent_activity(user_ids, limit)
+            return _recent_activity(self.db.messages, user_ids, limit)
+        except Exception as e:
+            print(f"Error getting users recent activity: {e}")
+            return {}
+    
     def get_conversation_messages(self, user1_id: str, user2_id: str, limit: int = 100) -> List[Dict]:
         """Get conversation messages between two users"""
         try:
+            if self.message_store:
+                return self.message_store.get_conversation_messages(user1_id, user2_id, limit)
+            
             messages = list(self.db.messages.find({
                 "$or": [
                     {"sender_id": user1_id, "recipient_id": user2_id},
@@ -254,31 +1440,20 @@ class Database:
     def get_message_statistics(self) -> Dict:
         """Get message statistics for admin dashboard"""
         try:
+            if self.message_store:
+                return self.message_store.get_message_statistics()
+            
+            now = datetime.utcnow()
             total_messages = self.db.messages.count_documents({"is_deleted": False})
-            messages_today = self.db.messages.count_documents({
-                "timestamp": {"$gte": datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)},
-                "is_deleted": False
-            })
             
-            # Get messages by hour for the last 24 hours
-            hourly_stats = []
-            for i in range(24):
-                hour_start = datetime.utcnow() - timedelta(hours=i+1)
-                hour_end = datetime.utcnow() - timedelta(hours=i)
-                count = self.db.messages.count_documents({
-                    "timestamp": {"$gte": hour_start, "$lt": hour_end},
-                    "is_deleted": False
-                })
-                hourly_stats.append({
-                    "hour": hour_start.hour,
-                    "count": count
-                })
-            
-            return {
-                "total_messages": total_messages,
-                "messages_today": messages_today,
-                "hourly_stats": hourly_stats
-            }
+            # Messages by hour for the last 24 hours, counted in one aggregation
+            day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            since = min(day_start, now - timedelta(hours=24))
+            groups = self.db.messages.aggregate([
+                {"$match": {"timestamp": {"$gte": since, "$lt": now}, "is_deleted": False}},
+                *_message_statistics_stages(now, day_start, "$timestamp")
+            ])
+            return _message_statistics(total_messages, now, groups)
         except Exception as e:
             print(f"Error getting message statistics: {e}")
             return {"total_messages": 0, "messages_today": 0, "hourly_stats": []}
@@ -293,13 +1468,25 @@ class Database:
         except Exception as e:
             raise Exception(f"Error creating threat log: {e}")
     
+    def _find_threat_logs(self, query: Dict, limit: int) -> List[Dict]:
+        """Newest threat logs matching query, including resolved ones in the time-series collection"""
+        collections = [self.db.threat_logs]
+        if self.log_retention_managed:
+            collections.append(self.db[RESOLVED_THREAT_LOGS])
+        
+        threat_logs = heapq.nlargest(
+            limit,
+            itertools.chain.from_iterable(c.find(query).sort("timestamp", -1).limit(limit) for c in collections),
+            key=lambda log: log['timestamp']
+        )
+        for log in threat_logs:
+            log['_id'] = str(log['_id'])
+        return threat_logs
+    
     def get_recent_threat_logs(self, limit: int = 20) -> List[Dict]:
         """Get recent threat logs"""
         try:
-            threat_logs = list(self.db.threat_logs.find().sort("timestamp", -1).limit(limit))
-            for log in threat_logs:
-                log['_id'] = str(log['_id'])
-            return threat_logs
+            return self._find_threat_logs({}, limit)
         except Exception as e:
             print(f"Error getting recent threat logs: {e}")
             return []
@@ -307,18 +1494,49 @@ class Database:
     def get_user_threat_logs(self, user_id: str, limit: int = 10) -> List[Dict]:
         """Get threat logs for a specific user"""
         try:
-            threat_logs = list(self.db.threat_logs.find({
-                "user_id": user_id
-            }).sort("timestamp", -1).limit(limit))
-            
-            for log in threat_logs:
-                log['_id'] = str(log['_id'])
-            
-            return threat_logs
+            return self._find_threat_logs({"user_id": user_id}, limit)
         except Exception as e:
             print(f"Error getting user threat logs: {e}")
             return []
     
+    def resolve_threat_log(self, log_id: str, resolved_by: str) -> bool:
+        """Mark an unresolved threat log resolved, returning whether this call resolved it
+        
+        With server-managed retention the log moves to the resolved_threat_logs
+        time-series collection, since time-series documents cannot be updated
+        in place.
+        """
+        try:
+            resolution = {"is_resolved": True, "resolved_at": datetime.utcnow(), "resolved_by": resolved_by}
+            query = {"_id": ObjectId(log_id), "is_resolved": False}
+            if not self.log_retention_managed:
+                return self.db.threat_logs.update_one(query, {"$set": resolution}).modified_count > 0
+            
+            log = self.db.threat_logs.find_one_and_delete(query)
+            if not log:
+                return False
+            try:
+                self.db[RESOLVED_THREAT_LOGS].insert_one({**log, **resolution})
+            except Exception:
+                self.db.threat_logs.insert_one(log)
+                raise
+            return True
+        except Exception as e:
+            print(f"Error resolving threat log: {e}")
+            return False
+    
+    def delete_old_threat_logs(self, cutoff: datetime) -> int:
+        """Delete resolved threat logs older than cutoff"""
+        try:
+            result = self.db.threat_logs.delete_many({
+                "timestamp": {"$lt": cutoff},
+                "is_resolved": True
+            })
+            return result.deleted_count
+        except Exception as e:
+            print(f"Error deleting old threat logs: {e}")
+            return 0
+    
     # Session key operations
     def create_session_key(self, session_key: SessionKey) -> str:
         """Create a new session key"""
@@ -350,10 +1568,180 @@ class Database:
         except Exception as e:
             print(f"Error destroying session key: {e}")
     
+    def count_expired_keys(self) -> int:
+        """Count expired session keys not yet destroyed"""
+        try:
+            return self.db.session_keys.count_documents({
+                "expires_at": {"$lt": datetime.utcnow()},
+                "is_destroyed": False
+            })
+        except Exception as e:
+            print(f"Error counting expired keys: {e}")
+            return 0
+    
+    # System log operations
+    def log_system_event(self, log_entry: Dict) -> str:
+        """Store a system log entry"""
+        try:
+            result = self.db.system_logs.insert_one({'timestamp': datetime.utcnow(), **log_entry})
+            return str(result.inserted_id)
+        except Exception as e:
+            raise Exception(f"Error logging system event: {e}")
+    
+    def log_system_events(self, log_entries: List[Dict]) -> int:
+        """Store several system log entries in one write"""
+        if not log_entries:
+            return 0
+        try:
+            now = datetime.utcnow()
+            result = self.db.system_logs.insert_many([{'timestamp': now, **entry} for entry in log_entries], ordered=False)
+            return len(result.inserted_ids)
+        except Exception as e:
+            raise Exception(f"Error logging system events: {e}")
+    
+    def get_recent_system_logs(self, limit: int = 50, event_type: Optional[str] = None) -> List[Dict]:
+        """Get recent system logs"""
+        try:
+            query = {"event_type": event_type} if event_type else {}
+            logs = list(self.db.system_logs.find(query).sort("timestamp", -1).limit(limit))
+            for log in logs:
+                log['_id'] = str(log['_id'])
+            return logs
+        except Exception as e:
+            print(f"Error getting recent system logs: {e}")
+            return []
+    
+    def delete_old_system_logs(self, cutoff: datetime) -> int:
+        """Delete system logs older than cutoff"""
+        try:
+            result = self.db.system_logs.delete_many({"timestamp": {"$lt": cutoff}})
+            return result.deleted_count
+        except Exception as e:
+            print(f"Error deleting old system logs: {e}")
+            return 0
+    
+    # Leases
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew a lease unless another owner holds an unexpired one"""
+        now = datetime.utcnow()
+        try:
+            self.db.leases.find_one_and_update(
+                {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+                {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl), "heartbeat_at": now}},
+                upsert=True
+            )
+            return True
+        except DuplicateKeyError:
+            # The lease exists and is held by someone else
+            return False
+        except Exception as e:
+            print(f"Error acquiring lease {name}: {e}")
+            return False
+    
+    def release_lease(self, name: str, owner: str):
+        """Give up a lease held by owner"""
+        try:
+            self.db.leases.delete_one({"_id": name, "owner": owner})
+        except Exception as e:
+            print(f"Error releasing lease {name}: {e}")
+    
+    # Background job state
+    def get_job_state(self, job_name: str) -> Optional[Dict]:
+        """Get the checkpoint saved by a background job"""
+        try:
+            state = self.db.job_state.find_one({"_id": job_name})
+            if state:
+                state.pop('_id')
+            return state
+        except Exception as e:
+            print(f"Error getting job state: {e}")
+            return None
+    
+    def save_job_state(self, job_name: str, state: Dict):
+        """Replace the checkpoint of a background job"""
+        self.db.job_state.replace_one({"_id": job_name}, dict(state), upsert=True)
+    
+    # Threat behavior features
+    def record_user_behavior(self, user_id: str, message_length: int, timestamp: datetime,
+                             window: int = 100) -> Optional[Dict]:
+        """Append a message length to a user's behavior window in one atomic write"""
+        try:
+            return self.db.user_behavior.find_one_and_update(
+                {"_id": user_id},
+                {
+                    "$push": {"lengths": {"$each": [message_length], "$slice": -window}},
+                    "$inc": {"message_count": 1, "suspicious_count": 0},
+                    "$max": {"last_activity": timestamp},
+                    "$set": {"updated_at": datetime.utcnow()}
+                },
+                projection=USER_BEHAVIOR_PROJECTION,
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            print(f"Error recording behavior for {user_id}: {e}")
+            return None
+    
+    def record_users_behavior(self, messages: List[Tuple[str, int, datetime]],
+                              window: int = 100) -> Dict[str, Dict]:
+        """Append a batch of message lengths in one bulk write, then read the windows back in one query"""
+        by_user = {}
+        for user_id, message_length, timestamp in messages:
+            by_user.setdefault(user_id, []).append((message_length, timestamp))
+        if not by_user:
+            return {}
+        
+        try:
+            now = datetime.utcnow()
+            self.db.user_behavior.bulk_write([
+                UpdateOne(
+                    {"_id": user_id},
+                    {
+                        "$push": {"lengths": {"$each": [length for length, _ in records], "$slice": -window}},
+                        "$inc": {"message_count": len(records), "suspicious_count": 0},
+                        "$max": {"last_activity": max(timestamp for _, timestamp in records)},
+                        "$set": {"updated_at": now}
+                    },
+                    upsert=True
+                )
+                for user_id, records in by_user.items()
+            ], ordered=False)
+            behaviors = self.db.user_behavior.find(
+                {"_id": {"$in": list(by_user)}}, {**USER_BEHAVIOR_PROJECTION, "_id": 1}
+            )
+            return {behavior.pop("_id"): behavior for behavior in behaviors}
+        except Exception as e:
+            print(f"Error recording behavior for {len(by_user)} users: {e}")
+            return {}
+    
+    def mark_user_suspicious(self, user_id: str) -> Optional[Dict]:
+        """Count a suspicious event against a recorded user in one atomic write"""
+        try:
+            return self.db.user_behavior.find_one_and_update(
+                {"_id": user_id},
+                {"$inc": {"suspicious_count": 1}, "$set": {"updated_at": datetime.utcnow()}},
+                projection=USER_BEHAVIOR_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+        except Exception as e:
+            print(f"Error marking {user_id} suspicious: {e}")
+            return None
+    
+    def get_user_behavior(self, user_id: str) -> Optional[Dict]:
+        """Get a user's behavior aggregate"""
+        try:
+            return self.db.user_behavior.find_one({"_id": user_id}, USER_BEHAVIOR_PROJECTION)
+        except Exception as e:
+            print(f"Error getting behavior for {user_id}: {e}")
+            return None
+    
     # Cleanup operations
     def cleanup_expired_messages(self):
         """Clean up expired self-destruct messages"""
         try:
+            if self.message_store:
+                return self.message_store.cleanup_expired_messages()
+            
             result = self.db.messages.update_many(
                 {
                     "destruct_at": {"$lt": datetime.utcnow()},
@@ -366,6 +1754,28 @@ class Database:
             print(f"Error cleaning up expired messages: {e}")
             return 0
     
+    def apply_message_retention(self) -> int:
+        """Drop message partitions past retention"""
+        try:
+            if isinstance(self.message_store, MessagePartitionRouter):
+                dropped = self.message_store.drop_expired_partitions()
+                if dropped:
+                    print(f"Dropped {dropped} expired message partitions")
+                return dropped
+            return 0
+        except Exception as e:
+            print(f"Error applying message retention: {e}")
+            return 0
+    
+    def purge_deleted_messages(self, cutoff: datetime, batch_size: int = 500,
+                               resume_after: Optional[str] = None) -> Dict:
+        """Hard-delete one batch of messages soft-deleted before cutoff"""
+        if self.message_store:
+            return self.message_store.purge_deleted_messages(cutoff, batch_size, resume_after)
+        
+        documents, size = _purge_deleted_batch(self.db.messages, cutoff, batch_size)
+        return {'documents': documents, 'bytes': size, 'resume_after': None, 'done': documents < batch_size}
+    
     def cleanup_expired_keys(self):
         """Clean up expired session keys"""
         try:
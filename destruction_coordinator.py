@@ -0,0 +1,129 @@
+"""
+TacticalLink Destruction Coordinator
+Shares expired-message destruction between workers through leased time-range shards
+"""
+
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+class DestructionCoordinator:
+    """Claims time-range shards of expired messages with leases
+    
+    The destruct_at timeline is cut into ``shard_span``-second shards. A
+    worker walks the shards holding expired messages, takes each shard's lease
+    through the storage backend (a ``find_one_and_update`` on MongoDB),
+    destroys the shard's messages in batches and renews the lease between
+    batches as its heartbeat. Shards held by live workers are skipped; a
+    lease that is not renewed within ``lease_ttl`` seconds can be taken over.
+    ``destroy`` receives a whole batch and returns how many it destroyed; it
+    must be idempotent across workers (a conditional soft delete), so a
+    message is destroyed once even around a lease takeover.
+    """
+    
+    def __init__(self, db, destroy: Callable[[List[Dict]], int], owner: Optional[str] = None,
+                 shard_span: int = 60, lease_ttl: float = 30.0, batch_size: int = 200):
+        self.db = db
+        self.destroy = destroy
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.shard_span = shard_span
+        self.lease_ttl = lease_ttl
+        self.batch_size = batch_size
+        self.stop_event = threading.Event()
+        self.stats = {
+            'runs': 0, 'shards_claimed': 0, 'shards_contended': 0, 'leases_lost': 0, 'destroyed': 0,
+            'batches': 0, 'last_run_destroyed': 0, 'throughput': 0.0
+        }
+    
+    def _shard_start(self, destruct_at: datetime) -> datetime:
+        epoch = int((destruct_at - datetime(1970, 1, 1)).total_seconds())
+        return datetime.utcfromtimestamp(epoch - epoch % self.shard_span)
+    
+    def _lease_name(self, shard_start: datetime) -> str:
+        return f"destruction:{self.shard_span}:{shard_start.isoformat()}"
+    
+    def run_once(self) -> int:
+        """Claim and drain every unleased shard that has expired messages"""
+        destroyed = 0
+        since = None
+        started = time.monotonic()
+        self.stats['runs'] += 1
+        while not self.stop_event.is_set():
+            earliest = self.db.get_expired_messages(since=since, limit=1)
+            if not earliest:
+                break
+            
+            shard_start = self._shard_start(earliest[0]['destruct_at'])
+            since = shard_start + timedelta(seconds=self.shard_span)
+            lease = self._lease_name(shard_start)
+            if not self.db.acquire_lease(lease, self.owner, self.lease_ttl):
+                self.stats['shards_contended'] += 1
+                continue
+            
+            self.stats['shards_claimed'] += 1
+            try:
+                destroyed += self._drain(shard_start, lease)
+            finally:
+                self.db.release_lease(lease, self.owner)
+        
+        self.stats['destroyed'] += destroyed
+        self.stats['last_run_destroyed'] = destroyed
+        if destroyed:
+            self.stats['throughput'] = destroyed / max(time.monotonic() - started, 1e-6)
+        return destroyed
+    
+    def _drain(self, shard_start: datetime, lease: str) -> int:
+        """Destroy a claimed shard's expired messages, renewing the lease per batch"""
+        shard_end = shard_start + timedelta(seconds=self.shard_span)
+        destroyed = 0
+        while not self.stop_event.is_set():
+            batch = [
+                message for message in self.db.get_expired_messages(since=shard_start, limit=self.batch_size)
+                if message['destruct_at'] < shard_end
+            ]
+            progressed = self.destroy(batch) if batch else 0
+            self.stats['batches'] += 1
+            destroyed += progressed
+            
+            # Nothing left, or only messages that keep failing to destroy
+            if not progressed:
+                break
+            
+            if not self.db.acquire_lease(lease, self.owner, self.lease_ttl):
+                print(f"Lost destruction lease {lease}")
+                self.stats['leases_lost'] += 1
+                break
+        return destroyed
+    
+    def run(self, poll_interval: float = 5.0):
+        """Claim shards until stop() is called"""
+        self.stop_event.clear()
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Error claiming destruction shards: {e}")
+            self.stop_event.wait(poll_interval)
+    
+    def stop(self):
+        """Stop claiming shards"""
+        self.stop_event.set()
+    
+    def get_statistics(self) -> Dict:
+        """Coordinator statistics for monitoring
+        
+        ``throughput`` is messages destroyed per second during the last run
+        that destroyed any; ``backlog`` is the number of expired live messages
+        still waiting.
+        """
+        return {
+            'owner': self.owner,
+            'shard_span': self.shard_span,
+            'batch_size': self.batch_size,
+            'backlog': self.db.count_expired_messages(),
+            **self.stats
+        }
@@ -0,0 +1,119 @@
+"""
+TacticalLink Destruction Metrics
+Measures how late self-destructing messages are actually destroyed
+"""
+
+import bisect
+import threading
+from typing import Dict, Iterable, List, Optional
+
+from clock import SystemClock
+
+# Upper bounds in seconds of the lag histogram buckets; the last bucket is unbounded
+LAG_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+class LagHistogram:
+    """Fixed-bucket histogram of destruction lag in seconds
+    
+    Recording is a bisect and an increment, so it can sit on the destruction
+    path. Percentiles resolve to the upper bound of the bucket they fall in
+    (the largest observed lag for the unbounded bucket), which never
+    understates the lag.
+    """
+    
+    def __init__(self, bounds: Iterable[float] = LAG_BUCKETS):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+    
+    def record(self, lag: float):
+        lag = max(lag, 0.0)
+        self.counts[bisect.bisect_left(self.bounds, lag)] += 1
+        self.count += 1
+        self.total += lag
+        self.max = max(self.max, lag)
+    
+    def percentile(self, p: float) -> Optional[float]:
+        """Upper bound of the bucket holding the p-th percentile, None when empty"""
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+    
+    def to_dict(self) -> Dict:
+        buckets = {str(bound): count for bound, count in zip(self.bounds, self.counts)}
+        buckets['+Inf'] = self.counts[-1]
+        return {
+            'count': self.count,
+            'sum': round(self.total, 3),
+            'max': round(self.max, 3),
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'buckets': buckets
+        }
+
+class DestructionMetrics:
+    """Destruction lag histograms and the lag SLO alert for one worker
+    
+    ``histogram`` accumulates since start-up. The SLO is judged on a rolling
+    window of ``window`` seconds so the alert clears once destructions are on
+    time again; until the current window has samples the previous one is used.
+    Windows are timed on ``clock``, the scheduler's, so simulations on a
+    VirtualClock rotate them in virtual time.
+    """
+    
+    def __init__(self, slo: float = 5.0, window: float = 300.0, clock=None):
+        self.slo = slo
+        self.window = window
+        self.clock = clock or SystemClock()
+        self.histogram = LagHistogram()
+        self.current = LagHistogram()
+        self.previous = LagHistogram()
+        self.window_started = self.clock.monotonic()
+        self.lock = threading.Lock()
+    
+    def _rotate(self):
+        now = self.clock.monotonic()
+        if now - self.window_started >= self.window:
+            self.previous = self.current
+            self.current = LagHistogram()
+            self.window_started = now
+    
+    def record(self, lags: List[float]):
+        """Record the lag between destruct_at and the actual delete for each destroyed message"""
+        with self.lock:
+            self._rotate()
+            for lag in lags:
+                self.histogram.record(lag)
+                self.current.record(lag)
+    
+    def window_p99(self) -> Optional[float]:
+        with self.lock:
+            self._rotate()
+            window = self.current if self.current.count else self.previous
+            return window.percentile(99)
+    
+    def get_statistics(self, queue_depth: int, overdue: int) -> Dict:
+        """Lag histogram, queue depth, overdue count and SLO state"""
+        p99 = self.window_p99()
+        with self.lock:
+            histogram = self.histogram.to_dict()
+        return {
+            'lag_seconds': histogram,
+            'queue_depth': queue_depth,
+            'overdue_messages': overdue,
+            'slo': {
+                'p99_lag_seconds': self.slo,
+                'window_seconds': self.window,
+                'window_p99': p99,
+                'alert': p99 is not None and p99 > self.slo
+            }
+        }
@@ -0,0 +1,177 @@
+"""
+TacticalLink Destruction Queue
+Deadline-ordered schedule of pending message self-destructs
+"""
+
+import heapq
+import itertools
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from clock import SystemClock
+
+# Heap entry layout: [destruct_at, sequence, message_id, read_once, created_at]
+DESTRUCT_AT, SEQUENCE, MESSAGE_ID, READ_ONCE, CREATED_AT = range(5)
+
+class DestructionQueue:
+    """Min-heap of pending destructions keyed by destruct_at
+    
+    Scheduling is O(log n). Cancelling marks the heap entry dead in O(1); dead
+    entries are skipped when they reach the top and the heap is rebuilt once
+    they outnumber live ones. Entries are plain lists rather than dicts so
+    millions of pending timers stay affordable. ``clock`` supplies the time
+    and the waits, so a virtual clock can drive the queue in simulations.
+    """
+    
+    def __init__(self, clock=None):
+        self.clock = clock or SystemClock()
+        self.heap = []
+        self.entries = {}
+        self.sequence = itertools.count()
+        self.dead = 0
+        self.closed = False
+        self.condition = threading.Condition()
+    
+    def __len__(self) -> int:
+        return len(self.entries)
+    
+    def schedule(self, message_id: str, destruct_at: datetime, read_once: bool = False):
+        """Schedule or reschedule a message, waking the waiter if it is now the earliest"""
+        with self.condition:
+            self._remove(message_id)
+            entry = [destruct_at, next(self.sequence), message_id, read_once, self.clock.now()]
+            self.entries[message_id] = entry
+            heapq.heappush(self.heap, entry)
+            if self.heap[0] is entry:
+                self.condition.notify_all()
+    
+    def schedule_many(self, tasks: List[Tuple[str, datetime, bool]]):
+        """Schedule or reschedule (message_id, destruct_at, read_once) tasks under one lock
+        
+        A batch larger than the heap is appended and heapified in O(n) rather
+        than pushed entry by entry; the waiter is woken once if the earliest
+        deadline moved.
+        """
+        with self.condition:
+            earliest = self.heap[0] if self.heap else None
+            for message_id, _, _ in tasks:
+                self._remove(message_id)
+            
+            created_at = self.clock.now()
+            entries = []
+            for message_id, destruct_at, read_once in tasks:
+                entry = [destruct_at, next(self.sequence), message_id, read_once, created_at]
+                self.entries[message_id] = entry
+                entries.append(entry)
+            
+            if len(entries) > len(self.heap):
+                self.heap.extend(entries)
+                heapq.heapify(self.heap)
+            else:
+                for entry in entries:
+                    heapq.heappush(self.heap, entry)
+            
+            if self.heap and self.heap[0] is not earliest:
+                self.condition.notify_all()
+    
+    def cancel(self, message_id: str) -> bool:
+        """Cancel a pending destruction"""
+        with self.condition:
+            return self._remove(message_id)
+    
+    def cancel_many(self, message_ids: List[str]) -> List[str]:
+        """Cancel pending destructions under one lock, returning the IDs that were queued"""
+        with self.condition:
+            return [message_id for message_id in message_ids if self._remove(message_id)]
+    
+    def _remove(self, message_id: str) -> bool:
+        entry = self.entries.pop(message_id, None)
+        if entry is None:
+            return False
+        entry[MESSAGE_ID] = None
+        self.dead += 1
+        if self.dead > len(self.entries):
+            self.heap = [e for e in self.heap if e[MESSAGE_ID] is not None]
+            heapq.heapify(self.heap)
+            self.dead = 0
+        return True
+    
+    def _discard_dead(self):
+        while self.heap and self.heap[0][MESSAGE_ID] is None:
+            heapq.heappop(self.heap)
+            self.dead -= 1
+    
+    def next_deadline(self) -> Optional[datetime]:
+        """Earliest pending destruct_at"""
+        with self.condition:
+            self._discard_dead()
+            return self.heap[0][DESTRUCT_AT] if self.heap else None
+    
+    def pop_due(self, now: Optional[datetime] = None) -> List[Dict]:
+        """Remove and return every destruction due by now, earliest first"""
+        now = now or self.clock.now()
+        due = []
+        with self.condition:
+            self._discard_dead()
+            while self.heap and self.heap[0][DESTRUCT_AT] <= now:
+                entry = heapq.heappop(self.heap)
+                if entry[MESSAGE_ID] is None:
+                    self.dead -= 1
+                    continue
+                del self.entries[entry[MESSAGE_ID]]
+                due.append(self._task(entry))
+        return due
+    
+    def wait_for_due(self) -> List[Dict]:
+        """Sleep until the earliest deadline and return everything due then as one batch
+        
+        Returns an empty list once the queue is closed.
+        """
+        with self.condition:
+            while not self.closed:
+                self._discard_dead()
+                if not self.heap:
+                    self.clock.wait(self.condition)
+                    continue
+                
+                delay = (self.heap[0][DESTRUCT_AT] - self.clock.now()).total_seconds()
+                if delay <= 0:
+                    return self.pop_due()
+                self.clock.wait(self.condition, delay)
+            return []
+    
+    def close(self):
+        """Release any waiter"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+    
+    def reopen(self):
+        with self.condition:
+            self.closed = False
+    
+    @staticmethod
+    def _task(entry: List) -> Dict:
+        return {
+            'message_id': entry[MESSAGE_ID],
+            'destruct_at': entry[DESTRUCT_AT],
+            'read_once': entry[READ_ONCE],
+            'created_at': entry[CREATED_AT],
+            'status': 'scheduled'
+        }
+    
+    def get(self, message_id: str) -> Optional[Dict]:
+        """Pending destruction for a message"""
+        with self.condition:
+            entry = self.entries.get(message_id)
+            return self._task(entry) if entry else None
+    
+    def snapshot(self, limit: Optional[int] = None) -> List[Dict]:
+        """Pending destructions, soonest first"""
+        with self.condition:
+            entries = list(self.entries.values())
+        if limit:
+            entries = heapq.nsmallest(limit, entries)
+        else:
+            entries.sort()
+        return [self._task(entry) for entry in entries]
@@ -0,0 +1,165 @@
+"""
+TacticalLink Expiry Audit
+Records destruction events for messages the MongoDB TTL monitor removes
+"""
+
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+from pymongo.errors import PyMongoError
+
+LEASE_NAME = 'ttl-expiry-audit'
+JOB_NAME = 'ttl_expiry_audit'
+
+# Ciphertext and key material are dropped server-side; only the length is kept
+AUDIT_PIPELINE = [
+    {'$match': {'operationType': 'delete'}},
+    {'$set': {'message_length': {'$strLenCP': {'$ifNull': ['$fullDocumentBeforeChange.content', '']}}}},
+    {'$project': {
+        'fullDocumentBeforeChange.content': 0,
+        'fullDocumentBeforeChange.original_content': 0,
+        'fullDocumentBeforeChange.session_key': 0
+    }}
+]
+
+class ExpiryAuditor:
+    """Turns TTL deletes on ``messages`` into message_destruction system logs
+    
+    One worker at a time holds the audit lease and tails a change stream of
+    deletes, writing audit records in batches and checkpointing the resume
+    token after each write. Another worker takes over from that token when
+    the lease is not renewed. Message pre-images (MongoDB 6.0+) supply the
+    sender, recipient and soft-delete state. A delete without one cannot be
+    told apart from compaction purging an already destroyed message, so it
+    is counted as unattributed rather than logged; without pre-image support
+    the auditor does not run at all.
+    """
+    
+    def __init__(self, db, owner: str, lease_ttl: float = 30.0, batch_size: int = 100, metrics=None):
+        self.db = db
+        self.metrics = metrics
+        self.owner = owner
+        self.lease_ttl = lease_ttl
+        self.batch_size = batch_size
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'audited': 0, 'skipped': 0, 'unattributed': 0, 'errors': 0, 'leader': False,
+                      'pre_images': None}
+    
+    def start(self):
+        """Start competing for the audit lease"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.stats['pre_images'] = self._enable_pre_images()
+        if not self.stats['pre_images']:
+            return
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop auditing and release the lease"""
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+        self.db.release_lease(LEASE_NAME, self.owner)
+    
+    def _enable_pre_images(self) -> bool:
+        try:
+            self.db.db.command('collMod', 'messages', changeStreamPreAndPostImages={'enabled': True})
+            return True
+        except PyMongoError as e:
+            print(f"Message pre-images unavailable (MongoDB 6.0+ needed), TTL expiry is not audited: {e}")
+            return False
+    
+    def _run(self):
+        while not self.stop_event.is_set():
+            if not self.db.acquire_lease(LEASE_NAME, self.owner, self.lease_ttl):
+                self.stats['leader'] = False
+                self.stop_event.wait(self.lease_ttl / 3)
+                continue
+            
+            self.stats['leader'] = True
+            try:
+                self._watch()
+            except PyMongoError as e:
+                self.stats['errors'] += 1
+                print(f"Error in TTL expiry audit stream: {e}")
+                self.stop_event.wait(1)
+    
+    def _watch(self):
+        """Tail deletes until the lease is lost or the auditor stops"""
+        state = self.db.get_job_state(JOB_NAME) or {}
+        pending = []
+        renewed = time.monotonic()
+        with self.db.db.messages.watch(
+            AUDIT_PIPELINE,
+            resume_after=state.get('resume_token'),
+            full_document_before_change='whenAvailable',
+            max_await_time_ms=1000
+        ) as stream:
+            while not self.stop_event.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None:
+                    entry = self._audit_entry(change)
+                    if entry:
+                        pending.append(entry)
+                    elif not change.get('fullDocumentBeforeChange'):
+                        self.stats['unattributed'] += 1
+                    else:
+                        self.stats['skipped'] += 1
+                
+                if pending and (change is None or len(pending) >= self.batch_size):
+                    self.db.log_system_events(pending)
+                    self._record_lag(pending)
+                    self.stats['audited'] += len(pending)
+                    pending = []
+                    self.db.save_job_state(JOB_NAME, {
+                        'resume_token': stream.resume_token,
+                        'updated_at': datetime.utcnow()
+                    })
+                
+                if time.monotonic() - renewed > self.lease_ttl / 3:
+                    if not self.db.acquire_lease(LEASE_NAME, self.owner, self.lease_ttl):
+                        print("Lost TTL expiry audit lease")
+                        self.stats['leader'] = False
+                        return
+                    renewed = time.monotonic()
+    
+    def _record_lag(self, entries: List[Dict]):
+        """Feed the TTL monitor's delay behind destruct_at into the lag histogram"""
+        if self.metrics:
+            self.metrics.record([
+                (entry['timestamp'] - entry['metadata']['destruct_at']).total_seconds()
+                for entry in entries if entry['metadata']['destruct_at']
+            ])
+    
+    @staticmethod
+    def _audit_entry(change: Dict) -> Optional[Dict]:
+        """Destruction event for a deleted message, or None for compaction of a soft-deleted one
+        
+        Deletes without a pre-image (messages written before pre-images were
+        enabled) may be compaction too, so they are not logged either.
+        """
+        message = change.get('fullDocumentBeforeChange')
+        if not message or message.get('is_deleted'):
+            return None
+        return {
+            'event_type': 'message_destruction',
+            'message_id': str(change['documentKey']['_id']),
+            'sender_id': message.get('sender_id'),
+            'recipient_id': message.get('recipient_id'),
+            'destruction_reason': 'ttl_expiry',
+            'timestamp': change.get('wallTime') or datetime.utcnow(),
+            'metadata': {
+                'self_destruct_time': message.get('self_destruct_time'),
+                'read_once': message.get('read_once'),
+                'message_length': change.get('message_length', 0),
+                'destruct_at': message.get('destruct_at')
+            }
+        }
+    
+    def get_statistics(self) -> Dict:
+        """Audit statistics for monitoring"""
+        return {'owner': self.owner, **self.stats}
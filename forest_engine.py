@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+TacticalLink Forest Engine
+Evaluates a trained IsolationForest from flat NumPy arrays instead of per-tree sklearn calls
+"""
+
+import argparse
+import json
+import time
+from typing import Dict, Sequence
+
+import numpy as np
+
+def average_path_length(n_samples: np.ndarray) -> np.ndarray:
+    """Average path length of an unsuccessful search in a binary tree of n_samples (c(n) in the paper)"""
+    n_samples = np.asarray(n_samples, dtype=float)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    large = n_samples > 2
+    lengths[large] = (2.0 * (np.log(n_samples[large] - 1.0) + np.euler_gamma)
+                      - 2.0 * (n_samples[large] - 1.0) / n_samples[large])
+    return lengths
+
+class FlatIsolationForest:
+    """An IsolationForest's trees concatenated into contiguous node arrays
+    
+    Node i of the forest tests ``X[:, feature[i]] <= threshold[i]`` and moves
+    to left[i] or right[i]; a leaf points to itself on both sides and holds in
+    path_length its depth plus c(samples in the leaf), the path length
+    sklearn charges a row that ends there. decision_function walks every
+    row through every tree at once, one level per step, and matches
+    IsolationForest.decision_function.
+    """
+    
+    def __init__(self, feature: np.ndarray, threshold: np.ndarray, left: np.ndarray, right: np.ndarray,
+                 path_length: np.ndarray, roots: np.ndarray, depth: int, normalizer: float, offset: float):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.path_length = path_length
+        self.roots = roots
+        self.depth = depth
+        self.normalizer = normalizer
+        self.offset = offset
+    
+    @classmethod
+    def from_sklearn(cls, model) -> 'FlatIsolationForest':
+        """Flatten a fitted sklearn IsolationForest"""
+        subsample_features = model._max_features != model.n_features_in_
+        features, thresholds, lefts, rights, path_lengths, roots = [], [], [], [], [], []
+        offset, depth = 0, 0
+        
+        for estimator, tree_features in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            nodes = np.arange(tree.node_count)
+            is_leaf = tree.children_left == -1
+            
+            # Children always follow their parent, so one pass sets every depth
+            node_depth = np.zeros(tree.node_count)
+            for node in nodes[~is_leaf]:
+                node_depth[tree.children_left[node]] = node_depth[tree.children_right[node]] = node_depth[node] + 1
+            
+            feature = np.where(is_leaf, 0, tree.feature)
+            features.append(np.asarray(tree_features)[feature] if subsample_features else feature)
+            thresholds.append(tree.threshold)
+            lefts.append(np.where(is_leaf, nodes, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, nodes, tree.children_right) + offset)
+            path_lengths.append(np.where(is_leaf, node_depth + average_path_length(tree.n_node_samples), 0.0))
+            roots.append(offset)
+            offset += tree.node_count
+            depth = max(depth, tree.max_depth)
+        
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            path_length=np.concatenate(path_lengths),
+            roots=np.asarray(roots, dtype=np.intp),
+            depth=depth,
+            normalizer=len(model.estimators_) * float(average_path_length([model._max_samples])[0]),
+            offset=float(model.offset_)
+        )
+    
+    @property
+    def node_count(self) -> int:
+        return len(self.feature)
+    
+    def score_samples(self, X: np.ndarray) -> np.ndarray:
+        """Opposite of the anomaly score of each row, as IsolationForest.score_samples"""
+        # sklearn trees compare in float32, so thresholds split the same rows here
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(len(X))[:, None]
+        nodes = np.broadcast_to(self.roots, (len(X), len(self.roots)))
+        for _ in range(self.depth):
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        
+        depths = self.path_length[nodes].sum(axis=1)
+        if self.normalizer == 0:
+            return -np.ones(len(X))
+        return -(2 ** (-depths / self.normalizer))
+    
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        """Anomaly score of each row, negative for outliers, as IsolationForest.decision_function"""
+        return self.score_samples(X) - self.offset
+
+def benchmark(model, X: np.ndarray, batch_sizes: Sequence[int] = (1, 8, 64, 512), repeats: int = 20) -> Dict:
+    """Time sklearn and the flattened forest on batches of X and check they agree"""
+    engine = FlatIsolationForest.from_sklearn(model)
+    
+    def per_call(score, batch: np.ndarray) -> float:
+        score(batch)
+        started = time.perf_counter()
+        for _ in range(repeats):
+            score(batch)
+        return (time.perf_counter() - started) / repeats
+    
+    report = {
+        'trees': len(model.estimators_),
+        'nodes': engine.node_count,
+        'depth': engine.depth,
+        'max_abs_difference': float(np.abs(engine.decision_function(X) - model.decision_function(X)).max()),
+        'batches': []
+    }
+    for batch_size in batch_sizes:
+        batch = X[:batch_size]
+        sklearn_seconds = per_call(model.decision_function, batch)
+        flat_seconds = per_call(engine.decision_function, batch)
+        report['batches'].append({
+            'batch_size': len(batch),
+            'sklearn_ms': sklearn_seconds * 1000,
+            'flat_ms': flat_seconds * 1000,
+            'speedup': sklearn_seconds / flat_seconds
+        })
+    return report
+
+if __name__ == "__main__":
+    from ai_threat import ThreatDetector
+    
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    parser.add_argument('--model-dir', help='built model to benchmark (default THREAT_MODEL_DIR)')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 64, 512])
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+    
+    detector = ThreatDetector(args.model_dir)
+    detector._ensure_model()
+    if not detector.is_trained:
+        raise SystemExit(f"No model in {detector.model_dir}; build one with 'python ai_threat.py build'")
+    
+    # Score the kind of rows the model sees: its own synthetic training mix
+    X = np.vstack([detector._generate_normal_behavior_data(max(args.batch_sizes), seed=7),
+                   detector._generate_anomalous_behavior_data(max(args.batch_sizes) // 5, seed=8)])
+    X = detector.transform_features(X)
+    result = benchmark(detector.model, X, args.batch_sizes, args.repeats)
+    print(json.dumps(result, indent=2))
+    raise SystemExit(0 if result['max_abs_difference'] < 1e-9 else 1)
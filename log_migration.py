@@ -0,0 +1,119 @@
+"""
+TacticalLink Log Storage Migration
+Moves system_logs and resolved threat_logs into MongoDB time-series collections
+"""
+
+import os
+from datetime import datetime, timedelta
+from typing import Dict
+
+SYSTEM_LOGS = 'system_logs'
+LEGACY_SYSTEM_LOGS = 'system_logs_legacy'
+RESOLVED_THREAT_LOGS = 'resolved_threat_logs'
+JOB_NAME = 'log_timeseries_migration'
+BATCH_SIZE = 1000
+
+def is_timeseries(db, name: str) -> bool:
+    """Whether a collection exists and is a time-series collection"""
+    info = next(iter(db.list_collections(filter={'name': name})), None)
+    return bool(info and info.get('type') == 'timeseries')
+
+def create_log_collection(db, name: str, meta_field: str, retention: timedelta):
+    """Create a time-series log collection the server expires after ``retention``"""
+    if name in db.list_collection_names():
+        return
+    db.create_collection(
+        name,
+        timeseries={'timeField': 'timestamp', 'metaField': meta_field, 'granularity': 'minutes'},
+        expireAfterSeconds=int(retention.total_seconds())
+    )
+
+def _move(database, source, target, query: Dict, checkpoint: str, delete_source: bool) -> int:
+    """Copy documents matching query in _id order, checkpointing each batch copied
+    
+    Time-series collections do not enforce unique _ids, so a rerun must not
+    copy a document twice. Without ``delete_source`` the source is frozen and
+    the checkpoint is the last _id copied; a rerun resumes after it. With
+    ``delete_source`` the checkpoint is the _ids of the last batch, which is
+    removed from the source once the checkpoint is saved. Writers keep
+    matching older _ids (a log resolved after a newer one), so every batch
+    scans from the start of the query: whatever still matches has not been
+    copied.
+    """
+    state = database.get_job_state(JOB_NAME) or {}
+    if delete_source and state.get(checkpoint):
+        # Finish a batch copied before an interruption
+        source.delete_many({'_id': {'$in': state[checkpoint]}})
+    
+    moved = 0
+    while True:
+        batch_query = dict(query)
+        if not delete_source and state.get(checkpoint):
+            batch_query['_id'] = {'$gt': state[checkpoint]}
+        batch = list(source.find(batch_query).sort('_id', 1).limit(BATCH_SIZE))
+        if not batch:
+            return moved
+        
+        target.insert_many(batch, ordered=False)
+        copied = [document['_id'] for document in batch]
+        state[checkpoint] = copied if delete_source else copied[-1]
+        state['updated_at'] = datetime.utcnow()
+        database.save_job_state(JOB_NAME, state)
+        if delete_source:
+            source.delete_many({'_id': {'$in': copied}})
+        moved += len(batch)
+
+def migrate_system_logs(database, retention: timedelta) -> int:
+    """Replace system_logs with a time-series collection, carrying over logs still within retention
+    
+    Time-series collections cannot be renamed into place, so the regular
+    collection is renamed aside first. Run it with writers stopped: a log
+    written between the rename and the create would recreate system_logs
+    as a regular collection.
+    """
+    db = database.db
+    names = db.list_collection_names()
+    if not is_timeseries(db, SYSTEM_LOGS):
+        if SYSTEM_LOGS in names:
+            if LEGACY_SYSTEM_LOGS in names:
+                raise RuntimeError(f"Both {SYSTEM_LOGS} and {LEGACY_SYSTEM_LOGS} exist; merge them before migrating")
+            db[SYSTEM_LOGS].rename(LEGACY_SYSTEM_LOGS)
+        create_log_collection(db, SYSTEM_LOGS, 'event_type', retention)
+    
+    if LEGACY_SYSTEM_LOGS not in db.list_collection_names():
+        return 0
+    
+    cutoff = datetime.utcnow() - retention
+    copied = _move(database, db[LEGACY_SYSTEM_LOGS], db[SYSTEM_LOGS],
+                   {'timestamp': {'$gte': cutoff}}, 'system_logs_after', delete_source=False)
+    db[LEGACY_SYSTEM_LOGS].drop()
+    return copied
+
+def migrate_resolved_threat_logs(database, retention: timedelta) -> int:
+    """Move resolved threat logs into the resolved_threat_logs time-series collection"""
+    db = database.db
+    create_log_collection(db, RESOLVED_THREAT_LOGS, 'user_id', retention)
+    return _move(database, db.threat_logs, db[RESOLVED_THREAT_LOGS],
+                 {'is_resolved': True, 'timestamp': {'$type': 'date'}}, 'threat_logs_copied', delete_source=True)
+
+def run_migration(database=None) -> Dict:
+    """Migrate both log collections; safe to rerun after an interruption"""
+    if database is None:
+        from database import Database
+        database = Database()
+    
+    system_retention = timedelta(days=float(os.getenv('SYSTEM_LOG_RETENTION_DAYS', 7)))
+    threat_retention = timedelta(days=float(os.getenv('THREAT_LOG_RETENTION_DAYS', 30)))
+    
+    result = {
+        'system_logs': migrate_system_logs(database, system_retention),
+        'resolved_threat_logs': migrate_resolved_threat_logs(database, threat_retention)
+    }
+    database.save_job_state(JOB_NAME, {**result, 'completed_at': datetime.utcnow()})
+    database.create_indexes()
+    print(f"Moved {result['system_logs']} system logs and {result['resolved_threat_logs']} "
+          f"resolved threat logs into time-series collections")
+    return result
+
+if __name__ == "__main__":
+    run_migration()
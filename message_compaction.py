@@ -0,0 +1,148 @@
+"""
+TacticalLink Message Compaction
+Hard-deletes soft-deleted messages once their grace period has passed
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+JOB_NAME = 'message_compaction'
+
+class MessageCompactor:
+    """Throttled, checkpointed hard-delete of soft-deleted messages
+    
+    A run fixes its cutoff (now minus the grace period) and works through the
+    backlog in bounded batches. After each batch the checkpoint is saved, so a
+    run interrupted by a deadline or restart resumes with the same cutoff and
+    running totals. Batch latency is used as the foreground-load signal: slow
+    batches halve the batch size and double the pause between batches, fast
+    ones grow the batch back and shorten the pause.
+    """
+    
+    def __init__(self, db, grace_period: timedelta = timedelta(hours=24), batch_size: int = 500,
+                 min_batch_size: int = 50, target_latency: float = 0.25,
+                 pause: float = 0.5, max_pause: float = 30.0):
+        self.db = db
+        self.grace_period = grace_period
+        self.max_batch_size = batch_size
+        self.min_batch_size = min(min_batch_size, batch_size)
+        self.target_latency = target_latency
+        self.min_pause = pause
+        self.max_pause = max_pause
+        self.batch_size = batch_size
+        self.pause = pause
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.running = False
+        self.last_run = None
+    
+    def _load_state(self) -> Dict:
+        """Resume an unfinished run or start a new one"""
+        state = self.db.get_job_state(JOB_NAME)
+        if state and not state.get('completed_at'):
+            return state
+        
+        now = datetime.utcnow()
+        return {
+            'cutoff': now - self.grace_period,
+            'resume_after': None,
+            'documents': 0,
+            'bytes': 0,
+            'batches': 0,
+            'started_at': now,
+            'updated_at': now,
+            'completed_at': None
+        }
+    
+    def _throttle(self, latency: float):
+        """Back off when batches slow down, recover gradually when they are fast"""
+        if latency > self.target_latency:
+            self.batch_size = max(self.min_batch_size, self.batch_size // 2)
+            self.pause = min(self.max_pause, self.pause * 2)
+        else:
+            self.batch_size = min(self.max_batch_size, self.batch_size + self.min_batch_size)
+            self.pause = max(self.min_pause, self.pause / 2)
+    
+    def run(self, max_duration: Optional[float] = None) -> Optional[Dict]:
+        """Compact until the backlog is empty, the deadline passes or stop() is called"""
+        with self.lock:
+            if self.running:
+                return None
+            self.running = True
+            self.stop_event.clear()
+        
+        deadline = time.monotonic() + max_duration if max_duration else None
+        try:
+            state = self._load_state()
+            while not self.stop_event.is_set():
+                if deadline and time.monotonic() >= deadline:
+                    break
+                
+                started = time.monotonic()
+                result = self.db.purge_deleted_messages(state['cutoff'], self.batch_size, state['resume_after'])
+                latency = time.monotonic() - started
+                
+                state['documents'] += result['documents']
+                state['bytes'] += result['bytes']
+                state['batches'] += 1
+                state['resume_after'] = result['resume_after']
+                state['updated_at'] = datetime.utcnow()
+                if result['done']:
+                    state['completed_at'] = state['updated_at']
+                self.db.save_job_state(JOB_NAME, state)
+                
+                if result['done']:
+                    if state['documents']:
+                        self._report(state)
+                    break
+                
+                self._throttle(latency)
+                self.stop_event.wait(self.pause)
+            
+            self.last_run = dict(state)
+            return state
+        
+        except Exception as e:
+            print(f"Error compacting deleted messages: {e}")
+            return None
+        
+        finally:
+            with self.lock:
+                self.running = False
+    
+    def _report(self, state: Dict):
+        """Record a completed run in the system logs"""
+        print(f"Compacted {state['documents']} deleted messages, reclaimed {state['bytes']} bytes")
+        try:
+            self.db.log_system_event({
+                'event_type': 'message_compaction',
+                'timestamp': state['completed_at'],
+                'metadata': {
+                    'cutoff': state['cutoff'],
+                    'documents': state['documents'],
+                    'bytes': state['bytes'],
+                    'batches': state['batches'],
+                    'duration': (state['completed_at'] - state['started_at']).total_seconds()
+                }
+            })
+        except Exception as e:
+            print(f"Error logging message compaction: {e}")
+    
+    def stop(self):
+        """Ask a running compaction to stop after its current batch"""
+        self.stop_event.set()
+    
+    def get_statistics(self) -> Dict:
+        """Compaction progress for monitoring"""
+        last_run = self.last_run or self.db.get_job_state(JOB_NAME) or {}
+        return {
+            'running': self.running,
+            'batch_size': self.batch_size,
+            'pause': self.pause,
+            'documents_reclaimed': last_run.get('documents', 0),
+            'bytes_reclaimed': last_run.get('bytes', 0),
+            'cutoff': last_run['cutoff'].isoformat() if last_run.get('cutoff') else None,
+            'completed_at': last_run['completed_at'].isoformat() if last_run.get('completed_at') else None
+        }
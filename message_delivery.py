@@ -0,0 +1,391 @@
+"""
+TacticalLink Message Delivery
+Pushes new and deleted messages to connected clients instead of polling
+"""
+
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict, deque, OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from pymongo.errors import PyMongoError
+from database import Database
+
+# Delivery modes
+DELIVERY_CHANGE_STREAM = 'change_stream'
+DELIVERY_IN_PROCESS = 'in_process'
+# No push delivery: clients reload on a timer
+DELIVERY_POLLING = 'polling'
+
+# Ciphertext and key material never travel through the delivery path
+CHANGE_STREAM_PIPELINE = [
+    {'$match': {'$or': [
+        {'operationType': {'$in': ['insert', 'delete']}},
+        {'operationType': 'update', 'updateDescription.updatedFields.is_deleted': True}
+    ]}},
+    {'$project': {
+        'fullDocument.content': 0,
+        'fullDocument.original_content': 0,
+        'fullDocument.session_key': 0
+    }}
+]
+
+class Subscription:
+    """Bounded event buffer for one connected client"""
+    
+    def __init__(self, user_id: str, max_buffer: int = 100):
+        self.user_id = user_id
+        self.max_buffer = max_buffer
+        self.events = deque()
+        self.condition = threading.Condition()
+        self.overflowed = False
+        self.start_event_id = None
+    
+    def push(self, event: Dict):
+        """Buffer an event, dropping the oldest when the buffer is full"""
+        with self.condition:
+            if len(self.events) >= self.max_buffer:
+                self.events.popleft()
+                self.overflowed = True
+            self.events.append(event)
+            self.condition.notify_all()
+    
+    def get(self, timeout: float) -> List[Dict]:
+        """Wait up to timeout seconds for events and drain the buffer"""
+        with self.condition:
+            if not self.events:
+                self.condition.wait(timeout)
+            events = list(self.events)
+            self.events.clear()
+            return events
+
+class MessageDeliveryHub:
+    """Routes message insert/delete events to per-user subscriber queues
+    
+    In production the hub tails the ``messages`` collection through a change
+    stream, so every worker sees every write. Without change stream support
+    (standalone MongoDB, bucketed storage, SQLite) a single worker falls back
+    to in-process publishing from the storage backend's ``create_message``
+    and ``delete_message``; with several workers a write would only reach
+    clients polling the worker that made it, so push delivery is off and
+    clients reload on a timer instead.
+    
+    Each waiting long-poll holds a request thread, so at most max_waiters
+    wait at once and further polls are turned away to keep threads free
+    for other requests.
+    
+    Event IDs are cursors a client hands back on its next poll, which may
+    reach another worker. From a change stream they are built from the
+    event's clusterTime, which every worker sees in the same order, so any
+    worker can tell which events the client has had. In-process IDs carry
+    the hub's origin and a counter; an ID from another origin (a previous
+    process) cannot be placed and makes the client resync.
+    """
+    
+    def __init__(self, max_buffer: int = 100, replay_size: int = 100, participant_cache_size: int = 10000,
+                 max_waiters: int = 4, workers: int = 1):
+        self.max_buffer = max_buffer
+        self.replay_size = replay_size
+        self.participant_cache_size = participant_cache_size
+        self.max_waiters = max_waiters
+        self.workers = workers
+        self.waiting = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+        self.subscribers = defaultdict(set)
+        self.recent_events = defaultdict(lambda: deque(maxlen=self.replay_size))
+        # user_id -> position of the newest event dropped from recent_events
+        self.evicted = {}
+        self.participants = OrderedDict()
+        self.origin = uuid.uuid4().hex[:8]
+        self.last_event_id = None
+        self.last_position = None
+        # The hub has seen every event after this position, and may have missed earlier ones
+        self.first_position = None
+        self.mode = None
+        self.collection = None
+        self.resume_token = None
+        self.running = False
+        self.watch_thread = None
+    
+    def attach(self, db):
+        """Start delivering events for a storage backend"""
+        with self.lock:
+            if self.mode is None:
+                if self._supports_change_streams(db):
+                    self.mode = DELIVERY_CHANGE_STREAM
+                elif self.workers == 1:
+                    self.mode = DELIVERY_IN_PROCESS
+                else:
+                    print(f"In-process delivery only reaches clients of the writing worker; "
+                          f"with {self.workers} workers clients reload on a timer instead")
+                    self.mode = DELIVERY_POLLING
+                print(f"Message delivery mode: {self.mode}")
+            mode = self.mode
+        
+        if mode == DELIVERY_CHANGE_STREAM:
+            if self.collection is None:
+                self.collection = db.db.messages
+                self.start()
+        elif mode == DELIVERY_IN_PROCESS:
+            with self.lock:
+                if self.first_position is None:
+                    self._set_horizon(f"{self.origin}-0", (0, 0, 0))
+            db.add_message_listener(self.publish)
+    
+    def _set_horizon(self, event_id: str, position: Tuple[int, int, int]):
+        """Start the hub's event order at position; called with the lock held"""
+        self.last_event_id, self.last_position, self.first_position = event_id, position, position
+    
+    def _supports_change_streams(self, db) -> bool:
+        """Change streams need the document layout on a replica set or sharded cluster"""
+        if not isinstance(db, Database) or db.message_store:
+            return False
+        try:
+            with db.db.messages.watch(CHANGE_STREAM_PIPELINE, max_await_time_ms=1) as stream:
+                stream.try_next()
+            return True
+        except PyMongoError as e:
+            print(f"Change streams unavailable, using in-process delivery: {e}")
+            return False
+    
+    def start(self):
+        """Start the change stream watcher"""
+        if self.running:
+            return
+        self.running = True
+        self.watch_thread = threading.Thread(target=self._watch_messages, daemon=True)
+        self.watch_thread.start()
+    
+    def stop(self):
+        """Stop the change stream watcher"""
+        self.running = False
+        if self.watch_thread and self.watch_thread.is_alive():
+            self.watch_thread.join(timeout=5)
+    
+    def _watch_messages(self):
+        """Tail the messages collection, resuming after errors from the last token"""
+        start_at = None
+        try:
+            # Start at a known cluster time so cursors older than it are told to resync
+            start_at = self.collection.database.command('ping')['operationTime']
+            with self.lock:
+                self._set_horizon(f"ct-{start_at.time}-{start_at.inc}-0", (start_at.time, start_at.inc, 0))
+        except (PyMongoError, KeyError) as e:
+            print(f"Error reading the cluster time to start the change stream at: {e}")
+        
+        while self.running:
+            try:
+                with self.collection.watch(
+                    CHANGE_STREAM_PIPELINE,
+                    full_document='updateLookup',
+                    resume_after=self.resume_token,
+                    start_at_operation_time=None if self.resume_token else start_at,
+                    max_await_time_ms=1000
+                ) as stream:
+                    while self.running and stream.alive:
+                        change = stream.try_next()
+                        if change is not None:
+                            self._handle_change(change)
+                        self.resume_token = stream.resume_token
+            
+            except PyMongoError as e:
+                print(f"Error in message change stream: {e}")
+                time.sleep(1)
+    
+    def _handle_change(self, change: Dict):
+        """Translate a change event into a delivery event"""
+        message_id = str(change['documentKey']['_id'])
+        message = change.get('fullDocument') or {'_id': message_id}
+        message['_id'] = message_id
+        event_type = 'insert' if change['operationType'] == 'insert' else 'delete'
+        self.publish(event_type, message, change.get('clusterTime'))
+    
+    def _next_event_id(self, cluster_time=None) -> Tuple[str, Tuple[int, int, int]]:
+        """ID and position of the next event; called with the lock held
+        
+        Events sharing a clusterTime (one transaction) are numbered from 1 in
+        stream order, which is the same on every worker; 0 stands for the
+        point just before them.
+        """
+        if cluster_time is None:
+            sequence = self.last_position[2] + 1 if self.last_position else 1
+            return f"{self.origin}-{sequence}", (0, 0, sequence)
+        
+        time_part = (cluster_time.time, cluster_time.inc)
+        same_time = self.last_position is not None and self.last_position[:2] == time_part
+        sequence = self.last_position[2] + 1 if same_time else 1
+        return f"ct-{time_part[0]}-{time_part[1]}-{sequence}", (*time_part, sequence)
+    
+    def _position(self, event_id: str) -> Optional[Tuple[int, int, int]]:
+        """Position of an event ID in this hub's order, None when it cannot be placed"""
+        try:
+            parts = event_id.split('-')
+            if self.mode == DELIVERY_CHANGE_STREAM and parts[0] == 'ct' and len(parts) == 4:
+                return int(parts[1]), int(parts[2]), int(parts[3])
+            if self.mode == DELIVERY_IN_PROCESS and parts[0] == self.origin and len(parts) == 2:
+                return 0, 0, int(parts[1])
+        except (AttributeError, ValueError):
+            pass
+        return None
+    
+    def publish(self, event_type: str, message: Dict, cluster_time=None):
+        """Deliver an insert or delete event to the sender's and recipient's subscribers"""
+        try:
+            message_id = str(message['_id'])
+            sender_id = message.get('sender_id')
+            recipient_id = message.get('recipient_id')
+            
+            with self.lock:
+                # Deletes may only carry the ID; route them like the original insert
+                if sender_id is None or recipient_id is None:
+                    cached = self.participants.get(message_id)
+                    if cached is None:
+                        return
+                    sender_id, recipient_id = cached
+                elif event_type == 'insert':
+                    self.participants[message_id] = (sender_id, recipient_id)
+                    if len(self.participants) > self.participant_cache_size:
+                        self.participants.popitem(last=False)
+                
+                if event_type == 'delete':
+                    self.participants.pop(message_id, None)
+                
+                event_id, position = self._next_event_id(cluster_time)
+                if self.first_position is None:
+                    self._set_horizon(event_id, position)
+                self.last_event_id, self.last_position = event_id, position
+                event = {
+                    'id': event_id,
+                    'type': event_type,
+                    'message_id': message_id,
+                    'sender_id': sender_id,
+                    'recipient_id': recipient_id,
+                    'timestamp': self._isoformat(message.get('timestamp')),
+                    'read_once': message.get('read_once'),
+                    'destruct_at': self._isoformat(message.get('destruct_at'))
+                }
+                
+                subscribers = []
+                for user_id in {sender_id, recipient_id}:
+                    recent = self.recent_events[user_id]
+                    if len(recent) == recent.maxlen:
+                        self.evicted[user_id] = self._position(recent[0]['id'])
+                    recent.append(event)
+                    subscribers.extend(self.subscribers.get(user_id, ()))
+            
+            for subscription in subscribers:
+                subscription.push(event)
+        
+        except Exception as e:
+            print(f"Error publishing message event: {e}")
+    
+    @staticmethod
+    def _isoformat(value) -> Optional[str]:
+        return value.isoformat() if isinstance(value, datetime) else value
+    
+    def subscribe(self, user_id: str) -> Subscription:
+        """Register a subscriber queue for a user"""
+        subscription = Subscription(user_id, self.max_buffer)
+        with self.lock:
+            subscription.start_event_id = self.last_event_id
+            self.subscribers[user_id].add(subscription)
+        return subscription
+    
+    def unsubscribe(self, subscription: Subscription):
+        """Remove a subscriber queue"""
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.user_id]
+    
+    def _replay(self, user_id: str, after: Tuple[int, int, int]):
+        """Events after position ``after`` and whether the client must resync
+        
+        A worker behind the client's cursor has nothing to replay and waits
+        for the events to reach it; one that started after the cursor, or
+        has evicted events since, may have missed some.
+        """
+        with self.lock:
+            if self.first_position is None or after < self.first_position:
+                return [], True
+            recent = self.recent_events.get(user_id) or ()
+            missed = [event for event in recent if self._position(event['id']) > after]
+            evicted = self.evicted.get(user_id)
+            return missed, evicted is not None and evicted > after
+    
+    def wait_for_events(self, user_id: str, after: Optional[str] = None, timeout: float = 25.0) -> Optional[Dict]:
+        """Long-poll for a user's events after the given event ID
+        
+        ``resync`` tells the client that events may have been missed and it
+        should reload through the regular conversation endpoints. None means
+        the client cannot wait here, because push delivery is off or
+        max_waiters polls are already waiting, and should reload later.
+        """
+        if self.mode == DELIVERY_POLLING:
+            return None
+        
+        subscription = self.subscribe(user_id)
+        try:
+            position = None if after is None else self._position(after)
+            if after is None:
+                events, resync = [], False
+            elif position is None:
+                # Minted by another process or in another delivery mode
+                events, resync = [], True
+            else:
+                events, resync = self._replay(user_id, position)
+            
+            if not events and not resync:
+                with self.lock:
+                    if self.waiting >= self.max_waiters:
+                        self.rejected += 1
+                        return None
+                    self.waiting += 1
+                try:
+                    events = subscription.get(timeout)
+                finally:
+                    with self.lock:
+                        self.waiting -= 1
+                resync = subscription.overflowed
+                if position is not None:
+                    # A worker catching up publishes events the client already has
+                    events = [event for event in events if self._position(event['id']) > position]
+            
+            # Anything after start_event_id is either returned now or still replayable;
+            # a client ahead of this worker keeps its own cursor
+            last_event_id = subscription.start_event_id
+            if position is not None and (last_event_id is None or position > self._position(last_event_id)):
+                last_event_id = after
+            return {
+                'events': events,
+                'last_event_id': events[-1]['id'] if events else last_event_id,
+                'resync': resync,
+                'mode': self.mode
+            }
+        finally:
+            self.unsubscribe(subscription)
+    
+    def get_statistics(self) -> Dict:
+        """Delivery statistics for monitoring"""
+        with self.lock:
+            return {
+                'mode': self.mode,
+                'last_event_id': self.last_event_id,
+                'subscribed_users': len(self.subscribers),
+                'subscriptions': sum(len(s) for s in self.subscribers.values()),
+                'waiting': self.waiting,
+                'max_waiters': self.max_waiters,
+                'rejected': self.rejected,
+                'watcher_running': self.running
+            }
+
+# Process-wide hub shared by the app and blueprints
+delivery_hub = MessageDeliveryHub(
+    max_waiters=int(os.getenv('MESSAGE_POLL_MAX_WAITERS', 4)),
+    workers=int(os.getenv('WEB_CONCURRENCY', 1))
+)
@@ -3,49 +3,115 @@ TacticalLink Message Scheduler
 Handles self-destructing messages and automatic cleanup
 """
 
+import os
 import threading
-import time
 import schedule
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
 import uuid
-from database import Database
+from storage_backend import create_database, EXPIRY_MODE_TTL
 from encryption import EncryptionManager
+from destruction_queue import DestructionQueue
+from destruction_coordinator import DestructionCoordinator
+from message_compaction import MessageCompactor
+from expiry_audit import ExpiryAuditor
+from destruction_metrics import DestructionMetrics
+from clock import SystemClock
 
 class MessageScheduler:
-    """Scheduler for self-destructing messages and cleanup tasks"""
+    """Scheduler for self-destructing messages and cleanup tasks
     
-    def __init__(self):
-        self.db = Database()
+    ``db`` and ``clock`` default to the configured storage backend and wall
+    time; simulations pass an in-memory store and a VirtualClock.
+    """
+    
+    def __init__(self, db=None, clock=None):
+        self.clock = clock or SystemClock()
+        self.db = db or create_database()
         self.encryption_manager = EncryptionManager()
-        self.scheduled_messages = {}
+        self.destruction_queue = DestructionQueue(self.clock)
         self.running = False
-        self.cleanup_thread = None
+        self.stop_event = threading.Event()
+        self.destruction_thread = None
         self.scheduler_thread = None
+        self.compaction_thread = None
+        self.coordinator_thread = None
+        
+        # Workers share expired-message destruction through leased time-range shards
+        self.coordinator = DestructionCoordinator(
+            self.db,
+            self._destroy_batch,
+            shard_span=int(os.getenv('DESTRUCTION_SHARD_SECONDS', 60)),
+            lease_ttl=float(os.getenv('DESTRUCTION_LEASE_TTL', 30)),
+            batch_size=int(os.getenv('DESTRUCTION_BATCH_SIZE', 200))
+        )
+        self.coordinator_interval = float(os.getenv('DESTRUCTION_POLL_INTERVAL', 5))
+        
+        # How late destructions happen, judged against the p99 lag SLO
+        self.metrics = DestructionMetrics(
+            slo=float(os.getenv('DESTRUCTION_LAG_SLO_SECONDS', 5)),
+            window=float(os.getenv('DESTRUCTION_LAG_WINDOW_SECONDS', 300)),
+            clock=self.clock
+        )
+        
+        # In TTL mode MongoDB removes expired documents; we only audit its deletes
+        self.ttl_expiry = self.db.expiry_mode == EXPIRY_MODE_TTL
+        self.expiry_auditor = ExpiryAuditor(
+            self.db,
+            self.coordinator.owner,
+            lease_ttl=float(os.getenv('DESTRUCTION_LEASE_TTL', 30)),
+            metrics=self.metrics
+        ) if self.ttl_expiry else None
+        
+        # Hard-delete soft-deleted messages after their grace period
+        self.compactor = MessageCompactor(
+            self.db,
+            grace_period=timedelta(hours=float(os.getenv('MESSAGE_COMPACTION_GRACE_HOURS', 24))),
+            batch_size=int(os.getenv('MESSAGE_COMPACTION_BATCH_SIZE', 500)),
+            target_latency=float(os.getenv('MESSAGE_COMPACTION_TARGET_LATENCY_MS', 250)) / 1000
+        )
+        self.compaction_max_duration = float(os.getenv('MESSAGE_COMPACTION_MAX_SECONDS', 600))
         
         # Schedule cleanup tasks
         self._setup_cleanup_schedules()
     
     def _setup_cleanup_schedules(self):
-        """Setup automatic cleanup schedules"""
+        """Setup automatic cleanup schedules; every worker schedules them and one per round runs each"""
         try:
-            # Clean up expired messages every minute
-            schedule.every().minute.do(self._cleanup_expired_messages)
-            
-            # Clean up expired session keys every 5 minutes
-            schedule.every(5).minutes.do(self._cleanup_expired_keys)
+            # Clean up expired session keys every 5 minutes (TTL mode leaves this to MongoDB)
+            if not self.ttl_expiry:
+                schedule.every(5).minutes.do(self._leased('cleanup-expired-keys', 300, self._cleanup_expired_keys))
+            
+            # Time-series log collections expire on the server (see log_migration.py)
+            if not self.db.log_retention_managed:
+                # Clean up old threat logs every hour
+                schedule.every().hour.do(self._leased('cleanup-threat-logs', 3600, self._cleanup_old_threat_logs))
+                
+                # Clean up old system logs every day
+                schedule.every().day.at("02:00").do(
+                    self._leased('cleanup-system-logs', 86400, self._cleanup_old_system_logs)
+                )
             
-            # Clean up old threat logs every hour
-            schedule.every().hour.do(self._cleanup_old_threat_logs)
+            # Drop message partitions past retention every hour
+            schedule.every().hour.do(self._leased('message-retention', 3600, self._apply_message_retention))
             
-            # Clean up old system logs every day
-            schedule.every().day.at("02:00").do(self._cleanup_old_system_logs)
+            # Compact soft-deleted messages every hour, resuming from the last checkpoint
+            schedule.every().hour.do(self._leased('message-compaction', 3600, self._compact_deleted_messages))
             
             print("Cleanup schedules configured")
             
         except Exception as e:
             print(f"Error setting up cleanup schedules: {e}")
     
+    def _leased(self, job_name: str, interval: float, job):
+        """Wrap a scheduled job so only the worker taking this round's lease runs it"""
+        def run():
+            # The lease lasts half an interval and is never released, so one worker
+            # runs each round even though every worker's schedule fires
+            if self.db.acquire_lease(f"scheduled:{job_name}", self.coordinator.owner, interval / 2):
+                job()
+        return run
+    
     def start(self):
         """Start the message scheduler"""
         try:
@@ -53,14 +119,28 @@ class MessageScheduler:
                 return
             
             self.running = True
+            self.stop_event.clear()
+            self.destruction_queue.reopen()
             
             # Start scheduler thread
             self.scheduler_thread = threading.Thread(target=self._run_scheduler, daemon=True)
             self.scheduler_thread.start()
             
-            # Start cleanup thread
-            self.cleanup_thread = threading.Thread(target=self._run_cleanup, daemon=True)
-            self.cleanup_thread.start()
+            if self.ttl_expiry:
+                # Record the TTL monitor's deletes as destruction events
+                self.expiry_auditor.start()
+            else:
+                # Start destruction thread
+                self.destruction_thread = threading.Thread(target=self._run_destructions, daemon=True)
+                self.destruction_thread.start()
+                
+                # Start claiming expired-message shards
+                self.coordinator_thread = threading.Thread(
+                    target=self.coordinator.run,
+                    args=(self.coordinator_interval,),
+                    daemon=True
+                )
+                self.coordinator_thread.start()
             
             print("Message scheduler started")
             
@@ -71,12 +151,24 @@ class MessageScheduler:
         """Stop the message scheduler"""
         try:
             self.running = False
+            self.stop_event.set()
+            self.destruction_queue.close()
+            self.coordinator.stop()
+            self.compactor.stop()
+            if self.expiry_auditor:
+                self.expiry_auditor.stop()
             
             if self.scheduler_thread and self.scheduler_thread.is_alive():
                 self.scheduler_thread.join(timeout=5)
             
-            if self.cleanup_thread and self.cleanup_thread.is_alive():
-                self.cleanup_thread.join(timeout=5)
+            if self.destruction_thread and self.destruction_thread.is_alive():
+                self.destruction_thread.join(timeout=5)
+            
+            if self.coordinator_thread and self.coordinator_thread.is_alive():
+                self.coordinator_thread.join(timeout=5)
+            
+            if self.compaction_thread and self.compaction_thread.is_alive():
+                self.compaction_thread.join(timeout=5)
             
             print("Message scheduler stopped")
             
@@ -87,26 +179,14 @@ class MessageScheduler:
         """Schedule message for self-destruction"""
         try:
             # Calculate destruction time
-            destruct_at = datetime.utcnow() + timedelta(seconds=destruct_time)
-            
-            # Create destruction task
-            destruction_task = {
-                'message_id': message_id,
-                'destruct_at': destruct_at,
-                'read_once': read_once,
-                'created_at': datetime.utcnow(),
-                'status': 'scheduled'
-            }
+            destruct_at = self.clock.now() + timedelta(seconds=destruct_time)
             
-            # Store in memory for quick access
-            self.scheduled_messages[message_id] = destruction_task
+            # Queue in memory, ordered by deadline, unless the TTL index handles it
+            if not self.ttl_expiry:
+                self.destruction_queue.schedule(message_id, destruct_at, read_once)
             
             # Update database
-            from bson import ObjectId
-            self.db.db.messages.update_one(
-                {'_id': ObjectId(message_id)},
-                {'$set': {'destruct_at': destruct_at}}
-            )
+            self.db.set_message_destruct_at(message_id, destruct_at)
             
             print(f"Scheduled message {message_id} for destruction at {destruct_at}")
             
@@ -116,15 +196,10 @@ class MessageScheduler:
     def cancel_destruction(self, message_id: str):
         """Cancel scheduled message destruction"""
         try:
-            if message_id in self.scheduled_messages:
-                del self.scheduled_messages[message_id]
+            self.destruction_queue.cancel(message_id)
             
             # Update database
-            from bson import ObjectId
-            self.db.db.messages.update_one(
-                {'_id': ObjectId(message_id)},
-                {'$unset': {'destruct_at': 1}}
-            )
+            self.db.set_message_destruct_at(message_id, None)
             
             print(f"Cancelled destruction for message {message_id}")
             
@@ -132,138 +207,133 @@ class MessageScheduler:
             print(f"Error cancelling message destruction: {e}")
     
     def _run_scheduler(self):
-        """Main scheduler loop"""
+        """Run periodic cleanup jobs, sleeping until the next one is due"""
         try:
             while self.running:
-                # Check for messages that need to be destroyed
-                self._check_scheduled_destructions()
-                
-                # Run scheduled tasks
                 schedule.run_pending()
                 
-                # Sleep for 1 second
-                time.sleep(1)
+                idle_seconds = schedule.idle_seconds()
+                self.stop_event.wait(max(idle_seconds, 0) if idle_seconds is not None else 60)
                 
         except Exception as e:
             print(f"Error in scheduler loop: {e}")
     
-    def _run_cleanup(self):
-        """Main cleanup loop"""
+    def _run_destructions(self):
+        """Sleep until the next destruction deadline and destroy everything then due"""
+        while self.running:
+            try:
+                batch = self.destruction_queue.wait_for_due()
+                if batch:
+                    self._destroy_messages(batch)
+            
+            except Exception as e:
+                print(f"Error in destruction loop: {e}")
+    
+    def fire_due_destructions(self) -> int:
+        """Destroy every queued message due by the clock's current time without waiting"""
+        batch = self.destruction_queue.pop_due(self.clock.now())
+        return self._destroy_messages(batch) if batch else 0
+    
+    def _destroy_messages(self, batch: List[Dict]) -> int:
+        """Destroy a batch of messages that fell due together, fetched with one query"""
+        messages = self.db.get_messages_by_ids([task['message_id'] for task in batch])
+        found = {message['_id'] for message in messages}
+        for task in batch:
+            if task['message_id'] not in found:
+                print(f"Message {task['message_id']} not found for destruction")
+        
+        destroyed = self._destroy_batch(messages)
+        if len(batch) > 1:
+            print(f"Destroyed {destroyed} of {len(batch)} messages due at {batch[-1]['destruct_at']}")
+        return destroyed
+    
+    def _destroy_message(self, message_id: str, message: Optional[Dict] = None) -> bool:
+        """Securely destroy a message, unless another worker already has"""
+        message = message or self.db.get_message_by_id(message_id)
+        if not message:
+            print(f"Message {message_id} not found for destruction")
+            return False
+        
+        if self._destroy_batch([message]) != 1:
+            return False
+        print(f"Message {message_id} destroyed successfully")
+        return True
+    
+    def _destroy_batch(self, messages: List[Dict]) -> int:
+        """Securely destroy messages with one bulk delete and one bulk audit write
+        
+        Only the messages this worker's conditional delete flipped go on to key
+        destruction and logging.
+        """
         try:
-            while self.running:
-                # Clean up expired messages
-                self._cleanup_expired_messages()
+            if not messages:
+                return 0
+            
+            # Mark messages as deleted in database
+            deleted = set(self.db.delete_messages([message['_id'] for message in messages]))
+            destroyed_at = self.clock.now()
+            
+            log_entries = []
+            lags = []
+            for message in messages:
+                # Remove from the destruction queue whoever destroyed it
+                self.destruction_queue.cancel(message['_id'])
+                if message['_id'] not in deleted:
+                    continue
                 
-                # Clean up expired keys
-                self._cleanup_expired_keys()
+                # Destroy encryption key
+                if message.get('session_key'):
+                    self.encryption_manager.destroy_key(message['session_key'])
                 
-                # Sleep for 30 seconds
-                time.sleep(30)
+                log_entries.append(self._destruction_log_entry(message['_id'], message))
                 
-        except Exception as e:
-            print(f"Error in cleanup loop: {e}")
-    
-    def _check_scheduled_destructions(self):
-        """Check for messages that need to be destroyed"""
-        try:
-            current_time = datetime.utcnow()
-            messages_to_destroy = []
-            
-            # Check scheduled messages
-            for message_id, task in self.scheduled_messages.items():
-                if task['destruct_at'] <= current_time and task['status'] == 'scheduled':
-                    messages_to_destroy.append(message_id)
-            
-            # Destroy messages
-            for message_id in messages_to_destroy:
-                self._destroy_message(message_id)
-                
-        except Exception as e:
-            print(f"Error checking scheduled destructions: {e}")
-    
-    def _destroy_message(self, message_id: str):
-        """Securely destroy a message"""
-        try:
-            # Get message from database
-            message = self.db.get_message_by_id(message_id)
-            if not message:
-                print(f"Message {message_id} not found for destruction")
-                return
-            
-            # Destroy encryption key
-            if message.get('session_key'):
-                self.encryption_manager.destroy_key(message['session_key'])
-            
-            # Mark message as deleted in database
-            self.db.delete_message(message_id)
+                # Lag behind the deadline; early read-once destructions are not measured
+                destruct_at = message.get('destruct_at')
+                if destruct_at and destruct_at <= destroyed_at:
+                    lags.append((destroyed_at - destruct_at).total_seconds())
             
-            # Remove from scheduled messages
-            if message_id in self.scheduled_messages:
-                self.scheduled_messages[message_id]['status'] = 'destroyed'
-                del self.scheduled_messages[message_id]
+            self.metrics.record(lags)
             
-            # Log destruction
-            self._log_message_destruction(message_id, message)
-            
-            print(f"Message {message_id} destroyed successfully")
+            # Log destructions
+            self._log_message_destructions(log_entries)
+            return len(deleted)
             
         except Exception as e:
-            print(f"Error destroying message {message_id}: {e}")
+            print(f"Error destroying messages: {e}")
+            return 0
     
-    def _log_message_destruction(self, message_id: str, message: Dict):
-        """Log message destruction event"""
-        try:
-            log_entry = {
-                'event_type': 'message_destruction',
-                'message_id': message_id,
-                'sender_id': message.get('sender_id'),
-                'recipient_id': message.get('recipient_id'),
-                'destruction_reason': 'scheduled_self_destruct',
-                'timestamp': datetime.utcnow(),
-                'metadata': {
-                    'self_destruct_time': message.get('self_destruct_time'),
-                    'read_once': message.get('read_once'),
-                    'message_length': len(message.get('content', ''))
-                }
+    def _destruction_log_entry(self, message_id: str, message: Dict) -> Dict:
+        """Build a message destruction event"""
+        return {
+            'event_type': 'message_destruction',
+            'message_id': message_id,
+            'sender_id': message.get('sender_id'),
+            'recipient_id': message.get('recipient_id'),
+            'destruction_reason': 'scheduled_self_destruct',
+            'timestamp': self.clock.now(),
+            'metadata': {
+                'self_destruct_time': message.get('self_destruct_time'),
+                'read_once': message.get('read_once'),
+                'message_length': len(message.get('content', ''))
             }
-            
-            # Store in system logs collection
-            self.db.db.system_logs.insert_one(log_entry)
+        }
+    
+    def _log_message_destructions(self, log_entries: List[Dict]):
+        """Store message destruction events in one write"""
+        try:
+            if log_entries:
+                self.db.log_system_events(log_entries)
             
         except Exception as e:
             print(f"Error logging message destruction: {e}")
     
     def _cleanup_expired_messages(self):
-        """Clean up expired self-destruct messages"""
+        """Clean up expired self-destruct messages in shards no other worker holds"""
         try:
-            current_time = datetime.utcnow()
-            
-            # Find expired messages
-            expired_messages = list(self.db.db.messages.find({
-                'destruct_at': {'$lt': current_time},
-                'is_deleted': False
-            }))
-            
-            destroyed_count = 0
-            for message in expired_messages:
-                try:
-                    # Destroy encryption key
-                    if message.get('session_key'):
-                        self.encryption_manager.destroy_key(message['session_key'])
-                    
-                    # Mark as deleted
-                    self.db.db.messages.update_one(
-                        {'_id': message['_id']},
-                        {'$set': {'is_deleted': True, 'deleted_at': current_time}}
-                    )
-                    
-                    # Log destruction
-                    self._log_message_destruction(str(message['_id']), message)
-                    
-                    destroyed_count += 1
-                    
-                except Exception as e:
-                    print(f"Error destroying expired message {message['_id']}: {e}")
+            if self.ttl_expiry:
+                return
+            
+            destroyed_count = self.coordinator.run_once()
             
             if destroyed_count > 0:
                 print(f"Cleaned up {destroyed_count} expired messages")
@@ -274,27 +344,11 @@ class MessageScheduler:
     def _cleanup_expired_keys(self):
         """Clean up expired session keys"""
         try:
-            current_time = datetime.utcnow()
-            
-            # Find expired keys
-            expired_keys = list(self.db.db.session_keys.find({
-                'expires_at': {'$lt': current_time},
-                'is_destroyed': False
-            }))
-            
-            destroyed_count = 0
-            for key in expired_keys:
-                try:
-                    # Mark as destroyed
-                    self.db.db.session_keys.update_one(
-                        {'_id': key['_id']},
-                        {'$set': {'is_destroyed': True, 'destroyed_at': current_time}}
-                    )
-                    
-                    destroyed_count += 1
-                    
-                except Exception as e:
-                    print(f"Error destroying expired key {key['_id']}: {e}")
+            if self.ttl_expiry:
+                return
+            
+            # Mark expired keys as destroyed
+            destroyed_count = self.db.cleanup_expired_keys()
             
             if destroyed_count > 0:
                 print(f"Cleaned up {destroyed_count} expired session keys")
@@ -303,43 +357,68 @@ class MessageScheduler:
             print(f"Error cleaning up expired keys: {e}")
     
     def _cleanup_old_threat_logs(self):
-        """Clean up old threat logs (older than 30 days)"""
+        """Clean up resolved threat logs older than THREAT_LOG_RETENTION_DAYS (30)"""
         try:
-            cutoff_date = datetime.utcnow() - timedelta(days=30)
+            if self.db.log_retention_managed:
+                return
             
-            result = self.db.db.threat_logs.delete_many({
-                'timestamp': {'$lt': cutoff_date},
-                'is_resolved': True
-            })
+            cutoff_date = self.clock.now() - timedelta(days=float(os.getenv('THREAT_LOG_RETENTION_DAYS', 30)))
             
-            if result.deleted_count > 0:
-                print(f"Cleaned up {result.deleted_count} old threat logs")
+            deleted_count = self.db.delete_old_threat_logs(cutoff_date)
+            
+            if deleted_count > 0:
+                print(f"Cleaned up {deleted_count} old threat logs")
                 
         except Exception as e:
             print(f"Error cleaning up old threat logs: {e}")
     
     def _cleanup_old_system_logs(self):
-        """Clean up old system logs (older than 7 days)"""
+        """Clean up system logs older than SYSTEM_LOG_RETENTION_DAYS (7)"""
         try:
-            cutoff_date = datetime.utcnow() - timedelta(days=7)
+            if self.db.log_retention_managed:
+                return
+            
+            cutoff_date = self.clock.now() - timedelta(days=float(os.getenv('SYSTEM_LOG_RETENTION_DAYS', 7)))
             
-            result = self.db.db.system_logs.delete_many({
-                'timestamp': {'$lt': cutoff_date}
-            })
+            deleted_count = self.db.delete_old_system_logs(cutoff_date)
             
-            if result.deleted_count > 0:
-                print(f"Cleaned up {result.deleted_count} old system logs")
+            if deleted_count > 0:
+                print(f"Cleaned up {deleted_count} old system logs")
                 
         except Exception as e:
             print(f"Error cleaning up old system logs: {e}")
     
+    def _apply_message_retention(self):
+        """Drop whole message partitions past retention"""
+        try:
+            self.db.apply_message_retention()
+            
+        except Exception as e:
+            print(f"Error applying message retention: {e}")
+    
+    def _compact_deleted_messages(self):
+        """Run message compaction off the scheduler thread"""
+        try:
+            if self.compaction_thread and self.compaction_thread.is_alive():
+                return
+            
+            self.compaction_thread = threading.Thread(
+                target=self.compactor.run,
+                args=(self.compaction_max_duration,),
+                daemon=True
+            )
+            self.compaction_thread.start()
+            
+        except Exception as e:
+            print(f"Error starting message compaction: {e}")
+    
     def get_scheduled_messages(self) -> List[Dict]:
         """Get list of scheduled messages"""
         try:
             scheduled = []
-            for message_id, task in self.scheduled_messages.items():
+            for task in self.destruction_queue.snapshot():
                 scheduled.append({
-                    'message_id': message_id,
+                    'message_id': task['message_id'],
                     'destruct_at': task['destruct_at'].isoformat(),
                     'read_once': task['read_once'],
                     'status': task['status'],
@@ -355,35 +434,47 @@ class MessageScheduler:
     def get_cleanup_statistics(self) -> Dict:
         """Get cleanup statistics"""
         try:
-            current_time = datetime.utcnow()
+            current_time = self.clock.now()
             
             # Count expired messages
-            expired_messages = self.db.db.messages.count_documents({
-                'destruct_at': {'$lt': current_time},
-                'is_deleted': False
-            })
+            expired_messages = self.db.count_expired_messages()
             
             # Count expired keys
-            expired_keys = self.db.db.session_keys.count_documents({
-                'expires_at': {'$lt': current_time},
-                'is_destroyed': False
-            })
+            expired_keys = self.db.count_expired_keys()
             
             # Count scheduled messages
-            scheduled_count = len(self.scheduled_messages)
+            scheduled_count = len(self.destruction_queue)
+            next_deadline = self.destruction_queue.next_deadline()
             
             return {
                 'expired_messages': expired_messages,
                 'expired_keys': expired_keys,
                 'scheduled_messages': scheduled_count,
+                'next_destruction': next_deadline.isoformat() if next_deadline else None,
                 'last_cleanup': current_time.isoformat(),
-                'scheduler_running': self.running
+                'scheduler_running': self.running,
+                'expiry_mode': self.db.expiry_mode,
+                'expiry_audit': self.expiry_auditor.get_statistics() if self.expiry_auditor else None,
+                'coordinator': self.coordinator.get_statistics(),
+                'compaction': self.compactor.get_statistics(),
+                'destruction': self.metrics.get_statistics(scheduled_count, expired_messages)
             }
             
         except Exception as e:
             print(f"Error getting cleanup statistics: {e}")
             return {'error': str(e)}
     
+    def get_destruction_metrics(self) -> Dict:
+        """Destruction lag histogram, queue depth, overdue messages and SLO alert"""
+        try:
+            metrics = self.metrics.get_statistics(len(self.destruction_queue), self.db.count_expired_messages())
+            metrics['timestamp'] = self.clock.now().isoformat()
+            return metrics
+            
+        except Exception as e:
+            print(f"Error getting destruction metrics: {e}")
+            return {'error': str(e)}
+    
     def force_cleanup(self):
         """Force immediate cleanup of all expired items"""
         try:
@@ -398,47 +489,126 @@ class MessageScheduler:
             # Clean up old logs
             self._cleanup_old_threat_logs()
             self._cleanup_old_system_logs()
+            self._apply_message_retention()
             
             print("Forced cleanup completed")
             
         except Exception as e:
             print(f"Error in forced cleanup: {e}")
     
-    def schedule_bulk_destruction(self, message_ids: List[str], destruct_time: int):
-        """Schedule multiple messages for destruction"""
+    def schedule_destructions(self, destruct_times: Dict[str, int], read_once: bool = False) -> Dict[str, str]:
+        """Schedule many messages for destruction with one database write
+        
+        ``destruct_times`` maps message IDs to seconds from now. Returns
+        'scheduled' or 'not_found' (missing or already deleted) per message ID.
+        """
         try:
-            for message_id in message_ids:
-                self.schedule_destruction(message_id, destruct_time)
+            now = self.clock.now()
+            deadlines = {
+                message_id: now + timedelta(seconds=destruct_time)
+                for message_id, destruct_time in destruct_times.items()
+            }
+            
+            # One update_many, or one bulk_write when deadlines differ
+            updated = set(self.db.set_messages_destruct_at(deadlines))
+            
+            # Queue the live messages in one pass over the heap
+            if not self.ttl_expiry:
+                self.destruction_queue.schedule_many([
+                    (message_id, deadlines[message_id], read_once) for message_id in deadlines if message_id in updated
+                ])
             
-            print(f"Scheduled {len(message_ids)} messages for destruction")
+            print(f"Scheduled {len(updated)} of {len(deadlines)} messages for destruction")
+            return {message_id: 'scheduled' if message_id in updated else 'not_found' for message_id in deadlines}
             
         except Exception as e:
             print(f"Error scheduling bulk destruction: {e}")
+            return {message_id: 'error' for message_id in destruct_times}
     
-    def get_destruction_queue(self) -> List[Dict]:
-        """Get messages in destruction queue"""
+    def schedule_bulk_destruction(self, message_ids: List[str], destruct_time: int) -> Dict[str, str]:
+        """Schedule multiple messages for destruction at the same time, e.g. a whole conversation"""
+        return self.schedule_destructions({message_id: destruct_time for message_id in message_ids})
+    
+    def cancel_destructions(self, message_ids: List[str]) -> Dict[str, str]:
+        """Cancel scheduled destruction of many messages with one database write
+        
+        Returns 'cancelled' or 'not_found' (missing or already deleted) per message ID.
+        """
         try:
-            current_time = datetime.utcnow()
-            
-            # Get messages scheduled for destruction
-            queued_messages = list(self.db.db.messages.find({
-                'destruct_at': {'$gt': current_time},
-                'is_deleted': False
-            }).sort('destruct_at', 1))
-            
-            queue = []
-            for message in queued_messages:
-                queue.append({
-                    'message_id': str(message['_id']),
-                    'sender_id': message['sender_id'],
-                    'recipient_id': message['recipient_id'],
-                    'destruct_at': message['destruct_at'].isoformat(),
-                    'time_remaining': (message['destruct_at'] - current_time).total_seconds(),
-                    'read_once': message.get('read_once', False)
-                })
+            self.destruction_queue.cancel_many(message_ids)
+            
+            updated = set(self.db.set_messages_destruct_at({message_id: None for message_id in message_ids}))
+            
+            print(f"Cancelled destruction for {len(updated)} of {len(message_ids)} messages")
+            return {message_id: 'cancelled' if message_id in updated else 'not_found' for message_id in message_ids}
+            
+        except Exception as e:
+            print(f"Error cancelling bulk destruction: {e}")
+            return {message_id: 'error' for message_id in message_ids}
+    
+    def iter_destruction_queue(self, cursor: Optional[str] = None, limit: int = 0, sender_id: Optional[str] = None,
+                               recipient_id: Optional[str] = None) -> Iterator[Dict]:
+        """Stream messages in the destruction queue, soonest first, without reading their content"""
+        current_time = self.clock.now()
+        after = None
+        if cursor:
+            destruct_at, message_id = cursor.split('|', 1)
+            after = (datetime.fromisoformat(destruct_at), message_id)
+        
+        for message in self.db.iter_messages_pending_destruction(after, limit, sender_id, recipient_id):
+            yield {
+                'message_id': message['_id'],
+                'sender_id': message['sender_id'],
+                'recipient_id': message['recipient_id'],
+                'destruct_at': message['destruct_at'].isoformat(),
+                'time_remaining': (message['destruct_at'] - current_time).total_seconds(),
+                'read_once': message.get('read_once', False)
+            }
+    
+    def get_destruction_queue(self, limit: int = 100, cursor: Optional[str] = None, sender_id: Optional[str] = None,
+                              recipient_id: Optional[str] = None) -> Dict:
+        """Get one page of the destruction queue
+        
+        ``next_cursor`` is passed back as ``cursor`` for the following page and
+        is None on the last one.
+        """
+        try:
+            queue = list(self.iter_destruction_queue(cursor, limit, sender_id, recipient_id))
+            last = queue[-1] if limit and len(queue) == limit else None
             
-            return queue
+            return {
+                'messages': queue,
+                'next_cursor': f"{last['destruct_at']}|{last['message_id']}" if last else None
+            }
             
         except Exception as e:
             print(f"Error getting destruction queue: {e}")
+            return {'messages': [], 'next_cursor': None, 'error': str(e)}
+    
+    def summarize_destruction_queue(self, bucket_seconds: int = 60, sender_id: Optional[str] = None,
+                                    recipient_id: Optional[str] = None) -> List[Dict]:
+        """Count queued destructions per bucket_seconds of destruct_at, aggregated by the database"""
+        try:
+            return [
+                {
+                    'bucket_start': bucket['bucket_start'].isoformat(),
+                    'count': bucket['count'],
+                    'read_once': bucket['read_once']
+                }
+                for bucket in self.db.summarize_messages_pending_destruction(bucket_seconds, sender_id, recipient_id)
+            ]
+            
+        except Exception as e:
+            print(f"Error summarizing destruction queue: {e}")
             return []
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_message_scheduler() -> MessageScheduler:
+    """Process-wide scheduler shared by the app and blueprints"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = MessageScheduler()
+        return _scheduler
@@ -0,0 +1,132 @@
+"""
+TacticalLink Model Retraining
+Retrains the threat model from sampled live traffic in the background and rolls new versions out to every worker
+"""
+
+import os
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+
+LEASE_NAME = 'threat-model-retrain'
+
+class FeatureReservoir:
+    """Uniform sample of up to capacity feature rows from an unbounded stream (Algorithm R)
+    
+    Row n replaces a random slot with probability capacity/n, so every row
+    seen so far is equally likely to be in the sample and memory stays fixed.
+    """
+    
+    def __init__(self, capacity: int = 10000, n_features: int = 10, seed: Optional[int] = None):
+        self.capacity = capacity
+        self.rows = np.zeros((capacity, n_features))
+        self.seen = 0
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+    
+    def __len__(self) -> int:
+        return min(self.seen, self.capacity)
+    
+    def add(self, features: Sequence[float]):
+        """Offer one feature row to the sample"""
+        with self.lock:
+            self.seen += 1
+            slot = self.seen - 1 if self.seen <= self.capacity else self.random.randrange(self.seen)
+            if slot < self.capacity:
+                self.rows[slot] = features
+    
+    def sample(self) -> np.ndarray:
+        """Copy of the rows currently sampled"""
+        with self.lock:
+            return self.rows[:len(self)].copy()
+
+class ModelRetrainer:
+    """Retrains the threat model in the background and keeps every worker on the newest version
+    
+    Each process runs one. Every poll_interval seconds it installs the
+    version the model manifest names if the detector runs another one. Every
+    retrain_interval seconds the worker that takes its host's retrain lease
+    fits a new model on its reservoir of recent feature rows, publishes it as
+    a new version and installs it; the host's other workers pick it up on
+    their next poll. Model versions live in the host's THREAT_MODEL_DIR, so
+    the lease is per host and every host retrains its own model. Scoring
+    never waits for either, since the detector swaps models with a single
+    reference assignment.
+    """
+    
+    def __init__(self, detector, db, owner: Optional[str] = None,
+                 retrain_interval: float = 86400, poll_interval: float = 30):
+        self.detector = detector
+        self.db = db
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_name = f"{LEASE_NAME}:{socket.gethostname()}"
+        self.retrain_interval = retrain_interval
+        self.poll_interval = poll_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.stats = {'retrains': 0, 'retrain_failures': 0, 'skipped': 0, 'reloads': 0,
+                      'errors': 0, 'last_retrain_seconds': None}
+    
+    def start(self):
+        """Start polling for new versions and retraining on schedule"""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+    
+    def stop(self):
+        """Stop the background thread; a retrain in progress is finished first"""
+        self.stop_event.set()
+        if self.thread and self.thread.is_alive():
+            self.thread.join(timeout=5)
+    
+    def _run(self):
+        next_retrain = time.monotonic() + self.retrain_interval
+        while not self.stop_event.wait(self.poll_interval):
+            self.poll()
+            if time.monotonic() >= next_retrain:
+                next_retrain = time.monotonic() + self.retrain_interval
+                self.retrain()
+    
+    def poll(self) -> bool:
+        """Install the published version if it is not the one in use"""
+        try:
+            if self.detector.reload_if_changed():
+                self.stats['reloads'] += 1
+                return True
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Error checking for a new threat model: {e}")
+        return False
+    
+    def retrain(self) -> bool:
+        """Retrain and publish unless another worker holds this round's lease"""
+        # The lease lasts half an interval and is never released, so one
+        # worker per host retrains per round even though every worker's timer fires
+        if not self.db.acquire_lease(self.lease_name, self.owner, self.retrain_interval / 2):
+            self.stats['skipped'] += 1
+            return False
+        
+        started = time.perf_counter()
+        retrained = self.detector.retrain_model()
+        self.stats['retrains' if retrained else 'retrain_failures'] += 1
+        if retrained:
+            self.stats['last_retrain_seconds'] = time.perf_counter() - started
+        return retrained
+    
+    def get_statistics(self) -> Dict:
+        """Retraining statistics for monitoring"""
+        return {
+            **self.stats,
+            'owner': self.owner,
+            'lease': self.lease_name,
+            'model_version': self.detector.model_version,
+            'reservoir_rows': len(self.detector.reservoir),
+            'rows_seen': self.detector.reservoir.seen
+        }
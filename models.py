@@ -208,6 +208,7 @@ MongoDB Collections Schema:
    - is_active: Boolean
    - created_at: DateTime
    - last_login: DateTime
+   - last_seen: DateTime (coalesced presence updates)
 
 2. messages
    - _id: ObjectId
@@ -220,7 +221,9 @@ MongoDB Collections Schema:
    - timestamp: DateTime
    - is_read: Boolean
    - is_deleted: Boolean
-   - destruct_at: DateTime
+   - deleted_at: DateTime (hard-deleted by compaction after the grace period)
+   - deleted_by: ObjectId (token of the bulk delete that removed the message)
+   - destruct_at: DateTime (TTL-indexed when MESSAGE_EXPIRY_MODE=ttl)
 
 3. threat_logs
    - _id: ObjectId
@@ -232,17 +235,37 @@ MongoDB Collections Schema:
    - is_resolved: Boolean
    - resolved_at: DateTime
    - resolved_by: ObjectId (reference to users._id)
+   Once migrated, resolved logs move to resolved_threat_logs (time-series on
+   timestamp with metaField user_id, expiring after THREAT_LOG_RETENTION_DAYS)
 
 4. session_keys
    - _id: ObjectId
    - key_id: String (unique)
    - encrypted_key: String
    - created_at: DateTime
-   - expires_at: DateTime
+   - expires_at: DateTime (TTL-indexed when MESSAGE_EXPIRY_MODE=ttl)
    - is_destroyed: Boolean
    - destroyed_at: DateTime
 
-5. system_logs
+5. message_buckets (MESSAGE_STORAGE_MODE=bucket, replaces messages)
+   - _id: ObjectId
+   - conversation_id: String (sorted "user1:user2")
+   - participants: Array of user IDs
+   - bucket_start: DateTime (start of the bucket time window)
+   - count: Integer (messages pushed, capped at MESSAGE_BUCKET_SIZE)
+   - deleted_count: Integer
+   - first_timestamp / last_timestamp: DateTime
+   - next_destruct_at: DateTime (earliest pending self-destruct, absent if none)
+   - compacted_count: Integer (deleted messages replaced by tombstones)
+   - messages: Array of message documents (fields as in messages, without _id)
+   Message IDs are "<bucket _id>:<array position>"
+
+6. messages_YYYYMMDD / messages_YYYYMMDDHH (MESSAGE_STORAGE_MODE=partitioned, replaces messages)
+   - Same fields as messages, one collection per day or hour of timestamp
+   - Partitions older than MESSAGE_RETENTION_DAYS are dropped whole
+   Message IDs are "<YYYYMMDD[HH]>:<ObjectId>"
+
+7. system_logs (time-series on timestamp with metaField event_type after log_migration.py)
    - _id: ObjectId
    - event_type: String
    - user_id: ObjectId (optional)
@@ -250,13 +273,36 @@ MongoDB Collections Schema:
    - timestamp: DateTime
    - metadata: Object
 
+8. leases
+   - _id: String (lease name, e.g. "destruction:60:<shard start>")
+   - owner: String (host:pid:nonce of the holding worker)
+   - expires_at: DateTime (renewed by heartbeats; TTL index removes abandoned leases)
+   - heartbeat_at: DateTime
+
+9. job_state
+   - _id: String (job name, e.g. "message_compaction", "ttl_expiry_audit")
+   - checkpoint fields of the job (cutoff, resume_after, running totals, change stream resume_token)
+
 Indexes:
 - users.username: unique
 - users.email: unique
 - messages.sender_id: index
 - messages.recipient_id: index
 - messages.timestamp: index
+- messages.destruct_at: index (TTL index, expireAfterSeconds 0, when MESSAGE_EXPIRY_MODE=ttl)
+- messages.deleted_at: partial index (soft-deleted messages)
 - threat_logs.user_id: index
 - threat_logs.timestamp: index
+- resolved_threat_logs.(user_id, timestamp): index
 - session_keys.key_id: unique
+- session_keys.expires_at: index (TTL index, expireAfterSeconds 0, when MESSAGE_EXPIRY_MODE=ttl)
+- leases.expires_at: TTL index (1 hour after expiry)
+- message_buckets.(conversation_id, bucket_start, count): index
+- message_buckets.(participants, bucket_start): index
+- message_buckets.next_destruct_at: partial index
+- messages_<partition>.(recipient_id, is_read, timestamp): index
+- messages_<partition>.(sender_id, timestamp): index
+- messages_<partition>.(sender_id, recipient_id, timestamp): index
+- messages_<partition>.destruct_at: partial index (live messages)
+- messages_<partition>.deleted_at: partial index (soft-deleted messages)
 """
@@ -0,0 +1,103 @@
+"""
+TacticalLink Presence Tracking
+Coalesces last-login and last-seen writes into periodic bulk updates
+"""
+
+import atexit
+import threading
+from datetime import datetime
+from typing import Dict, Optional
+
+class PresenceCoalescer:
+    """Buffers per-user activity timestamps and flushes them in one bulk write
+    
+    Only the latest timestamp per user and field is kept, so a user who logs
+    in or polls many times between flushes costs a single update.
+    """
+    
+    def __init__(self, db, flush_interval: float = 10.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.flush_thread = None
+        self.stats = {'recorded': 0, 'flushes': 0, 'users_flushed': 0, 'flush_errors': 0}
+    
+    def record_login(self, user_id: str, timestamp: Optional[datetime] = None):
+        """Record a successful login"""
+        timestamp = timestamp or datetime.utcnow()
+        self._record(user_id, {'last_login': timestamp, 'last_seen': timestamp})
+    
+    def record_activity(self, user_id: str, timestamp: Optional[datetime] = None):
+        """Record authenticated activity"""
+        self._record(user_id, {'last_seen': timestamp or datetime.utcnow()})
+    
+    def _record(self, user_id: str, fields: Dict[str, datetime]):
+        with self.lock:
+            pending = self.pending.setdefault(user_id, {})
+            for field, timestamp in fields.items():
+                if field not in pending or timestamp > pending[field]:
+                    pending[field] = timestamp
+            self.stats['recorded'] += 1
+        
+        if self.flush_thread is None:
+            self.start()
+    
+    def get_last_seen(self, user_id: str) -> Optional[datetime]:
+        """Unflushed last-seen time for a user, if any"""
+        with self.lock:
+            return self.pending.get(user_id, {}).get('last_seen')
+    
+    def flush(self) -> int:
+        """Write all buffered timestamps in one bulk update"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        
+        if not pending:
+            return 0
+        
+        try:
+            self.db.update_user_activity(pending)
+            with self.lock:
+                self.stats['flushes'] += 1
+                self.stats['users_flushed'] += len(pending)
+            return len(pending)
+        
+        except Exception as e:
+            print(f"Error flushing presence updates: {e}")
+            # Put the batch back without overwriting newer timestamps
+            with self.lock:
+                self.stats['flush_errors'] += 1
+                for user_id, fields in pending.items():
+                    current = self.pending.setdefault(user_id, {})
+                    for field, timestamp in fields.items():
+                        if field not in current or timestamp > current[field]:
+                            current[field] = timestamp
+            return 0
+    
+    def start(self):
+        """Start the background flush thread"""
+        with self.lock:
+            if self.flush_thread is not None:
+                return
+            self.flush_thread = threading.Thread(target=self._run, daemon=True)
+        self.flush_thread.start()
+        atexit.register(self.stop)
+    
+    def stop(self):
+        """Stop the flush thread and write anything still buffered"""
+        self.stop_event.set()
+        if self.flush_thread and self.flush_thread.is_alive():
+            self.flush_thread.join(timeout=5)
+        self.flush()
+    
+    def _run(self):
+        """Flush loop"""
+        while not self.stop_event.wait(self.flush_interval):
+            self.flush()
+    
+    def get_statistics(self) -> Dict:
+        """Coalescer statistics for monitoring"""
+        with self.lock:
+            return {**self.stats, 'pending_users': len(self.pending)}
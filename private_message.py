@@ -4,18 +4,21 @@ from datetime import datetime
 from threading import Timer
 
 from encryption import EncryptionManager
-from ai_threat import ThreatDetector
-from database import Database
-from message_scheduler import MessageScheduler
-from models import Message, ThreatLog
+from storage_backend import create_database
+from message_scheduler import get_message_scheduler
+from message_delivery import delivery_hub
+from threat_scoring import get_threat_pipeline
+from models import Message
 
 private_bp = Blueprint("private_bp", __name__)
 
 # use your existing components
-db = Database()
+db = create_database()
 encryption_manager = EncryptionManager()
-threat_detector = ThreatDetector()
-message_scheduler = MessageScheduler()
+threat_pipeline = get_threat_pipeline()
+message_scheduler = get_message_scheduler()
+delivery_hub.attach(db)
+delivery_hub.attach(message_scheduler.db)
 
 
 @private_bp.route("/send", methods=["POST"])
@@ -68,29 +71,23 @@ def send_private_message():
             message_id, self_destruct_time, read_once
         )
 
-        # AI threat analysis
-        threat_score = threat_detector.analyze_message_metadata(
+        # AI threat analysis runs in the scoring pipeline, which logs flagged messages
+        threat_score = threat_pipeline.provisional_score(current_user_id)
+        threat_pipeline.enqueue(
             sender_id=current_user_id,
             recipient_id=target_id,
             message_length=len(message_content),
-            timestamp=datetime.utcnow()
+            reason="Private message flagged by AI",
+            message_id=message_id
         )
 
-        if threat_score > 70:
-            log = ThreatLog(
-                user_id=current_user_id,
-                threat_score=threat_score,
-                reason="Private message flagged by AI",
-                timestamp=datetime.utcnow()
-            )
-            db.create_threat_log(log)
-
         return jsonify({
             "success": True,
             "message_id": message_id,
             "target_id": target_id,
             "self_destruct_time": self_destruct_time,
-            "threat_score": threat_score
+            "threat_score": threat_score,
+            "threat_score_provisional": True
         }), 201
 
     except Exception as e:
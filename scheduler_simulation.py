@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+TacticalLink Scheduler Simulation
+Pushes millions of self-destruct timers through MessageScheduler on a virtual clock
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import random
+import resource
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from clock import VirtualClock
+from message_scheduler import MessageScheduler
+from storage_backend import EXPIRY_MODE_POLL
+
+class MemoryStore:
+    """Dict-backed stand-in for the storage backend, covering what the destruction path calls
+    
+    Deletes are stamped with the virtual time and counted per message, so the
+    simulation can prove every deadline fired once and on time.
+    """
+    
+    expiry_mode = EXPIRY_MODE_POLL
+    log_retention_managed = False
+    
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        self.messages = {}
+        self.deleted_at = {}
+        self.delete_attempts = Counter()
+        self.logged = 0
+        self.message_listeners = []
+    
+    def create_messages(self, count: int) -> List[str]:
+        ids = [str(i) for i in range(count)]
+        for message_id in ids:
+            self.messages[message_id] = {
+                '_id': message_id, 'sender_id': 'sim-sender', 'recipient_id': 'sim-recipient',
+                'is_deleted': False, 'destruct_at': None, 'read_once': False
+            }
+        return ids
+    
+    def get_message_by_id(self, message_id: str) -> Optional[Dict]:
+        return self.messages.get(message_id)
+    
+    def get_messages_by_ids(self, message_ids: List[str]) -> List[Dict]:
+        return [self.messages[m] for m in message_ids if m in self.messages]
+    
+    def set_message_destruct_at(self, message_id: str, destruct_at: Optional[datetime]):
+        self.set_messages_destruct_at({message_id: destruct_at})
+    
+    def set_messages_destruct_at(self, deadlines: Dict[str, Optional[datetime]]) -> List[str]:
+        updated = []
+        for message_id, destruct_at in deadlines.items():
+            message = self.messages.get(message_id)
+            if message and not message['is_deleted']:
+                message['destruct_at'] = destruct_at
+                updated.append(message_id)
+        return updated
+    
+    def delete_messages(self, message_ids: List[str]) -> List[str]:
+        now = self.clock.now()
+        deleted = []
+        for message_id in message_ids:
+            self.delete_attempts[message_id] += 1
+            message = self.messages.get(message_id)
+            if message and not message['is_deleted']:
+                message['is_deleted'] = True
+                self.deleted_at[message_id] = now
+                deleted.append(message_id)
+        return deleted
+    
+    def log_system_events(self, log_entries: List[Dict]) -> int:
+        self.logged += len(log_entries)
+        return len(log_entries)
+    
+    def count_expired_messages(self) -> int:
+        now = self.clock.now()
+        return sum(
+            1 for m in self.messages.values()
+            if m['destruct_at'] and m['destruct_at'] < now and not m['is_deleted']
+        )
+
+def _rss_bytes() -> int:
+    """Current resident set size (peak RSS where /proc is unavailable)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _chunks(items: List[str], size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+def _phase(work) -> Dict:
+    """Run work quietly, returning its wall and CPU seconds"""
+    wall, cpu = time.perf_counter(), time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        work()
+    return {'wall_seconds': time.perf_counter() - wall, 'cpu_seconds': time.process_time() - cpu}
+
+def simulate(timers: int = 1_000_000, cancel_fraction: float = 0.1, horizon: float = 86400,
+             batch_size: int = 10_000, seed: int = 7) -> Dict:
+    """Schedule, cancel and fire ``timers`` destructions spread over ``horizon`` virtual seconds"""
+    rng = random.Random(seed)
+    clock = VirtualClock(datetime(2030, 1, 1))
+    store = MemoryStore(clock)
+    ids = store.create_messages(timers)
+    scheduler = MessageScheduler(db=store, clock=clock)
+    queue = scheduler.destruction_queue
+    
+    start = clock.now()
+    delays = {message_id: rng.uniform(1, horizon) for message_id in ids}
+    cancelled = set(rng.sample(ids, int(timers * cancel_fraction)))
+    
+    gc.collect()
+    rss_before = _rss_bytes()
+    schedule_phase = _phase(lambda: [
+        scheduler.schedule_destructions({message_id: delays[message_id] for message_id in chunk})
+        for chunk in _chunks(ids, batch_size)
+    ])
+    gc.collect()
+    queue_bytes = _rss_bytes() - rss_before
+    queued = len(queue)
+    
+    cancel_phase = _phase(lambda: [
+        scheduler.cancel_destructions(chunk) for chunk in _chunks(sorted(cancelled), batch_size)
+    ])
+    
+    def fire():
+        while True:
+            deadline = queue.next_deadline()
+            if deadline is None:
+                break
+            clock.advance_to(deadline)
+            scheduler.fire_due_destructions()
+    fire_phase = _phase(fire)
+    
+    expected = set(ids) - cancelled
+    deadline_of = lambda message_id: start + timedelta(seconds=delays[message_id])
+    fired = set(store.deleted_at)
+    report = {
+        'timers': timers,
+        'queued': queued,
+        'cancelled': len(cancelled),
+        'fired': len(fired),
+        'missed': len(expected - fired),
+        'fired_after_cancel': len(fired & cancelled),
+        'fired_twice': sum(1 for count in store.delete_attempts.values() if count > 1),
+        'fired_early': sum(1 for m in fired if store.deleted_at[m] < deadline_of(m)),
+        'fired_late': sum(1 for m in fired if store.deleted_at[m] > deadline_of(m)),
+        'audit_events': store.logged,
+        'schedule': {**schedule_phase, 'per_second': timers / schedule_phase['wall_seconds']},
+        'cancel': {**cancel_phase, 'per_second': len(cancelled) / max(cancel_phase['wall_seconds'], 1e-9)},
+        'fire': {**fire_phase, 'per_second': len(fired) / max(fire_phase['wall_seconds'], 1e-9)}
+    }
+    total_cpu = schedule_phase['cpu_seconds'] + cancel_phase['cpu_seconds'] + fire_phase['cpu_seconds']
+    report['per_million_timers'] = {
+        'cpu_seconds': total_cpu * 1_000_000 / timers,
+        # RSS growth while scheduling: heap entries plus the store's destruct_at values
+        'scheduling_memory_mb': queue_bytes * 1_000_000 / timers / 2**20
+    }
+    report['ok'] = not any(report[k] for k in ('missed', 'fired_after_cancel', 'fired_twice', 'fired_early', 'fired_late'))
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[-1])
+    parser.add_argument('--timers', type=int, default=1_000_000)
+    parser.add_argument('--cancel-fraction', type=float, default=0.1)
+    parser.add_argument('--horizon', type=float, default=86400, help='virtual seconds timers are spread over')
+    parser.add_argument('--batch-size', type=int, default=10_000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    
+    result = simulate(args.timers, args.cancel_fraction, args.horizon, args.batch_size, args.seed)
+    print(json.dumps(result, indent=2))
+    raise SystemExit(0 if result['ok'] else 1)
@@ -0,0 +1,936 @@
+"""
+TacticalLink SQLite Database Manager
+Embedded single-node storage for users, messages, and threat logs
+"""
+
+import sqlite3
+import threading
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Iterator, List, Dict, Any, Optional, Tuple
+from dotenv import load_dotenv
+from models import User, Message, ThreatLog, SessionKey
+from storage_backend import StorageBackend, PENDING_DESTRUCTION_FIELDS
+
+load_dotenv()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    email TEXT NOT NULL UNIQUE,
+    is_admin INTEGER NOT NULL DEFAULT 0,
+    created_at TEXT,
+    last_login TEXT,
+    last_seen TEXT,
+    public_key TEXT,
+    private_key TEXT,
+    password_hash BLOB,
+    is_active INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    sender_id TEXT NOT NULL,
+    recipient_id TEXT NOT NULL,
+    content TEXT,
+    original_content TEXT,
+    session_key TEXT,
+    self_destruct_time INTEGER NOT NULL DEFAULT 0,
+    read_once INTEGER NOT NULL DEFAULT 0,
+    timestamp TEXT NOT NULL,
+    is_read INTEGER NOT NULL DEFAULT 0,
+    is_deleted INTEGER NOT NULL DEFAULT 0,
+    deleted_at TEXT,
+    destruct_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_recipient ON messages (recipient_id, is_read, is_deleted, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_sender ON messages (sender_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_conversation ON messages (sender_id, recipient_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages (timestamp);
+CREATE INDEX IF NOT EXISTS idx_messages_destruct_at ON messages (destruct_at) WHERE destruct_at IS NOT NULL AND is_deleted = 0;
+CREATE INDEX IF NOT EXISTS idx_messages_deleted_at ON messages (deleted_at) WHERE is_deleted = 1;
+
+CREATE TABLE IF NOT EXISTS threat_logs (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    threat_score REAL NOT NULL,
+    reason TEXT,
+    timestamp TEXT NOT NULL,
+    metadata TEXT,
+    is_resolved INTEGER NOT NULL DEFAULT 0,
+    resolved_at TEXT,
+    resolved_by TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_threat_logs_user ON threat_logs (user_id, timestamp);
+CREATE INDEX IF NOT EXISTS idx_threat_logs_timestamp ON threat_logs (timestamp);
+CREATE INDEX IF NOT EXISTS idx_threat_logs_score ON threat_logs (threat_score);
+
+CREATE TABLE IF NOT EXISTS session_keys (
+    id INTEGER PRIMARY KEY,
+    key_id TEXT NOT NULL UNIQUE,
+    encrypted_key TEXT,
+    created_at TEXT,
+    expires_at TEXT,
+    is_destroyed INTEGER NOT NULL DEFAULT 0,
+    destroyed_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_session_keys_expires_at ON session_keys (expires_at) WHERE is_destroyed = 0;
+
+CREATE TABLE IF NOT EXISTS system_logs (
+    id INTEGER PRIMARY KEY,
+    event_type TEXT,
+    user_id TEXT,
+    timestamp TEXT NOT NULL,
+    data TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_system_logs_timestamp ON system_logs (timestamp);
+CREATE INDEX IF NOT EXISTS idx_system_logs_event ON system_logs (event_type, timestamp);
+
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at TEXT NOT NULL,
+    heartbeat_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS job_state (
+    name TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS user_behavior (
+    user_id TEXT PRIMARY KEY,
+    lengths TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    last_activity TEXT,
+    suspicious_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TEXT
+);
+"""
+
+# Approximate stored size of a message row, reported by compaction
+MESSAGE_ROW_BYTES = (
+    "COALESCE(LENGTH(CAST(content AS BLOB)), 0) + COALESCE(LENGTH(CAST(original_content AS BLOB)), 0) + "
+    "COALESCE(LENGTH(CAST(session_key AS BLOB)), 0) + LENGTH(sender_id) + LENGTH(recipient_id) + 64"
+)
+
+# Columns stored as ISO-8601 text and returned as datetime
+DATETIME_COLUMNS = {
+    'created_at', 'last_login', 'last_seen', 'timestamp', 'deleted_at', 'destruct_at',
+    'resolved_at', 'expires_at', 'destroyed_at', 'last_activity'
+}
+
+# Rows per statement of bulk updates: two bound values each stays within the
+# 999-variable limit of older SQLite builds, and the lock is released between statements
+BULK_UPDATE_ROWS = 499
+
+# Columns stored as 0/1 and returned as bool
+BOOLEAN_COLUMNS = {'is_admin', 'is_active', 'read_once', 'is_read', 'is_deleted', 'is_resolved', 'is_destroyed'}
+
+def _to_db(value: Any) -> Any:
+    """Convert a Python value to its SQLite representation"""
+    if isinstance(value, datetime):
+        # Fixed-width format keeps text comparison in chronological order
+        return value.isoformat(sep=' ', timespec='microseconds')
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, dict):
+        return json.dumps(value, default=str)
+    return value
+
+def _encode_state(value: Any) -> Any:
+    """JSON default hook keeping datetimes distinguishable in job state"""
+    if isinstance(value, datetime):
+        return {'$date': _to_db(value)}
+    raise TypeError(f"Cannot store {type(value).__name__} in job state")
+
+def _decode_state(document: Dict) -> Any:
+    if set(document) == {'$date'}:
+        return datetime.fromisoformat(document['$date'])
+    return document
+
+def _from_row(row: sqlite3.Row) -> Dict:
+    """Convert a SQLite row to the document shape returned by the Mongo backend"""
+    document = {}
+    for key in row.keys():
+        value = row[key]
+        if key == 'id':
+            document['_id'] = str(value)
+        elif key in DATETIME_COLUMNS and value is not None:
+            document[key] = datetime.fromisoformat(value)
+        elif key in BOOLEAN_COLUMNS:
+            document[key] = bool(value)
+        elif key in ('metadata', 'data'):
+            document[key] = json.loads(value) if value else {}
+        else:
+            document[key] = value
+    return document
+
+class SQLiteDatabase(StorageBackend):
+    """Embedded SQLite (WAL mode) database manager for TacticalLink"""
+    
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.getenv('SQLITE_PATH', 'data/tactical_link.db')
+        self.lock = threading.RLock()
+        self.conn = None
+        self.message_listeners = []
+        self.connect()
+        self.create_indexes()
+    
+    def connect(self):
+        """Open the SQLite database in WAL mode"""
+        try:
+            if self.path != ':memory:':
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+            
+            self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self.conn.row_factory = sqlite3.Row
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute("PRAGMA foreign_keys=ON")
+            print(f"Opened SQLite database at {self.path}")
+        
+        except sqlite3.Error as e:
+            print(f"Failed to open SQLite database: {e}")
+            raise
+    
+    def create_indexes(self):
+        """Create tables and indexes"""
+        with self.lock:
+            self.conn.executescript(SCHEMA)
+            self.conn.commit()
+    
+    def _execute(self, sql: str, params: tuple = ()) -> sqlite3.Cursor:
+        with self.lock:
+            cursor = self.conn.execute(sql, tuple(_to_db(p) for p in params))
+            self.conn.commit()
+            return cursor
+    
+    def _query(self, sql: str, params: tuple = ()) -> List[Dict]:
+        with self.lock:
+            rows = self.conn.execute(sql, tuple(_to_db(p) for p in params)).fetchall()
+        return [_from_row(row) for row in rows]
+    
+    def _insert(self, table: str, document: Dict) -> str:
+        columns = list(document.keys())
+        sql = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        return str(self._execute(sql, tuple(document[c] for c in columns)).lastrowid)
+    
+    @staticmethod
+    def _row_id(document_id: str) -> Optional[int]:
+        try:
+            return int(document_id)
+        except (TypeError, ValueError):
+            return None
+    
+    # User operations
+    def create_user(self, user: User) -> str:
+        """Create a new user"""
+        try:
+            return self._insert('users', user.to_dict())
+        except sqlite3.IntegrityError:
+            raise ValueError("Username or email already exists")
+        except Exception as e:
+            raise Exception(f"Error creating user: {e}")
+    
+    def get_user_by_id(self, user_id: str) -> Optional[Dict]:
+        """Get user by ID"""
+        try:
+            users = self._query("SELECT * FROM users WHERE id = ?", (self._row_id(user_id),))
+            return users[0] if users else None
+        except Exception as e:
+            print(f"Error getting user by ID: {e}")
+            return None
+    
+    def get_user_by_username(self, username: str) -> Optional[Dict]:
+        """Get user by username"""
+        try:
+            users = self._query("SELECT * FROM users WHERE username = ?", (username,))
+            return users[0] if users else None
+        except Exception as e:
+            print(f"Error getting user by username: {e}")
+            return None
+    
+    def update_last_login(self, user_id: str):
+        """Update user's last login timestamp"""
+        try:
+            self._execute("UPDATE users SET last_login = ? WHERE id = ?",
+                          (datetime.utcnow(), self._row_id(user_id)))
+        except Exception as e:
+            print(f"Error updating last login: {e}")
+    
+    def update_user_activity(self, activity: Dict[str, Dict[str, datetime]]) -> int:
+        """Apply coalesced activity timestamps in one transaction"""
+        updates = {'last_login': [], 'last_seen': []}
+        for user_id, fields in activity.items():
+            for field, timestamp in fields.items():
+                updates[field].append((_to_db(timestamp), self._row_id(user_id)))
+        
+        with self.lock:
+            for field, rows in updates.items():
+                if rows:
+                    self.conn.executemany(
+                        f"UPDATE users SET {field} = MAX(COALESCE({field}, ''), ?) WHERE id = ?", rows
+                    )
+            self.conn.commit()
+        return len(activity)
+    
+    def get_all_users(self) -> List[Dict]:
+        """Get all users (admin function)"""
+        try:
+            return self._query(
+                "SELECT id, username, email, is_admin, created_at, last_login, last_seen, public_key, is_active "
+                "FROM users WHERE is_active = 1"
+            )
+        except Exception as e:
+            print(f"Error getting all users: {e}")
+            return []
+    
+    def get_total_users(self) -> int:
+        """Get total number of active users"""
+        try:
+            with self.lock:
+                return self.conn.execute("SELECT COUNT(*) FROM users WHERE is_active = 1").fetchone()[0]
+        except Exception as e:
+            print(f"Error getting total users: {e}")
+            return 0
+    
+    # Message operations
+    def create_message(self, message: Message) -> str:
+        """Create a new message"""
+        try:
+            message_id = self._insert('messages', message.to_dict())
+            self._notify_message_listeners('insert', {**message.to_dict(), '_id': message_id})
+            return message_id
+        except Exception as e:
+            raise Exception(f"Error creating message: {e}")
+    
+    def get_message_by_id(self, message_id: str) -> Optional[Dict]:
+        """Get message by ID"""
+        try:
+            messages = self._query("SELECT * FROM messages WHERE id = ?", (self._row_id(message_id),))
+            return messages[0] if messages else None
+        except Exception as e:
+            print(f"Error getting message by ID: {e}")
+            return None
+    
+    def get_messages_by_ids(self, message_ids: List[str]) -> List[Dict]:
+        """Get messages by ID with one query"""
+        try:
+            row_ids = [row_id for row_id in map(self._row_id, message_ids) if row_id is not None]
+            if not row_ids:
+                return []
+            return self._query(f"SELECT * FROM messages WHERE id IN ({', '.join('?' * len(row_ids))})",
+                               tuple(row_ids))
+        except Exception as e:
+            print(f"Error getting messages by ID: {e}")
+            return []
+    
+    def get_pending_messages(self, user_id: str) -> List[Dict]:
+        """Get pending messages for a user"""
+        try:
+            return self._query(
+                "SELECT * FROM messages WHERE recipient_id = ? AND is_read = 0 AND is_deleted = 0 "
+                "AND (destruct_at IS NULL OR destruct_at > ?) ORDER BY timestamp ASC",
+                (user_id, datetime.utcnow())
+            )
+        except Exception as e:
+            print(f"Error getting pending messages: {e}")
+            return []
+    
+    def mark_message_as_read(self, message_id: str):
+        """Mark message as read"""
+        try:
+            self._execute("UPDATE messages SET is_read = 1 WHERE id = ?", (self._row_id(message_id),))
+        except Exception as e:
+            print(f"Error marking message as read: {e}")
+    
+    def delete_message(self, message_id: str) -> bool:
+        """Delete a message, returning whether this call deleted it"""
+        try:
+            deleted = self._execute(
+                "UPDATE messages SET is_deleted = 1, deleted_at = ? WHERE id = ? AND is_deleted = 0",
+                (datetime.utcnow(), self._row_id(message_id))
+            ).rowcount > 0
+            if deleted:
+                self._notify_message_listeners('delete', {'_id': message_id})
+            return deleted
+        except Exception as e:
+            print(f"Error deleting message: {e}")
+            return False
+    
+    def delete_messages(self, message_ids: List[str]) -> List[str]:
+        """Delete live messages in one statement, returning the IDs this call deleted"""
+        try:
+            row_ids = [self._row_id(message_id) for message_id in message_ids]
+            if not row_ids:
+                return []
+            
+            with self.lock:
+                rows = self.conn.execute(
+                    f"UPDATE messages SET is_deleted = 1, deleted_at = ? "
+                    f"WHERE id IN ({', '.join('?' * len(row_ids))}) AND is_deleted = 0 RETURNING id",
+                    (_to_db(datetime.utcnow()), *row_ids)
+                ).fetchall()
+                self.conn.commit()
+            
+            deleted = [str(row['id']) for row in rows]
+            for message_id in deleted:
+                self._notify_message_listeners('delete', {'_id': message_id})
+            return deleted
+        except Exception as e:
+            print(f"Error deleting messages: {e}")
+            return []
+    
+    def set_message_destruct_at(self, message_id: str, destruct_at: Optional[datetime]):
+        """Set or clear the self-destruct time of a message"""
+        try:
+            self._execute("UPDATE messages SET destruct_at = ? WHERE id = ?",
+                          (destruct_at, self._row_id(message_id)))
+        except Exception as e:
+            print(f"Error setting message destruct time: {e}")
+    
+    def set_messages_destruct_at(self, deadlines: Dict[str, Optional[datetime]]) -> List[str]:
+        """Set or clear self-destruct times of live messages, one statement per BULK_UPDATE_ROWS, returning the IDs updated"""
+        try:
+            rows = [(row_id, _to_db(destruct_at)) for row_id, destruct_at in
+                    ((self._row_id(message_id), destruct_at) for message_id, destruct_at in deadlines.items())
+                    if row_id is not None]
+            
+            updated = []
+            for start in range(0, len(rows), BULK_UPDATE_ROWS):
+                chunk = rows[start:start + BULK_UPDATE_ROWS]
+                # Each deadline looks its message up by primary key
+                with self.lock:
+                    updated.extend(row['id'] for row in self.conn.execute(
+                        f"WITH deadlines(id, destruct_at) AS (VALUES {', '.join(['(?, ?)'] * len(chunk))}) "
+                        f"UPDATE messages SET destruct_at = deadlines.destruct_at FROM deadlines "
+                        f"WHERE messages.id = deadlines.id AND messages.is_deleted = 0 RETURNING messages.id",
+                        [value for row in chunk for value in row]
+                    ).fetchall())
+                    self.conn.commit()
+            
+            return [str(row_id) for row_id in updated]
+        except Exception as e:
+            print(f"Error setting message destruct times: {e}")
+            return []
+    
+    def get_expired_messages(self, since: Optional[datetime] = None, limit: int = 0) -> List[Dict]:
+        """Get live messages whose self-destruct time has passed, soonest first"""
+        try:
+            return self._query(
+                "SELECT * FROM messages WHERE destruct_at IS NOT NULL AND is_deleted = 0 AND destruct_at < ? "
+                "AND destruct_at >= ? ORDER BY destruct_at ASC LIMIT ?",
+                (datetime.utcnow(), since or '', limit or -1)
+            )
+        except Exception as e:
+            print(f"Error getting expired messages: {e}")
+            return []
+    
+    def count_expired_messages(self) -> int:
+        """Count live messages whose self-destruct time has passed"""
+        try:
+            with self.lock:
+                return self.conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE destruct_at IS NOT NULL AND is_deleted = 0 "
+                    "AND destruct_at < ?",
+                    (_to_db(datetime.utcnow()),)
+                ).fetchone()[0]
+        except Exception as e:
+            print(f"Error counting expired messages: {e}")
+            return 0
+    
+    def get_messages_pending_destruction(self) -> List[Dict]:
+        """Get live messages scheduled to self-destruct in the future, soonest first"""
+        try:
+            return self._query(
+                "SELECT * FROM messages WHERE destruct_at IS NOT NULL AND is_deleted = 0 AND destruct_at > ? "
+                "ORDER BY destruct_at ASC",
+                (datetime.utcnow(),)
+            )
+        except Exception as e:
+            print(f"Error getting messages pending destruction: {e}")
+            return []
+    
+    @staticmethod
+    def _participant_clause(sender_id: Optional[str], recipient_id: Optional[str]) -> Tuple[str, tuple]:
+        clause, params = "", ()
+        if sender_id:
+            clause, params = clause + " AND sender_id = ?", params + (sender_id,)
+        if recipient_id:
+            clause, params = clause + " AND recipient_id = ?", params + (recipient_id,)
+        return clause, params
+    
+    def iter_messages_pending_destruction(self, after: Optional[Tuple[datetime, str]] = None, limit: int = 0,
+                                          sender_id: Optional[str] = None,
+                                          recipient_id: Optional[str] = None) -> Iterator[Dict]:
+        """Stream live messages scheduled to self-destruct in the future, soonest first
+        
+        Rows are fetched in keyset pages so the connection lock is never held
+        while the caller consumes them.
+        """
+        try:
+            participants, participant_params = self._participant_clause(sender_id, recipient_id)
+            sql = (
+                f"SELECT id, {', '.join(PENDING_DESTRUCTION_FIELDS)} FROM messages "
+                f"WHERE destruct_at IS NOT NULL AND is_deleted = 0 AND destruct_at > ?{participants} "
+                f"AND (destruct_at > ? OR (destruct_at = ? AND id > ?)) ORDER BY destruct_at ASC, id ASC LIMIT ?"
+            )
+            now = datetime.utcnow()
+            after_at, after_id = (after[0], self._row_id(after[1]) or 0) if after else ('', 0)
+            remaining = limit or None
+            while remaining is None or remaining > 0:
+                page_size = min(remaining or 500, 500)
+                page = self._query(sql, (now, *participant_params, after_at, after_at, after_id, page_size))
+                yield from page
+                
+                if len(page) < page_size:
+                    break
+                after_at, after_id = page[-1]['destruct_at'], int(page[-1]['_id'])
+                if remaining is not None:
+                    remaining -= len(page)
+        except Exception as e:
+            print(f"Error streaming messages pending destruction: {e}")
+    
+    def summarize_messages_pending_destruction(self, bucket_seconds: int = 60, sender_id: Optional[str] = None,
+                                               recipient_id: Optional[str] = None) -> List[Dict]:
+        """Count messages pending destruction per bucket of destruct_at with one GROUP BY"""
+        try:
+            participants, participant_params = self._participant_clause(sender_id, recipient_id)
+            with self.lock:
+                rows = self.conn.execute(
+                    f"SELECT CAST(strftime('%s', destruct_at) AS INTEGER) / ? * ? AS bucket, "
+                    f"COUNT(*) AS count, SUM(read_once) AS read_once FROM messages "
+                    f"WHERE destruct_at IS NOT NULL AND is_deleted = 0 AND destruct_at > ?{participants} "
+                    f"GROUP BY bucket ORDER BY bucket ASC",
+                    (bucket_seconds, bucket_seconds, _to_db(datetime.utcnow()), *participant_params)
+                ).fetchall()
+            return [
+                {'bucket_start': datetime.utcfromtimestamp(row['bucket']), 'count': row['count'],
+                 'read_once': row['read_once']}
+                for row in rows
+            ]
+        except Exception as e:
+            print(f"Error summarizing messages pending destruction: {e}")
+            return []
+    
+    def get_user_recent_messages(self, user_id: str, limit: int = 50) -> List[Dict]:
+        """Get user's recent messages for threat analysis"""
+        try:
+            return self._query(
+                "SELECT * FROM messages WHERE (sender_id = ? OR recipient_id = ?) AND is_deleted = 0 "
+                "ORDER BY timestamp DESC LIMIT ?",
+                (user_id, user_id, limit)
+            )
+        except Exception as e:
+            print(f"Error getting user recent messages: {e}")
+            return []
+    
+    def get_users_recent_activity(self, user_ids: List[str], limit: int = 10) -> Dict[str, List[Dict]]:
+        """Get the latest messages of many users with one windowed query"""
+        try:
+            if not user_ids:
+                return {}
+            users = json.dumps(list(user_ids))
+            rows = self._query(
+                "WITH activity AS ("
+                " SELECT sender_id AS user_id, recipient_id, timestamp, length(content) AS content_length"
+                " FROM messages WHERE is_deleted = 0 AND sender_id IN (SELECT value FROM json_each(?))"
+                " UNION ALL"
+                " SELECT recipient_id, recipient_id, timestamp, length(content)"
+                " FROM messages WHERE is_deleted = 0 AND recipient_id IN (SELECT value FROM json_each(?))"
+                " AND recipient_id != sender_id"
+                "), ranked AS ("
+                " SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp DESC) AS position"
+                " FROM activity"
+                ") SELECT user_id, recipient_id, timestamp, content_length FROM ranked"
+                " WHERE position <= ? ORDER BY user_id, position",
+                (users, users, limit)
+            )
+            activity = {}
+            for row in rows:
+                activity.setdefault(row.pop('user_id'), []).append(row)
+            return activity
+        except Exception as e:
+            print(f"Error getting users recent activity: {e}")
+            return {}
+    
+    def get_conversation_messages(self, user1_id: str, user2_id: str, limit: int = 100) -> List[Dict]:
+        """Get conversation messages between two users"""
+        try:
+            return self._query(
+                "SELECT * FROM messages WHERE ((sender_id = ? AND recipient_id = ?) "
+                "OR (sender_id = ? AND recipient_id = ?)) AND is_deleted = 0 "
+                "ORDER BY timestamp ASC LIMIT ?",
+                (user1_id, user2_id, user2_id, user1_id, limit)
+            )
+        except Exception as e:
+            print(f"Error getting conversation messages: {e}")
+            return []
+    
+    def get_message_statistics(self) -> Dict:
+        """Get message statistics for admin dashboard"""
+        try:
+            now = datetime.utcnow()
+            day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+            with self.lock:
+                total_messages = self.conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE is_deleted = 0"
+                ).fetchone()[0]
+                messages_today = self.conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE is_deleted = 0 AND timestamp >= ?",
+                    (_to_db(day_start),)
+                ).fetchone()[0]
+                
+                # Get messages by hour for the last 24 hours
+                hourly_stats = []
+                for i in range(24):
+                    hour_start = now - timedelta(hours=i+1)
+                    hour_end = now - timedelta(hours=i)
+                    count = self.conn.execute(
+                        "SELECT COUNT(*) FROM messages WHERE is_deleted = 0 AND timestamp >= ? AND timestamp < ?",
+                        (_to_db(hour_start), _to_db(hour_end))
+                    ).fetchone()[0]
+                    hourly_stats.append({
+                        "hour": hour_start.hour,
+                        "count": count
+                    })
+            
+            return {
+                "total_messages": total_messages,
+                "messages_today": messages_today,
+                "hourly_stats": hourly_stats
+            }
+        except Exception as e:
+            print(f"Error getting message statistics: {e}")
+            return {"total_messages": 0, "messages_today": 0, "hourly_stats": []}
+    
+    # Threat log operations
+    def create_threat_log(self, threat_log: ThreatLog) -> str:
+        """Create a new threat log"""
+        try:
+            return self._insert('threat_logs', threat_log.to_dict())
+        except Exception as e:
+            raise Exception(f"Error creating threat log: {e}")
+    
+    def get_recent_threat_logs(self, limit: int = 20) -> List[Dict]:
+        """Get recent threat logs"""
+        try:
+            return self._query("SELECT * FROM threat_logs ORDER BY timestamp DESC LIMIT ?", (limit,))
+        except Exception as e:
+            print(f"Error getting recent threat logs: {e}")
+            return []
+    
+    def get_user_threat_logs(self, user_id: str, limit: int = 10) -> List[Dict]:
+        """Get threat logs for a specific user"""
+        try:
+            return self._query(
+                "SELECT * FROM threat_logs WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
+                (user_id, limit)
+            )
+        except Exception as e:
+            print(f"Error getting user threat logs: {e}")
+            return []
+    
+    def resolve_threat_log(self, log_id: str, resolved_by: str) -> bool:
+        """Mark an unresolved threat log resolved, returning whether this call resolved it"""
+        try:
+            return self._execute(
+                "UPDATE threat_logs SET is_resolved = 1, resolved_at = ?, resolved_by = ? "
+                "WHERE id = ? AND is_resolved = 0",
+                (datetime.utcnow(), resolved_by, self._row_id(log_id))
+            ).rowcount > 0
+        except Exception as e:
+            print(f"Error resolving threat log: {e}")
+            return False
+    
+    def delete_old_threat_logs(self, cutoff: datetime) -> int:
+        """Delete resolved threat logs older than cutoff"""
+        try:
+            return self._execute(
+                "DELETE FROM threat_logs WHERE timestamp < ? AND is_resolved = 1", (cutoff,)
+            ).rowcount
+        except Exception as e:
+            print(f"Error deleting old threat logs: {e}")
+            return 0
+    
+    # Session key operations
+    def create_session_key(self, session_key: SessionKey) -> str:
+        """Create a new session key"""
+        try:
+            return self._insert('session_keys', session_key.to_dict())
+        except Exception as e:
+            raise Exception(f"Error creating session key: {e}")
+    
+    def get_session_key(self, key_id: str) -> Optional[Dict]:
+        """Get session key by ID"""
+        try:
+            keys = self._query("SELECT * FROM session_keys WHERE key_id = ?", (key_id,))
+            return keys[0] if keys else None
+        except Exception as e:
+            print(f"Error getting session key: {e}")
+            return None
+    
+    def destroy_session_key(self, key_id: str):
+        """Mark session key as destroyed"""
+        try:
+            self._execute("UPDATE session_keys SET is_destroyed = 1, destroyed_at = ? WHERE key_id = ?",
+                          (datetime.utcnow(), key_id))
+        except Exception as e:
+            print(f"Error destroying session key: {e}")
+    
+    def count_expired_keys(self) -> int:
+        """Count expired session keys not yet destroyed"""
+        try:
+            with self.lock:
+                return self.conn.execute(
+                    "SELECT COUNT(*) FROM session_keys WHERE is_destroyed = 0 AND expires_at < ?",
+                    (_to_db(datetime.utcnow()),)
+                ).fetchone()[0]
+        except Exception as e:
+            print(f"Error counting expired keys: {e}")
+            return 0
+    
+    # System log operations
+    @staticmethod
+    def _system_log_row(log_entry: Dict) -> tuple:
+        data = {k: v for k, v in log_entry.items() if k not in ('event_type', 'user_id', 'timestamp')}
+        return tuple(_to_db(value) for value in (
+            log_entry.get('event_type'),
+            log_entry.get('user_id'),
+            log_entry.get('timestamp') or datetime.utcnow(),
+            data
+        ))
+    
+    def log_system_event(self, log_entry: Dict) -> str:
+        """Store a system log entry"""
+        try:
+            return str(self._execute(
+                "INSERT INTO system_logs (event_type, user_id, timestamp, data) VALUES (?, ?, ?, ?)",
+                self._system_log_row(log_entry)
+            ).lastrowid)
+        except Exception as e:
+            raise Exception(f"Error logging system event: {e}")
+    
+    def log_system_events(self, log_entries: List[Dict]) -> int:
+        """Store several system log entries in one transaction"""
+        try:
+            with self.lock:
+                self.conn.executemany(
+                    "INSERT INTO system_logs (event_type, user_id, timestamp, data) VALUES (?, ?, ?, ?)",
+                    [self._system_log_row(entry) for entry in log_entries]
+                )
+                self.conn.commit()
+            return len(log_entries)
+        except Exception as e:
+            raise Exception(f"Error logging system events: {e}")
+    
+    def get_recent_system_logs(self, limit: int = 50, event_type: Optional[str] = None) -> List[Dict]:
+        """Get recent system logs"""
+        try:
+            if event_type:
+                rows = self._query(
+                    "SELECT * FROM system_logs WHERE event_type = ? ORDER BY timestamp DESC LIMIT ?",
+                    (event_type, limit)
+                )
+            else:
+                rows = self._query("SELECT * FROM system_logs ORDER BY timestamp DESC LIMIT ?", (limit,))
+            
+            logs = []
+            for row in rows:
+                data = row.pop('data')
+                logs.append({**data, **row})
+            return logs
+        except Exception as e:
+            print(f"Error getting recent system logs: {e}")
+            return []
+    
+    def delete_old_system_logs(self, cutoff: datetime) -> int:
+        """Delete system logs older than cutoff"""
+        try:
+            return self._execute("DELETE FROM system_logs WHERE timestamp < ?", (cutoff,)).rowcount
+        except Exception as e:
+            print(f"Error deleting old system logs: {e}")
+            return 0
+    
+    # Leases
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew a lease unless another owner holds an unexpired one"""
+        try:
+            now = datetime.utcnow()
+            return self._execute(
+                "INSERT INTO leases (name, owner, expires_at, heartbeat_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at, "
+                "heartbeat_at = excluded.heartbeat_at "
+                "WHERE leases.owner = excluded.owner OR leases.expires_at < excluded.heartbeat_at",
+                (name, owner, now + timedelta(seconds=ttl), now)
+            ).rowcount > 0
+        except Exception as e:
+            print(f"Error acquiring lease {name}: {e}")
+            return False
+    
+    def release_lease(self, name: str, owner: str):
+        """Give up a lease held by owner"""
+        try:
+            self._execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
+        except Exception as e:
+            print(f"Error releasing lease {name}: {e}")
+    
+    # Background job state
+    def get_job_state(self, job_name: str) -> Optional[Dict]:
+        """Get the checkpoint saved by a background job"""
+        try:
+            with self.lock:
+                row = self.conn.execute("SELECT state FROM job_state WHERE name = ?", (job_name,)).fetchone()
+            return json.loads(row['state'], object_hook=_decode_state) if row else None
+        except Exception as e:
+            print(f"Error getting job state: {e}")
+            return None
+    
+    def save_job_state(self, job_name: str, state: Dict):
+        """Replace the checkpoint of a background job"""
+        self._execute(
+            "INSERT INTO job_state (name, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (job_name, json.dumps(state, default=_encode_state), datetime.utcnow())
+        )
+    
+    # Threat behavior features
+    def record_user_behavior(self, user_id: str, message_length: int, timestamp: datetime,
+                             window: int = 100) -> Optional[Dict]:
+        """Append a message length to a user's behavior window in one atomic upsert"""
+        return self.record_users_behavior([(user_id, message_length, timestamp)], window).get(user_id)
+    
+    def record_users_behavior(self, messages: List[Tuple[str, int, datetime]],
+                              window: int = 100) -> Dict[str, Dict]:
+        """Append a batch of message lengths with one upsert per user in a single transaction"""
+        by_user = {}
+        for user_id, message_length, timestamp in messages:
+            by_user.setdefault(user_id, []).append((message_length, timestamp))
+        
+        try:
+            now = _to_db(datetime.utcnow())
+            behaviors = {}
+            with self.lock:
+                for user_id, records in by_user.items():
+                    # The new lengths follow the stored ones; the last window of them are kept
+                    row = self.conn.execute(
+                        "INSERT INTO user_behavior (user_id, lengths, message_count, last_activity, updated_at) "
+                        "VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(user_id) DO UPDATE SET "
+                        "lengths = (SELECT json_group_array(value) FROM ("
+                        "SELECT key AS position, value FROM json_each(user_behavior.lengths) "
+                        "UNION ALL SELECT json_array_length(user_behavior.lengths) + key, value "
+                        "FROM json_each(excluded.lengths) "
+                        "ORDER BY position) "
+                        "WHERE position >= json_array_length(user_behavior.lengths) "
+                        "+ json_array_length(excluded.lengths) - ?), "
+                        "message_count = message_count + excluded.message_count, "
+                        "last_activity = MAX(last_activity, excluded.last_activity), "
+                        "updated_at = excluded.updated_at "
+                        "RETURNING lengths, message_count, last_activity, suspicious_count",
+                        (user_id, json.dumps([length for length, _ in records][-window:]), len(records),
+                         _to_db(max(timestamp for _, timestamp in records)), now, window)
+                    ).fetchone()
+                    behaviors[user_id] = self._behavior(row)
+                self.conn.commit()
+            return behaviors
+        except Exception as e:
+            print(f"Error recording behavior for {len(by_user)} users: {e}")
+            return {}
+    
+    def mark_user_suspicious(self, user_id: str) -> Optional[Dict]:
+        """Count a suspicious event against a recorded user in one atomic update"""
+        try:
+            with self.lock:
+                row = self.conn.execute(
+                    "UPDATE user_behavior SET suspicious_count = suspicious_count + 1, updated_at = ? "
+                    "WHERE user_id = ? RETURNING lengths, message_count, last_activity, suspicious_count",
+                    (_to_db(datetime.utcnow()), user_id)
+                ).fetchone()
+                self.conn.commit()
+            return self._behavior(row) if row else None
+        except Exception as e:
+            print(f"Error marking {user_id} suspicious: {e}")
+            return None
+    
+    def get_user_behavior(self, user_id: str) -> Optional[Dict]:
+        """Get a user's behavior aggregate"""
+        try:
+            with self.lock:
+                row = self.conn.execute(
+                    "SELECT lengths, message_count, last_activity, suspicious_count FROM user_behavior "
+                    "WHERE user_id = ?", (user_id,)
+                ).fetchone()
+            return self._behavior(row) if row else None
+        except Exception as e:
+            print(f"Error getting behavior for {user_id}: {e}")
+            return None
+    
+    @staticmethod
+    def _behavior(row: sqlite3.Row) -> Dict:
+        behavior = _from_row(row)
+        behavior['lengths'] = json.loads(behavior['lengths'])
+        return behavior
+    
+    # Cleanup operations
+    def cleanup_expired_messages(self) -> int:
+        """Clean up expired self-destruct messages"""
+        try:
+            now = datetime.utcnow()
+            return self._execute(
+                "UPDATE messages SET is_deleted = 1, deleted_at = ? "
+                "WHERE destruct_at IS NOT NULL AND is_deleted = 0 AND destruct_at < ?",
+                (now, now)
+            ).rowcount
+        except Exception as e:
+            print(f"Error cleaning up expired messages: {e}")
+            return 0
+    
+    def purge_deleted_messages(self, cutoff: datetime, batch_size: int = 500,
+                               resume_after: Optional[str] = None) -> Dict:
+        """Hard-delete one batch of messages soft-deleted before cutoff"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id, {MESSAGE_ROW_BYTES} AS size FROM messages "
+                "WHERE is_deleted = 1 AND deleted_at < ? ORDER BY deleted_at LIMIT ?",
+                (_to_db(cutoff), batch_size)
+            ).fetchall()
+            if rows:
+                self.conn.execute(
+                    f"DELETE FROM messages WHERE is_deleted = 1 AND id IN ({', '.join('?' * len(rows))})",
+                    tuple(row['id'] for row in rows)
+                )
+                self.conn.commit()
+        
+        return {
+            'documents': len(rows),
+            'bytes': sum(row['size'] for row in rows),
+            'resume_after': None,
+            'done': len(rows) < batch_size
+        }
+    
+    def cleanup_expired_keys(self) -> int:
+        """Clean up expired session keys"""
+        try:
+            now = datetime.utcnow()
+            return self._execute(
+                "UPDATE session_keys SET is_destroyed = 1, destroyed_at = ? "
+                "WHERE is_destroyed = 0 AND expires_at < ?",
+                (now, now)
+            ).rowcount
+        except Exception as e:
+            print(f"Error cleaning up expired keys: {e}")
+            return 0
+    
+    def close(self):
+        """Close database connection"""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
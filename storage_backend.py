@@ -0,0 +1,330 @@
+"""
+TacticalLink Storage Backend
+Interface shared by the MongoDB and embedded SQLite database managers
+"""
+
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Callable, Iterator, List, Dict, Optional, Tuple
+import os
+from dotenv import load_dotenv
+from models import User, Message, ThreatLog, SessionKey
+
+load_dotenv()
+
+# Storage backends
+STORAGE_BACKEND_MONGO = 'mongo'
+STORAGE_BACKEND_SQLITE = 'sqlite'
+
+# Fields returned when streaming the destruction queue (never content or keys)
+PENDING_DESTRUCTION_FIELDS = ('sender_id', 'recipient_id', 'destruct_at', 'read_once')
+
+# Message expiry modes
+EXPIRY_MODE_POLL = 'poll'
+EXPIRY_MODE_TTL = 'ttl'
+
+class StorageBackend(ABC):
+    """Operations every TacticalLink storage backend must provide"""
+    
+    message_listeners: List[Callable[[str, Dict], None]]
+    
+    # In TTL mode the store removes expired messages and session keys itself
+    expiry_mode: str = EXPIRY_MODE_POLL
+    
+    # Whether the store expires system logs and resolved threat logs itself
+    log_retention_managed: bool = False
+    
+    def add_message_listener(self, listener: Callable[[str, Dict], None]):
+        """Register a callback invoked with ('insert' | 'delete', message) after message writes"""
+        self.message_listeners.append(listener)
+    
+    def _notify_message_listeners(self, event_type: str, message: Dict):
+        """Invoke message listeners, isolating the write path from their failures"""
+        for listener in self.message_listeners:
+            try:
+                listener(event_type, message)
+            except Exception as e:
+                print(f"Error in message listener: {e}")
+    
+    # User operations
+    @abstractmethod
+    def create_user(self, user: User) -> str:
+        """Create a new user, raising ValueError on duplicate username or email"""
+    
+    @abstractmethod
+    def get_user_by_id(self, user_id: str) -> Optional[Dict]:
+        """Get user by ID"""
+    
+    @abstractmethod
+    def get_user_by_username(self, username: str) -> Optional[Dict]:
+        """Get user by username"""
+    
+    def authenticate_user(self, username: str, password: str) -> Optional[Dict]:
+        """Authenticate user with username and password"""
+        try:
+            user = self.get_user_by_username(username)
+            if not user:
+                return None
+            
+            # Create User object to check password
+            user_obj = User.from_dict(user)
+            if user_obj.check_password(password):
+                return user
+            return None
+        
+        except Exception as e:
+            print(f"Error authenticating user: {e}")
+            return None
+    
+    @abstractmethod
+    def update_last_login(self, user_id: str):
+        """Update user's last login timestamp"""
+    
+    @abstractmethod
+    def update_user_activity(self, activity: Dict[str, Dict[str, datetime]]) -> int:
+        """Apply coalesced last_login / last_seen timestamps, never moving them backwards"""
+    
+    @abstractmethod
+    def get_all_users(self) -> List[Dict]:
+        """Get all active users without key material or password hashes"""
+    
+    @abstractmethod
+    def get_total_users(self) -> int:
+        """Get total number of active users"""
+    
+    # Message operations
+    @abstractmethod
+    def create_message(self, message: Message) -> str:
+        """Create a new message"""
+    
+    @abstractmethod
+    def get_message_by_id(self, message_id: str) -> Optional[Dict]:
+        """Get message by ID"""
+    
+    @abstractmethod
+    def get_messages_by_ids(self, message_ids: List[str]) -> List[Dict]:
+        """Get the messages among message_ids that exist, in one round trip"""
+    
+    @abstractmethod
+    def get_pending_messages(self, user_id: str) -> List[Dict]:
+        """Get unread, live messages for a recipient, oldest first"""
+    
+    @abstractmethod
+    def mark_message_as_read(self, message_id: str):
+        """Mark message as read"""
+    
+    @abstractmethod
+    def delete_message(self, message_id: str) -> bool:
+        """Soft-delete a live message, returning whether this call deleted it"""
+    
+    @abstractmethod
+    def delete_messages(self, message_ids: List[str]) -> List[str]:
+        """Soft-delete live messages in bulk, returning the IDs this call deleted"""
+    
+    @abstractmethod
+    def set_message_destruct_at(self, message_id: str, destruct_at: Optional[datetime]):
+        """Set or clear the self-destruct time of a message"""
+    
+    @abstractmethod
+    def set_messages_destruct_at(self, deadlines: Dict[str, Optional[datetime]]) -> List[str]:
+        """Set or clear self-destruct times of live messages in bulk, returning the IDs updated"""
+    
+    @abstractmethod
+    def get_expired_messages(self, since: Optional[datetime] = None, limit: int = 0) -> List[Dict]:
+        """Get live messages whose self-destruct time has passed, soonest first
+        
+        ``since`` skips messages due before it; ``limit`` of 0 returns all.
+        """
+    
+    @abstractmethod
+    def count_expired_messages(self) -> int:
+        """Count live messages whose self-destruct time has passed"""
+    
+    @abstractmethod
+    def get_messages_pending_destruction(self) -> List[Dict]:
+        """Get live messages scheduled to self-destruct in the future, soonest first"""
+    
+    @abstractmethod
+    def iter_messages_pending_destruction(self, after: Optional[Tuple[datetime, str]] = None, limit: int = 0,
+                                          sender_id: Optional[str] = None,
+                                          recipient_id: Optional[str] = None) -> Iterator[Dict]:
+        """Stream live messages scheduled to self-destruct in the future, soonest first
+        
+        Only _id and PENDING_DESTRUCTION_FIELDS are read. ``after`` is the
+        (destruct_at, _id) of the last message already seen; ``limit`` of 0
+        streams all.
+        """
+    
+    @abstractmethod
+    def summarize_messages_pending_destruction(self, bucket_seconds: int = 60, sender_id: Optional[str] = None,
+                                               recipient_id: Optional[str] = None) -> List[Dict]:
+        """Count messages pending destruction per ``bucket_seconds`` of destruct_at
+        
+        Returns {'bucket_start', 'count', 'read_once'} per non-empty bucket,
+        soonest first, computed by the store.
+        """
+    
+    @abstractmethod
+    def get_user_recent_messages(self, user_id: str, limit: int = 50) -> List[Dict]:
+        """Get a user's most recent live messages, newest first"""
+    
+    @abstractmethod
+    def get_users_recent_activity(self, user_ids: List[str], limit: int = 10) -> Dict[str, List[Dict]]:
+        """Get each user's most recent live messages sent or received, newest first, in one query
+        
+        Messages carry only ``recipient_id``, ``timestamp`` and ``content_length``;
+        users without live messages are left out.
+        """
+    
+    @abstractmethod
+    def get_conversation_messages(self, user1_id: str, user2_id: str, limit: int = 100) -> List[Dict]:
+        """Get live conversation messages between two users, oldest first"""
+    
+    @abstractmethod
+    def get_message_statistics(self) -> Dict:
+        """Get message statistics for admin dashboard"""
+    
+    # Threat log operations
+    @abstractmethod
+    def create_threat_log(self, threat_log: ThreatLog) -> str:
+        """Create a new threat log"""
+    
+    @abstractmethod
+    def get_recent_threat_logs(self, limit: int = 20) -> List[Dict]:
+        """Get recent threat logs, newest first"""
+    
+    @abstractmethod
+    def get_user_threat_logs(self, user_id: str, limit: int = 10) -> List[Dict]:
+        """Get threat logs for a specific user, newest first"""
+    
+    @abstractmethod
+    def resolve_threat_log(self, log_id: str, resolved_by: str) -> bool:
+        """Mark an unresolved threat log resolved, returning whether this call resolved it"""
+    
+    @abstractmethod
+    def delete_old_threat_logs(self, cutoff: datetime) -> int:
+        """Delete resolved threat logs older than cutoff"""
+    
+    # Session key operations
+    @abstractmethod
+    def create_session_key(self, session_key: SessionKey) -> str:
+        """Create a new session key"""
+    
+    @abstractmethod
+    def get_session_key(self, key_id: str) -> Optional[Dict]:
+        """Get session key by ID"""
+    
+    @abstractmethod
+    def destroy_session_key(self, key_id: str):
+        """Mark session key as destroyed"""
+    
+    @abstractmethod
+    def count_expired_keys(self) -> int:
+        """Count expired session keys not yet destroyed"""
+    
+    # System log operations
+    @abstractmethod
+    def log_system_event(self, log_entry: Dict) -> str:
+        """Store a system log entry"""
+    
+    @abstractmethod
+    def log_system_events(self, log_entries: List[Dict]) -> int:
+        """Store several system log entries in one write"""
+    
+    @abstractmethod
+    def get_recent_system_logs(self, limit: int = 50, event_type: Optional[str] = None) -> List[Dict]:
+        """Get recent system logs, newest first"""
+    
+    @abstractmethod
+    def delete_old_system_logs(self, cutoff: datetime) -> int:
+        """Delete system logs older than cutoff"""
+    
+    # Leases
+    @abstractmethod
+    def acquire_lease(self, name: str, owner: str, ttl: float) -> bool:
+        """Take or renew a named lease for ttl seconds unless another owner holds it"""
+    
+    @abstractmethod
+    def release_lease(self, name: str, owner: str):
+        """Give up a lease held by owner"""
+    
+    # Background job state
+    @abstractmethod
+    def get_job_state(self, job_name: str) -> Optional[Dict]:
+        """Get the checkpoint saved by a background job"""
+    
+    @abstractmethod
+    def save_job_state(self, job_name: str, state: Dict):
+        """Replace the checkpoint of a background job"""
+    
+    # Threat behavior features
+    @abstractmethod
+    def record_user_behavior(self, user_id: str, message_length: int, timestamp: datetime,
+                             window: int = 100) -> Optional[Dict]:
+        """Append a message length to a user's behavior window in one atomic write
+        
+        Returns the updated aggregate: ``lengths`` (the last ``window`` lengths,
+        oldest first), ``message_count`` (all messages recorded),
+        ``last_activity`` and ``suspicious_count``.
+        """
+    
+    @abstractmethod
+    def record_users_behavior(self, messages: List[Tuple[str, int, datetime]],
+                              window: int = 100) -> Dict[str, Dict]:
+        """Append (user_id, message_length, timestamp) records to their users' windows in one batch
+        
+        Records of one user are appended in order. Returns the updated aggregate
+        of every user in the batch, as record_user_behavior does, keyed by user.
+        """
+    
+    @abstractmethod
+    def mark_user_suspicious(self, user_id: str) -> Optional[Dict]:
+        """Count a suspicious event against a recorded user in one atomic write
+        
+        Returns the updated aggregate as record_user_behavior does, or None for
+        a user without one.
+        """
+    
+    @abstractmethod
+    def get_user_behavior(self, user_id: str) -> Optional[Dict]:
+        """Get a user's behavior aggregate as returned by record_user_behavior"""
+    
+    # Cleanup operations
+    @abstractmethod
+    def cleanup_expired_messages(self) -> int:
+        """Soft-delete expired self-destruct messages"""
+    
+    def apply_message_retention(self) -> int:
+        """Drop whole message partitions past retention (partitioned storage only)"""
+        return 0
+    
+    @abstractmethod
+    def purge_deleted_messages(self, cutoff: datetime, batch_size: int = 500,
+                               resume_after: Optional[str] = None) -> Dict:
+        """Hard-delete one batch of messages soft-deleted before cutoff
+        
+        Returns ``documents`` and ``bytes`` reclaimed, the ``resume_after``
+        position for the next batch and ``done`` once nothing is left.
+        """
+    
+    @abstractmethod
+    def cleanup_expired_keys(self) -> int:
+        """Mark expired session keys as destroyed"""
+    
+    @abstractmethod
+    def close(self):
+        """Close the backend"""
+
+def create_database() -> StorageBackend:
+    """Create the storage backend selected by STORAGE_BACKEND"""
+    backend = os.getenv('STORAGE_BACKEND', STORAGE_BACKEND_MONGO).lower()
+    
+    if backend == STORAGE_BACKEND_SQLITE:
+        from sqlite_database import SQLiteDatabase
+        return SQLiteDatabase()
+    
+    if backend == STORAGE_BACKEND_MONGO:
+        from database import Database
+        return Database()
+    
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend}")
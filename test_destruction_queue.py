@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Tests for the deadline-ordered destruction queue, lease-based coordinator and TTL expiry audit
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from destruction_coordinator import DestructionCoordinator
+from destruction_metrics import DestructionMetrics, LagHistogram
+from destruction_queue import DestructionQueue
+from clock import VirtualClock
+from expiry_audit import ExpiryAuditor
+from message_compaction import JOB_NAME, MessageCompactor
+from message_scheduler import MessageScheduler
+from scheduler_simulation import simulate
+from models import Message
+from sqlite_database import SQLiteDatabase
+
+def test_pop_due_returns_batch_in_deadline_order():
+    queue = DestructionQueue()
+    now = datetime.utcnow()
+    queue.schedule('later', now + timedelta(seconds=30))
+    queue.schedule('second', now - timedelta(seconds=1))
+    queue.schedule('first', now - timedelta(seconds=2), read_once=True)
+    
+    due = queue.pop_due(now)
+    assert [task['message_id'] for task in due] == ['first', 'second']
+    assert due[0]['read_once'] is True
+    assert len(queue) == 1
+    assert queue.pop_due(now) == []
+
+def test_cancel_and_reschedule():
+    queue = DestructionQueue()
+    now = datetime.utcnow()
+    queue.schedule('a', now - timedelta(seconds=1))
+    queue.schedule('b', now - timedelta(seconds=1))
+    queue.schedule('b', now + timedelta(seconds=60))
+    
+    assert queue.cancel('a') is True
+    assert queue.cancel('a') is False
+    assert queue.pop_due(now) == []
+    assert queue.next_deadline() == now + timedelta(seconds=60)
+    assert [task['message_id'] for task in queue.snapshot()] == ['b']
+
+def test_schedule_many_and_cancel_many():
+    queue = DestructionQueue()
+    now = datetime.utcnow()
+    queue.schedule('existing', now + timedelta(seconds=30))
+    queue.schedule_many([(str(i), now + timedelta(seconds=i), False) for i in range(10, 0, -1)])
+    queue.schedule_many([('existing', now - timedelta(seconds=1), True)])
+    
+    assert len(queue) == 11
+    assert [task['message_id'] for task in queue.pop_due(now + timedelta(seconds=3))] == ['existing', '1', '2', '3']
+    assert queue.cancel_many(['4', '5', 'unknown']) == ['4', '5']
+    assert queue.next_deadline() == now + timedelta(seconds=6)
+
+def test_dead_entries_are_compacted():
+    queue = DestructionQueue()
+    deadline = datetime.utcnow() + timedelta(hours=1)
+    for i in range(1000):
+        queue.schedule(str(i), deadline + timedelta(seconds=i))
+    for i in range(600):
+        queue.cancel(str(i))
+    
+    assert len(queue) == 400
+    assert len(queue.heap) < 1000
+    assert queue.next_deadline() == deadline + timedelta(seconds=600)
+
+def test_wait_for_due_wakes_for_earlier_deadline():
+    queue = DestructionQueue()
+    queue.schedule('far', datetime.utcnow() + timedelta(hours=1))
+    result = []
+    waiter = threading.Thread(target=lambda: result.extend(queue.wait_for_due()))
+    waiter.start()
+    
+    time.sleep(0.05)
+    queue.schedule('soon', datetime.utcnow() + timedelta(milliseconds=50))
+    waiter.join(timeout=2)
+    
+    assert [task['message_id'] for task in result] == ['soon']
+    assert len(queue) == 1
+
+def test_close_releases_waiter():
+    queue = DestructionQueue()
+    result = []
+    waiter = threading.Thread(target=lambda: result.append(queue.wait_for_due()))
+    waiter.start()
+    queue.close()
+    waiter.join(timeout=2)
+    
+    assert result == [[]]
+
+def test_wait_for_due_on_virtual_clock_does_not_sleep():
+    clock = VirtualClock(datetime(2030, 1, 1))
+    queue = DestructionQueue(clock)
+    queue.schedule('late', clock.now() + timedelta(days=1))
+    started = time.monotonic()
+    
+    assert [task['message_id'] for task in queue.wait_for_due()] == ['late']
+    assert clock.now() >= datetime(2030, 1, 2)
+    assert time.monotonic() - started < 1
+
+def test_simulation_fires_every_deadline_once():
+    report = simulate(timers=5000, cancel_fraction=0.2, horizon=600, batch_size=700)
+    assert report['ok'], report
+    assert report['fired'] == report['audit_events'] == 4000
+    assert report['queued'] == 5000
+
+def test_coordinators_destroy_each_expired_message_once(tmp_path):
+    path = str(tmp_path / 'coordinator.db')
+    setup = SQLiteDatabase(path)
+    now = datetime.utcnow()
+    for i in range(300):
+        message_id = setup.create_message(Message('alice', 'bob', f"m{i}", 'key'))
+        setup.set_message_destruct_at(message_id, now - timedelta(seconds=i))
+    
+    destroyed = []
+    lock = threading.Lock()
+    
+    def make_coordinator(owner):
+        db = SQLiteDatabase(path)
+        def destroy(messages):
+            deleted = db.delete_messages([m['_id'] for m in messages])
+            with lock:
+                destroyed.extend(deleted)
+            return len(deleted)
+        return DestructionCoordinator(db, destroy, owner=owner, shard_span=30, batch_size=20)
+    
+    coordinators = [make_coordinator(f"worker-{i}") for i in range(3)]
+    workers = [threading.Thread(target=c.run_once) for c in coordinators]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=30)
+    
+    assert len(destroyed) == len(set(destroyed)) == 300
+    assert setup.count_expired_messages() == 0
+    assert sum(c.stats['shards_claimed'] for c in coordinators) >= 10
+    assert sum(c.stats['batches'] for c in coordinators) < 300
+    assert coordinators[0].get_statistics()['backlog'] == 0
+
+def test_coordinator_skips_shard_leased_elsewhere(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'leased.db'))
+    message_id = db.create_message(Message('alice', 'bob', 'held', 'key'))
+    db.set_message_destruct_at(message_id, datetime.utcnow() - timedelta(seconds=1))
+    
+    coordinator = DestructionCoordinator(db, lambda ms: len(db.delete_messages([m['_id'] for m in ms])),
+                                         owner='worker-1')
+    shard = coordinator._shard_start(db.get_message_by_id(message_id)['destruct_at'])
+    assert db.acquire_lease(coordinator._lease_name(shard), 'worker-2', ttl=30)
+    
+    assert coordinator.run_once() == 0
+    assert coordinator.stats['shards_contended'] == 1
+    
+    db.release_lease(coordinator._lease_name(shard), 'worker-2')
+    assert coordinator.run_once() == 1
+
+def soft_deleted_messages(db, count):
+    message_ids = [db.create_message(Message('alice', 'bob', f"m{i}", 'key')) for i in range(count)]
+    db.delete_messages(message_ids)
+    time.sleep(0.01)
+
+def test_compactor_throttles_on_slow_batches(tmp_path, monkeypatch):
+    db = SQLiteDatabase(str(tmp_path / 'compaction.db'))
+    soft_deleted_messages(db, 40)
+    compactor = MessageCompactor(db, grace_period=timedelta(0), batch_size=8, min_batch_size=2,
+                                 target_latency=0.05, pause=0.001, max_pause=0.004)
+    
+    # The first two batches are slow, as under foreground load
+    purge, batch_sizes = db.purge_deleted_messages, []
+    def slow_purge(cutoff, batch_size, resume_after):
+        batch_sizes.append(batch_size)
+        if len(batch_sizes) <= 2:
+            time.sleep(0.1)
+        return purge(cutoff, batch_size, resume_after)
+    monkeypatch.setattr(db, 'purge_deleted_messages', slow_purge)
+    
+    state = compactor.run()
+    assert batch_sizes == [8, 4, 2, 4, 6, 8, 8, 8]
+    assert (state['documents'], state['batches']) == (40, 8)
+    assert state['completed_at'] is not None
+    assert (compactor.batch_size, compactor.pause) == (8, 0.001)
+
+def test_compactor_resumes_from_its_checkpoint(tmp_path, monkeypatch):
+    db = SQLiteDatabase(str(tmp_path / 'compaction.db'))
+    soft_deleted_messages(db, 6)
+    first = MessageCompactor(db, grace_period=timedelta(0), batch_size=2, pause=0)
+    
+    # Stopped after its first batch, as by a restart
+    purge = db.purge_deleted_messages
+    def purge_then_stop(*args):
+        first.stop()
+        return purge(*args)
+    monkeypatch.setattr(db, 'purge_deleted_messages', purge_then_stop)
+    interrupted = first.run()
+    assert (interrupted['documents'], interrupted['completed_at']) == (2, None)
+    assert db.get_job_state(JOB_NAME) == interrupted
+    
+    # Messages deleted since are after the checkpointed cutoff and wait for the next run
+    monkeypatch.setattr(db, 'purge_deleted_messages', purge)
+    soft_deleted_messages(db, 2)
+    resumed = MessageCompactor(db, grace_period=timedelta(0), batch_size=2, pause=0).run()
+    assert resumed['cutoff'] == interrupted['cutoff'] and resumed['started_at'] == interrupted['started_at']
+    assert (resumed['documents'], resumed['batches']) == (6, 4)
+    assert resumed['completed_at'] is not None
+    
+    # A completed run is not resumed
+    following = MessageCompactor(db, grace_period=timedelta(0), batch_size=2, pause=0).run()
+    assert following['cutoff'] > resumed['cutoff'] and following['documents'] == 2
+
+def test_scheduled_jobs_run_in_one_worker_per_round(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'jobs.db'))
+    workers = [MessageScheduler(db=db), MessageScheduler(db=db)]
+    runs = []
+    jobs = [worker._leased('compaction', 3600, lambda worker=worker: runs.append(worker)) for worker in workers]
+    
+    for job in jobs:
+        job()
+    jobs[0]()
+    assert runs == [workers[0], workers[0]]
+    
+    # Another job has its own lease
+    workers[1]._leased('retention', 3600, lambda: runs.append('retention'))()
+    assert runs[-1] == 'retention'
+
+def test_lag_histogram_percentiles():
+    histogram = LagHistogram()
+    assert histogram.percentile(99) is None
+    for _ in range(98):
+        histogram.record(0.05)
+    histogram.record(3)
+    histogram.record(400)
+    
+    assert histogram.percentile(50) == 0.1
+    assert histogram.percentile(99) == 5
+    assert histogram.percentile(100) == 400
+    assert histogram.to_dict()['buckets'] == {**{str(b): 0 for b in histogram.bounds}, '0.1': 98, '5': 1, '+Inf': 1}
+
+def test_lag_slo_alert_follows_window():
+    clock = VirtualClock()
+    metrics = DestructionMetrics(slo=5, window=3600, clock=clock)
+    metrics.record([0.2] * 50)
+    assert metrics.get_statistics(queue_depth=3, overdue=0)['slo']['alert'] is False
+    
+    metrics.record([45] * 5)
+    stats = metrics.get_statistics(queue_depth=3, overdue=2)
+    assert stats['slo']['alert'] is True
+    assert stats['slo']['window_p99'] == 60
+    assert (stats['queue_depth'], stats['overdue_messages']) == (3, 2)
+    assert stats['lag_seconds']['count'] == 55
+    
+    # A new window of on-time destructions clears the alert; the totals keep everything
+    clock.advance(1800)
+    assert metrics.get_statistics(0, 0)['slo']['alert'] is True
+    clock.advance(1800)
+    metrics.record([0.2])
+    assert metrics.get_statistics(0, 0)['slo']['alert'] is False
+    assert metrics.histogram.count == 56
+
+def test_expiry_audit_records_ttl_deletes_only():
+    deleted_at = datetime.utcnow()
+    change = {
+        'operationType': 'delete',
+        'documentKey': {'_id': 'm1'},
+        'wallTime': deleted_at,
+        'message_length': 12,
+        'fullDocumentBeforeChange': {'sender_id': 'alice', 'recipient_id': 'bob', 'is_deleted': False, 'read_once': True}
+    }
+    entry = ExpiryAuditor._audit_entry(change)
+    assert entry['message_id'] == 'm1'
+    assert entry['destruction_reason'] == 'ttl_expiry'
+    assert entry['timestamp'] == deleted_at
+    assert (entry['sender_id'], entry['recipient_id']) == ('alice', 'bob')
+    assert entry['metadata']['message_length'] == 12
+    
+    # Without a pre-image the delete may be compaction, so it is not logged as a destruction
+    assert ExpiryAuditor._audit_entry({'documentKey': {'_id': 'm2'}}) is None
+    assert ExpiryAuditor._audit_entry({'documentKey': {'_id': 'm2'}, 'fullDocumentBeforeChange': None}) is None
+    
+    # Compaction of an already destroyed message is not a new destruction
+    change['fullDocumentBeforeChange']['is_deleted'] = True
+    assert ExpiryAuditor._audit_entry(change) is None
+
+def test_expiry_audit_does_not_run_without_pre_images(tmp_path):
+    auditor = ExpiryAuditor(SQLiteDatabase(str(tmp_path / 'audit.db')), 'worker-1')
+    auditor._enable_pre_images = lambda: False
+    auditor.start()
+    assert auditor.thread is None
+    assert auditor.get_statistics()['pre_images'] is False
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-v']))
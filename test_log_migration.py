@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for moving resolved threat logs into their time-series collection
+
+The in-memory collections below implement only the queries _move issues.
+"""
+
+import pytest
+
+import log_migration
+from log_migration import JOB_NAME, _move
+
+QUERY = {'is_resolved': True}
+
+def matches(document, query):
+    for field, condition in query.items():
+        value = document.get(field)
+        if isinstance(condition, dict):
+            if '$gt' in condition and not value > condition['$gt']:
+                return False
+            if '$in' in condition and value not in condition['$in']:
+                return False
+        elif value != condition:
+            return False
+    return True
+
+class FakeCursor(list):
+    def sort(self, field, direction):
+        return FakeCursor(sorted(self, key=lambda document: document[field], reverse=direction < 0))
+    
+    def limit(self, count):
+        return FakeCursor(self[:count])
+
+class FakeCollection:
+    def __init__(self, documents=()):
+        self.documents = [dict(document) for document in documents]
+        self.fail_deletes = 0
+    
+    def find(self, query):
+        return FakeCursor(dict(document) for document in self.documents if matches(document, query))
+    
+    def insert_many(self, documents, ordered=True):
+        self.documents.extend(dict(document) for document in documents)
+    
+    def delete_many(self, query):
+        if self.fail_deletes:
+            self.fail_deletes -= 1
+            raise ConnectionError('interrupted')
+        self.documents = [document for document in self.documents if not matches(document, query)]
+
+class FakeJobState:
+    def __init__(self):
+        self.jobs = {}
+    
+    def get_job_state(self, job_name):
+        return dict(self.jobs[job_name]) if job_name in self.jobs else None
+    
+    def save_job_state(self, job_name, state):
+        self.jobs[job_name] = dict(state)
+
+@pytest.fixture(autouse=True)
+def small_batches(monkeypatch):
+    monkeypatch.setattr(log_migration, 'BATCH_SIZE', 2)
+
+def threat_logs(*resolved):
+    return FakeCollection({'_id': i, 'is_resolved': i in resolved} for i in range(1, 7))
+
+def test_rerun_moves_logs_resolved_after_newer_ones():
+    database, source, target = FakeJobState(), threat_logs(2, 5, 6), FakeCollection()
+    assert _move(database, source, target, QUERY, 'copied', delete_source=True) == 3
+    
+    # Log 1 is older than everything already moved
+    source.documents[0]['is_resolved'] = True
+    assert _move(database, source, target, QUERY, 'copied', delete_source=True) == 1
+    assert sorted(document['_id'] for document in target.documents) == [1, 2, 5, 6]
+    assert sorted(document['_id'] for document in source.documents) == [3, 4]
+
+def test_interrupted_move_finishes_its_batch_without_copying_twice():
+    database, source, target = FakeJobState(), threat_logs(1, 2, 3, 4), FakeCollection()
+    source.fail_deletes = 1
+    with pytest.raises(ConnectionError):
+        _move(database, source, target, QUERY, 'copied', delete_source=True)
+    assert database.jobs[JOB_NAME]['copied'] == [1, 2]
+    
+    assert _move(database, source, target, QUERY, 'copied', delete_source=True) == 2
+    assert [document['_id'] for document in target.documents] == [1, 2, 3, 4]
+    assert [document['_id'] for document in source.documents] == [5, 6]
+
+def test_copy_resumes_after_the_last_id():
+    database, source, target = FakeJobState(), threat_logs(1, 2, 3, 4, 5, 6), FakeCollection()
+    database.save_job_state(JOB_NAME, {'after': 4})
+    assert _move(database, source, target, QUERY, 'after', delete_source=False) == 2
+    assert [document['_id'] for document in target.documents] == [5, 6]
+    assert len(source.documents) == 6
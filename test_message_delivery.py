@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Tests for long-poll message delivery: replay, resync across workers and the waiter cap
+"""
+
+import threading
+import time
+
+from bson.timestamp import Timestamp
+
+from message_delivery import DELIVERY_CHANGE_STREAM, DELIVERY_POLLING, MessageDeliveryHub, Subscription
+from models import Message
+from sqlite_database import SQLiteDatabase
+
+def send(db, sender_id, recipient_id, content):
+    return db.create_message(Message(sender_id, recipient_id, content, session_key='key'))
+
+def change(message_id, sender_id, recipient_id, time_part, inc=1):
+    return {
+        'operationType': 'insert',
+        'documentKey': {'_id': message_id},
+        'fullDocument': {'sender_id': sender_id, 'recipient_id': recipient_id},
+        'clusterTime': Timestamp(time_part, inc)
+    }
+
+def change_stream_hub(start: int = 100, **kwargs) -> MessageDeliveryHub:
+    """A hub in change stream mode whose stream started at cluster time ``start``"""
+    hub = MessageDeliveryHub(**kwargs)
+    hub.mode = DELIVERY_CHANGE_STREAM
+    hub._set_horizon(f"ct-{start}-1-0", (start, 1, 0))
+    return hub
+
+def test_subscription_drops_oldest_when_full():
+    subscription = Subscription('bob', max_buffer=2)
+    for i in range(3):
+        subscription.push({'id': i})
+    assert subscription.overflowed
+    assert [event['id'] for event in subscription.get(0)] == [1, 2]
+
+def test_in_process_replay_and_resync(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'delivery.db'))
+    hub = MessageDeliveryHub(replay_size=2, workers=1)
+    hub.attach(db)
+    cursor = hub.wait_for_events('bob', timeout=0)['last_event_id']
+    
+    # Events published between polls are replayed from the cursor
+    first = send(db, 'alice', 'bob', 'one')
+    second = send(db, 'alice', 'bob', 'two')
+    result = hub.wait_for_events('bob', cursor)
+    assert [event['message_id'] for event in result['events']] == [first, second]
+    assert result['resync'] is False
+    cursor = result['last_event_id']
+    assert hub.wait_for_events('bob', cursor, timeout=0) == {
+        'events': [], 'last_event_id': cursor, 'resync': False, 'mode': hub.mode
+    }
+    
+    # More events than the replay buffer holds, or a cursor from another process, force a resync
+    for content in ('three', 'four', 'five'):
+        send(db, 'alice', 'bob', content)
+    assert hub.wait_for_events('bob', cursor)['resync'] is True
+    restarted = MessageDeliveryHub(workers=1)
+    restarted.attach(db)
+    result = restarted.wait_for_events('bob', cursor, timeout=0)
+    assert result['resync'] is True and result['last_event_id'] == f"{restarted.origin}-0"
+
+def test_change_stream_cursors_work_on_any_worker():
+    worker_a, worker_b = change_stream_hub(), change_stream_hub()
+    changes = [change(f"m{i}", 'alice', 'bob', 100 + i) for i in range(1, 5)]
+    for event in changes[:3]:
+        worker_a._handle_change(event)
+    worker_b._handle_change(changes[0])
+    cursor = worker_a.wait_for_events('bob', 'ct-100-1-0')['last_event_id']
+    assert cursor == 'ct-103-1-1'
+    
+    # Worker B is behind the client: it waits rather than resyncing, and keeps the client's cursor
+    result = worker_b.wait_for_events('bob', cursor, timeout=0)
+    assert (result['events'], result['resync'], result['last_event_id']) == ([], False, cursor)
+    
+    # Once caught up it only returns what the client has not seen
+    for event in changes[1:]:
+        worker_b._handle_change(event)
+    result = worker_b.wait_for_events('bob', cursor)
+    assert [event['message_id'] for event in result['events']] == ['m4']
+    
+    # Worker B ahead of the client replays what the client missed
+    worker_a._handle_change(changes[3])
+    result = worker_b.wait_for_events('bob', 'ct-101-1-1')
+    assert [event['message_id'] for event in result['events']] == ['m2', 'm3', 'm4']
+    assert result['resync'] is False
+
+def test_change_stream_cursor_before_worker_start_or_foreign_resyncs():
+    late = change_stream_hub(start=200)
+    assert late.wait_for_events('bob', 'ct-150-1-1', timeout=0)['resync'] is True
+    assert late.wait_for_events('bob', 'abcd1234-3', timeout=0)['resync'] is True
+    
+    # Events of one transaction share a clusterTime and are numbered in stream order
+    hub = change_stream_hub()
+    hub._handle_change(change('m1', 'alice', 'bob', 101))
+    hub._handle_change(change('m2', 'alice', 'bob', 101))
+    result = hub.wait_for_events('bob', 'ct-101-1-1')
+    assert [(event['id'], event['message_id']) for event in result['events']] == [('ct-101-1-2', 'm2')]
+
+def test_waiters_beyond_the_cap_are_turned_away(tmp_path):
+    hub = change_stream_hub(max_waiters=1)
+    results = []
+    waiter = threading.Thread(target=lambda: results.append(hub.wait_for_events('bob', timeout=5)))
+    waiter.start()
+    deadline = time.monotonic() + 5
+    while hub.get_statistics()['waiting'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    
+    assert hub.wait_for_events('carol', timeout=5) is None
+    hub._handle_change(change('m1', 'alice', 'bob', 101))
+    waiter.join()
+    assert [event['message_id'] for event in results[0]['events']] == ['m1']
+    stats = hub.get_statistics()
+    assert (stats['waiting'], stats['rejected']) == (0, 1)
+    
+    # Several workers without change streams do not push at all
+    polling = MessageDeliveryHub(workers=4)
+    polling.attach(SQLiteDatabase(str(tmp_path / 'polling.db')))
+    assert polling.mode == DELIVERY_POLLING
+    assert polling.wait_for_events('bob', timeout=5) is None
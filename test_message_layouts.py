@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Tests for the bucketed and partitioned MongoDB message layouts that run without a server
+
+The in-memory collections below implement only the calls the layouts make
+for appends and single-message reads; test_storage_backends.py covers the
+full behavior against a real server when TEST_MONGODB_URL is set.
+"""
+
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+
+from database import MessageBucketStore, MessagePartitionRouter
+from models import Message
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+    
+    def create_index(self, *args, **kwargs):
+        pass
+    
+    def insert_one(self, document):
+        object_id = ObjectId()
+        self.docs[object_id] = {**document, '_id': object_id}
+        return SimpleNamespace(inserted_id=object_id)
+    
+    def find_one(self, query, projection=None):
+        document = self.docs.get(query['_id'])
+        if document is None:
+            return None
+        document = dict(document)
+        if projection and '$slice' in projection.get('messages', {}):
+            start, count = projection['messages']['$slice']
+            document['messages'] = document['messages'][start:start + count]
+        return document
+    
+    def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=None):
+        """The bucket append: the open bucket of a conversation and window, or a new one"""
+        for document in self.docs.values():
+            if (document['conversation_id'], document['bucket_start']) == (query['conversation_id'], query['bucket_start']) \
+                    and document['count'] < query['count']['$lt']:
+                break
+        else:
+            document = {'_id': ObjectId(), 'conversation_id': query['conversation_id'],
+                        'bucket_start': query['bucket_start'], 'count': 0, 'messages': [], **update['$setOnInsert']}
+            self.docs[document['_id']] = document
+        document['messages'].append(update['$push']['messages'])
+        document['count'] += update['$inc']['count']
+        return {'_id': document['_id'], 'count': document['count']}
+
+class FakeDatabase(dict):
+    def __missing__(self, name):
+        self[name] = FakeCollection()
+        return self[name]
+    
+    def __getattr__(self, name):
+        return self[name]
+    
+    def list_collection_names(self, filter=None):
+        return [name for name in self if name.startswith('messages_')]
+
+def message(sender_id, recipient_id, content, timestamp):
+    return Message(sender_id, recipient_id, content, session_key='key', timestamp=timestamp)
+
+def test_full_bucket_overflows_into_a_new_one():
+    db = FakeDatabase()
+    store = MessageBucketStore(db, bucket_size=2, bucket_span=3600)
+    start = datetime(2030, 1, 1, 9, 15)
+    
+    ids = [store.append(message('alice', 'bob', f"m{i}", start + timedelta(minutes=i))) for i in range(3)]
+    # The reply joins the same conversation's open bucket
+    ids.append(store.append(message('bob', 'alice', 'reply', start + timedelta(minutes=3))))
+    # The next hour opens its own bucket
+    ids.append(store.append(message('alice', 'bob', 'later', start + timedelta(hours=1))))
+    
+    buckets = [store.split_message_id(message_id)[0] for message_id in ids]
+    assert [store.split_message_id(message_id)[1] for message_id in ids] == [0, 1, 0, 1, 0]
+    assert buckets[0] == buckets[1] and buckets[2] == buckets[3] and len(set(buckets)) == 3
+    assert [b['count'] for b in db.message_buckets.docs.values()] == [2, 2, 1]
+    assert db.message_buckets.docs[buckets[0]]['participants'] == ['alice', 'bob']
+    
+    # IDs address the array slot directly
+    for message_id, content in zip(ids, ['m0', 'm1', 'm2', 'reply', 'later']):
+        assert store.get_message(message_id)['content'] == content
+        assert store.get_message(message_id)['_id'] == message_id
+    assert store.get_message(f"{buckets[4]}:5") is None
+
+@pytest.mark.parametrize('granularity, suffix', [('day', '20300101'), ('hour', '2030010109')])
+def test_partition_ids_round_trip(granularity, suffix):
+    db = FakeDatabase()
+    router = MessagePartitionRouter(db, granularity=granularity)
+    timestamp = datetime(2030, 1, 1, 9, 15)
+    
+    message_id = router.append(message('alice', 'bob', 'hello', timestamp))
+    assert message_id.split(':')[0] == suffix
+    collection, object_id = router.split_message_id(message_id)
+    assert collection is db[f"messages_{suffix}"] and object_id in collection.docs
+    assert router.get_message(message_id)['_id'] == message_id
+    assert router.get_message(message_id)['content'] == 'hello'
+    
+    # A partition starts at the beginning of the day or hour it covers
+    name = router.partition_name(timestamp)
+    assert name == f"messages_{suffix}"
+    assert router.partition_start(name) <= timestamp < router.partition_start(name) + router.partition_span
+    assert name in router._partitions_between(timestamp, timestamp + timedelta(seconds=1))
+    assert name not in router._partitions_between(timestamp + router.partition_span, None)
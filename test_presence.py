@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Tests for coalesced last-login and last-seen writes
+"""
+
+from datetime import datetime, timedelta
+
+from models import User
+from presence import PresenceCoalescer
+from sqlite_database import SQLiteDatabase
+
+def make_user(db, username):
+    user = User(username=username, email=f"{username}@example.com")
+    user.set_password(f"{username}-password")
+    return db.create_user(user)
+
+def test_presence_is_buffered_and_never_moves_back(tmp_path, monkeypatch):
+    db = SQLiteDatabase(str(tmp_path / 'presence.db'))
+    alice, bob = make_user(db, 'alice'), make_user(db, 'bob')
+    start = datetime(2030, 1, 1, 12)
+    writes = []
+    update_user_activity = db.update_user_activity
+    monkeypatch.setattr(db, 'update_user_activity', lambda activity: writes.append(activity) or update_user_activity(activity))
+    coalescer = PresenceCoalescer(db, flush_interval=3600)
+    
+    # Repeated activity between flushes keeps only the latest timestamp per field
+    coalescer.record_login(alice, start)
+    coalescer.record_activity(alice, start + timedelta(seconds=5))
+    coalescer.record_activity(alice, start + timedelta(seconds=2))
+    coalescer.record_activity(bob, start + timedelta(seconds=1))
+    assert coalescer.get_last_seen(alice) == start + timedelta(seconds=5)
+    assert db.get_user_by_id(alice)['last_seen'] is None
+    
+    assert coalescer.flush() == 2
+    assert writes == [{
+        alice: {'last_login': start, 'last_seen': start + timedelta(seconds=5)},
+        bob: {'last_seen': start + timedelta(seconds=1)}
+    }]
+    assert db.get_user_by_id(alice)['last_seen'] == start + timedelta(seconds=5)
+    assert coalescer.get_last_seen(alice) is None
+    
+    # An older timestamp flushed later, here by another worker, does not move the stored one back
+    other_worker = PresenceCoalescer(db, flush_interval=3600)
+    other_worker.record_login(alice, start + timedelta(seconds=3))
+    other_worker.stop()
+    user = db.get_user_by_id(alice)
+    assert (user['last_login'], user['last_seen']) == (start + timedelta(seconds=3), start + timedelta(seconds=5))
+    
+    # Stopping writes what is still buffered
+    coalescer.record_activity(bob, start + timedelta(seconds=9))
+    coalescer.stop()
+    assert not coalescer.flush_thread.is_alive()
+    assert db.get_user_by_id(bob)['last_seen'] == start + timedelta(seconds=9)
+    assert coalescer.get_statistics() == {
+        'recorded': 5, 'flushes': 2, 'users_flushed': 3, 'flush_errors': 0, 'pending_users': 0
+    }
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Conformance tests shared by every TacticalLink storage backend
+
+SQLite always runs. MongoDB runs (document, bucket and partitioned layouts) when
+TEST_MONGODB_URL points at a reachable server; a throwaway database is used.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from models import User, Message, ThreatLog, SessionKey
+from sqlite_database import BULK_UPDATE_ROWS, SQLiteDatabase
+from storage_backend import StorageBackend, create_database
+
+MONGO_TEST_DATABASE = 'tactical_link_conformance'
+
+@pytest.fixture(params=['sqlite', 'mongo', 'mongo-bucket', 'mongo-partitioned'])
+def db(request, tmp_path, monkeypatch):
+    """Yield a fresh backend of each kind"""
+    if request.param == 'sqlite':
+        backend = SQLiteDatabase(str(tmp_path / 'conformance.db'))
+        yield backend
+        backend.close()
+        return
+    
+    mongodb_url = os.getenv('TEST_MONGODB_URL')
+    if not mongodb_url:
+        pytest.skip("TEST_MONGODB_URL not set")
+    
+    from database import Database
+    monkeypatch.setenv('MESSAGE_STORAGE_MODE', {
+        'mongo-bucket': 'bucket',
+        'mongo-partitioned': 'partitioned'
+    }.get(request.param, 'document'))
+    backend = Database(mongodb_url=mongodb_url, database_name=MONGO_TEST_DATABASE)
+    backend.client.drop_database(MONGO_TEST_DATABASE)
+    backend.create_indexes()
+    yield backend
+    backend.client.drop_database(MONGO_TEST_DATABASE)
+    backend.close()
+
+def make_user(db, username):
+    user = User(username=username, email=f"{username}@example.com")
+    user.set_password(f"{username}-password")
+    user.public_key, user.private_key = f"{username}-public", f"{username}-private"
+    return db.create_user(user)
+
+def send(db, sender_id, recipient_id, content, seconds_ago=0, self_destruct_time=0):
+    message = Message(
+        sender_id=sender_id,
+        recipient_id=recipient_id,
+        content=content,
+        session_key=f"key-{content}",
+        self_destruct_time=self_destruct_time,
+        timestamp=datetime.utcnow() - timedelta(seconds=seconds_ago),
+        original_content=content
+    )
+    return db.create_message(message)
+
+def test_backend_implements_interface(db):
+    assert isinstance(db, StorageBackend)
+
+def test_user_operations(db):
+    alice_id = make_user(db, 'alice')
+    bob_id = make_user(db, 'bob')
+    
+    assert db.get_user_by_id(alice_id)['username'] == 'alice'
+    assert db.get_user_by_username('bob')['_id'] == bob_id
+    assert db.get_user_by_username('nobody') is None
+    
+    with pytest.raises(ValueError):
+        make_user(db, 'alice')
+    
+    assert db.authenticate_user('alice', 'alice-password')['_id'] == alice_id
+    assert db.authenticate_user('alice', 'wrong') is None
+    
+    db.update_last_login(alice_id)
+    assert isinstance(db.get_user_by_id(alice_id)['last_login'], datetime)
+    
+    later = datetime.utcnow().replace(microsecond=0) + timedelta(minutes=5)
+    db.update_user_activity({alice_id: {'last_login': later, 'last_seen': later}, bob_id: {'last_seen': later}})
+    db.update_user_activity({alice_id: {'last_seen': later - timedelta(minutes=1)}})
+    assert db.get_user_by_id(alice_id)['last_login'] == later
+    assert db.get_user_by_id(alice_id)['last_seen'] == later
+    assert db.get_user_by_id(bob_id)['last_seen'] == later
+    
+    users = db.get_all_users()
+    assert {u['username'] for u in users} == {'alice', 'bob'}
+    assert all('password_hash' not in u and 'private_key' not in u for u in users)
+    assert db.get_total_users() == 2
+
+def test_message_lifecycle(db):
+    first = send(db, 'alice', 'bob', 'first', seconds_ago=20)
+    second = send(db, 'alice', 'bob', 'second', seconds_ago=10)
+    reply = send(db, 'bob', 'alice', 'reply', seconds_ago=5)
+    send(db, 'alice', 'carol', 'other', seconds_ago=1)
+    
+    message = db.get_message_by_id(first)
+    assert message['_id'] == first
+    assert message['content'] == 'first'
+    assert message['is_read'] is False
+    assert isinstance(message['timestamp'], datetime)
+    
+    found = db.get_messages_by_ids([second, first, reply])
+    assert sorted(m['_id'] for m in found) == sorted([first, second, reply])
+    assert {m['_id']: m['content'] for m in found}[second] == 'second'
+    assert db.get_messages_by_ids([]) == []
+    
+    assert [m['_id'] for m in db.get_pending_messages('bob')] == [first, second]
+    
+    db.mark_message_as_read(first)
+    assert [m['_id'] for m in db.get_pending_messages('bob')] == [second]
+    
+    conversation = db.get_conversation_messages('bob', 'alice')
+    assert [m['_id'] for m in conversation] == [first, second, reply]
+    assert [m['_id'] for m in db.get_conversation_messages('alice', 'bob', limit=2)] == [first, second]
+    
+    recent = db.get_user_recent_messages('alice', limit=3)
+    assert [m['content'] for m in recent] == ['other', 'reply', 'second']
+    
+    assert db.delete_message(second) is True
+    assert db.delete_message(second) is False
+    assert db.get_message_by_id(second)['is_deleted'] is True
+    assert db.get_pending_messages('bob') == []
+    assert [m['_id'] for m in db.get_conversation_messages('alice', 'bob')] == [first, reply]
+    
+    bulk = [send(db, 'alice', 'bob', f"bulk-{i}") for i in range(3)]
+    assert sorted(db.delete_messages(bulk + [first])) == sorted(bulk + [first])
+    assert db.delete_messages(bulk) == []
+    assert [m['_id'] for m in db.get_conversation_messages('alice', 'bob')] == [reply]
+    
+    stats = db.get_message_statistics()
+    assert stats['total_messages'] == 2
+    assert stats['messages_today'] >= 0
+    assert len(stats['hourly_stats']) == 24
+
+def test_message_statistics_by_hour(db):
+    ages = [10, 20, 2 * 3600 + 60, 23 * 3600 + 60, 30 * 3600]
+    ids = [send(db, 'alice', 'bob', f"m{age}", seconds_ago=age) for age in ages]
+    send(db, 'alice', 'bob', 'gone', seconds_ago=30)
+    db.delete_message(ids[-1])
+    db.delete_message(send(db, 'alice', 'bob', 'deleted', seconds_ago=40))
+    
+    stats = db.get_message_statistics()
+    now = datetime.utcnow()
+    assert stats['total_messages'] == 5
+    assert [hour['count'] for hour in stats['hourly_stats']] == [3, 0, 1] + [0] * 20 + [1]
+    assert stats['hourly_stats'][2]['hour'] == (now - timedelta(hours=3)).hour
+    day_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    assert stats['messages_today'] == sum(
+        1 for age in [10, 20, 30, 2 * 3600 + 60, 23 * 3600 + 60] if now - timedelta(seconds=age) >= day_start
+    )
+
+def test_users_recent_activity(db):
+    send(db, 'alice', 'bob', 'first', seconds_ago=30)
+    send(db, 'bob', 'alice', 'reply', seconds_ago=20)
+    deleted = send(db, 'alice', 'carol', 'gone', seconds_ago=15)
+    send(db, 'alice', 'carol', 'latest', seconds_ago=10)
+    send(db, 'dave', 'erin', 'unrelated', seconds_ago=5)
+    db.delete_message(deleted)
+    
+    activity = db.get_users_recent_activity(['alice', 'bob', 'nobody'], limit=2)
+    assert sorted(activity) == ['alice', 'bob']
+    assert [(m['recipient_id'], m['content_length']) for m in activity['alice']] == [('carol', 6), ('alice', 5)]
+    assert [m['recipient_id'] for m in activity['bob']] == ['alice', 'bob']
+    assert isinstance(activity['bob'][0]['timestamp'], datetime)
+    assert db.get_users_recent_activity([], limit=2) == {}
+
+def test_self_destruct(db):
+    expired = send(db, 'alice', 'bob', 'expired', seconds_ago=30, self_destruct_time=10)
+    pending = send(db, 'alice', 'bob', 'pending', self_destruct_time=600)
+    scheduled = send(db, 'alice', 'bob', 'scheduled')
+    send(db, 'alice', 'bob', 'plain')
+    
+    db.set_message_destruct_at(scheduled, datetime.utcnow() + timedelta(seconds=300))
+    
+    assert [m['_id'] for m in db.get_expired_messages()] == [expired]
+    older = send(db, 'alice', 'bob', 'older', seconds_ago=60, self_destruct_time=10)
+    assert [m['_id'] for m in db.get_expired_messages()] == [older, expired]
+    assert [m['_id'] for m in db.get_expired_messages(limit=1)] == [older]
+    assert [m['_id'] for m in db.get_expired_messages(since=datetime.utcnow() - timedelta(seconds=30))] == [expired]
+    db.delete_message(older)
+    assert db.count_expired_messages() == 1
+    assert expired not in [m['_id'] for m in db.get_pending_messages('bob')]
+    assert [m['_id'] for m in db.get_messages_pending_destruction()] == [scheduled, pending]
+    
+    db.set_message_destruct_at(scheduled, None)
+    assert db.get_message_by_id(scheduled).get('destruct_at') is None
+    
+    assert db.cleanup_expired_messages() == 1
+    assert db.get_message_by_id(expired)['is_deleted'] is True
+    assert db.count_expired_messages() == 0
+    assert db.cleanup_expired_messages() == 0
+
+def test_expired_messages_soonest_first_across_partitions(db):
+    now = datetime.utcnow()
+    # Sent days apart, so partitioned storage keeps them in different collections
+    old = send(db, 'alice', 'bob', 'old', seconds_ago=3 * 86400)
+    new = send(db, 'alice', 'bob', 'new')
+    middle = send(db, 'alice', 'bob', 'middle', seconds_ago=86400)
+    db.set_messages_destruct_at({old: now - timedelta(seconds=5), new: now - timedelta(seconds=50),
+                                 middle: now - timedelta(seconds=20)})
+    
+    assert [m['_id'] for m in db.get_expired_messages()] == [new, middle, old]
+    assert [m['_id'] for m in db.get_expired_messages(limit=2)] == [new, middle]
+    assert [m['_id'] for m in db.get_expired_messages(limit=1)] == [new]
+
+def test_bulk_destruct_at(db):
+    ids = [send(db, 'alice', 'bob', f"m{i}") for i in range(4)]
+    db.delete_message(ids[3])
+    soon = datetime.utcnow() + timedelta(seconds=60)
+    later = soon + timedelta(seconds=60)
+    
+    # Shared deadline, then differing deadlines; deleted messages are not updated
+    assert sorted(db.set_messages_destruct_at({m: soon for m in ids})) == sorted(ids[:3])
+    assert sorted(db.set_messages_destruct_at({ids[0]: later, ids[1]: soon, ids[3]: later})) == sorted(ids[:2])
+    assert [m['_id'] for m in db.get_messages_pending_destruction()] == [ids[1], ids[2], ids[0]]
+    
+    assert sorted(db.set_messages_destruct_at({m: None for m in ids[:2]})) == sorted(ids[:2])
+    assert [m['_id'] for m in db.get_messages_pending_destruction()] == [ids[2]]
+    assert db.set_messages_destruct_at({}) == []
+
+def test_stream_pending_destruction(db):
+    base = datetime.utcnow().replace(second=0, microsecond=0) + timedelta(minutes=5)
+    ids = [send(db, 'alice' if i % 2 else 'carol', 'bob', f"m{i}") for i in range(5)]
+    # Two messages share a deadline; pages must neither skip nor repeat them
+    db.set_messages_destruct_at({ids[0]: base + timedelta(seconds=30), ids[1]: base, ids[2]: base,
+                                 ids[3]: base + timedelta(minutes=1), ids[4]: base + timedelta(seconds=10)})
+    expected = [m['_id'] for m in db.get_messages_pending_destruction()]
+    
+    streamed, after = [], None
+    while True:
+        page = list(db.iter_messages_pending_destruction(after=after, limit=2))
+        streamed.extend(m['_id'] for m in page)
+        if len(page) < 2:
+            break
+        after = (page[-1]['destruct_at'], page[-1]['_id'])
+    assert streamed == expected
+    
+    first = next(db.iter_messages_pending_destruction())
+    assert 'content' not in first and first['destruct_at'] == base
+    assert [m['_id'] for m in db.iter_messages_pending_destruction(sender_id='alice')] == [ids[1], ids[3]]
+    
+    summary = db.summarize_messages_pending_destruction(bucket_seconds=60)
+    assert [(s['bucket_start'], s['count']) for s in summary] == [(base, 4), (base + timedelta(minutes=1), 1)]
+    assert [s['count'] for s in db.summarize_messages_pending_destruction(60, recipient_id='nobody')] == []
+
+def test_purge_deleted_messages(db):
+    old = [send(db, 'alice', 'bob', f"old-{i}", seconds_ago=120) for i in range(3)]
+    recent = send(db, 'alice', 'bob', 'recent', seconds_ago=60)
+    live = send(db, 'alice', 'bob', 'live', seconds_ago=30)
+    for message_id in old + [recent]:
+        db.delete_message(message_id)
+    
+    time.sleep(0.01)
+    cutoff = datetime.utcnow()
+    time.sleep(0.01)
+    db.delete_message(send(db, 'alice', 'bob', 'after-cutoff'))
+    
+    purged, reclaimed, resume_after = 0, 0, None
+    while True:
+        batch = db.purge_deleted_messages(cutoff, batch_size=2, resume_after=resume_after)
+        purged, reclaimed = purged + batch['documents'], reclaimed + batch['bytes']
+        if batch['done']:
+            break
+        resume_after = batch['resume_after']
+    assert purged == 4 and reclaimed > 0
+    
+    assert all(db.get_message_by_id(m) is None or db.get_message_by_id(m).get('compacted') for m in old + [recent])
+    assert db.get_message_by_id(live)['content'] == 'live'
+    assert [m['_id'] for m in db.get_conversation_messages('alice', 'bob')] == [live]
+    assert db.purge_deleted_messages(cutoff)['documents'] == 0
+
+def test_leases(db):
+    assert db.acquire_lease('shard', 'worker-1', ttl=30) is True
+    assert db.acquire_lease('shard', 'worker-2', ttl=30) is False
+    assert db.acquire_lease('shard', 'worker-1', ttl=30) is True
+    
+    db.release_lease('shard', 'worker-2')
+    assert db.acquire_lease('shard', 'worker-2', ttl=30) is False
+    db.release_lease('shard', 'worker-1')
+    assert db.acquire_lease('shard', 'worker-2', ttl=-1) is True
+    
+    # An expired lease can be taken over
+    assert db.acquire_lease('shard', 'worker-1', ttl=30) is True
+    assert db.acquire_lease('shard', 'worker-2', ttl=30) is False
+
+def test_job_state(db):
+    assert db.get_job_state('compaction') is None
+    cutoff = datetime.utcnow().replace(microsecond=0)
+    db.save_job_state('compaction', {'cutoff': cutoff, 'resume_after': None, 'documents': 3})
+    db.save_job_state('compaction', {'cutoff': cutoff, 'resume_after': 'abc', 'documents': 5})
+    assert db.get_job_state('compaction') == {'cutoff': cutoff, 'resume_after': 'abc', 'documents': 5}
+
+def test_user_behavior(db):
+    assert db.get_user_behavior('alice') is None
+    start = datetime.utcnow().replace(microsecond=0)
+    for i, length in enumerate([10, 20, 30, 40, 50]):
+        behavior = db.record_user_behavior('alice', length, start + timedelta(seconds=i), window=3)
+    db.record_user_behavior('bob', 7, start)
+    
+    assert behavior == {'lengths': [30, 40, 50], 'message_count': 5, 'last_activity': start + timedelta(seconds=4),
+                        'suspicious_count': 0}
+    # A late message joins the window without moving last activity back
+    db.record_user_behavior('alice', 60, start, window=3)
+    assert db.mark_user_suspicious('alice')['suspicious_count'] == 1
+    assert db.get_user_behavior('alice') == {
+        'lengths': [40, 50, 60], 'message_count': 6, 'last_activity': start + timedelta(seconds=4),
+        'suspicious_count': 1
+    }
+    assert db.get_user_behavior('bob')['lengths'] == [7]
+    assert db.mark_user_suspicious('carol') is None
+    assert db.get_user_behavior('carol') is None
+
+def test_user_behavior_batch(db):
+    start = datetime.utcnow().replace(microsecond=0)
+    db.record_user_behavior('alice', 10, start, window=3)
+    behaviors = db.record_users_behavior([
+        ('alice', 20, start + timedelta(seconds=2)), ('bob', 7, start),
+        ('alice', 30, start + timedelta(seconds=1)), ('alice', 40, start + timedelta(seconds=3))
+    ], window=3)
+    
+    # A batch gives the same windows as recording its messages one by one
+    assert behaviors == {
+        'alice': {'lengths': [20, 30, 40], 'message_count': 4, 'last_activity': start + timedelta(seconds=3),
+                  'suspicious_count': 0},
+        'bob': {'lengths': [7], 'message_count': 1, 'last_activity': start, 'suspicious_count': 0}
+    }
+    assert db.get_user_behavior('alice') == behaviors['alice']
+    assert db.record_users_behavior([('carol', length, start) for length in range(5)], window=3)['carol']['lengths'] == [2, 3, 4]
+    assert db.record_users_behavior([]) == {}
+
+def test_threat_logs(db):
+    old = ThreatLog('alice', 90.0, 'old', timestamp=datetime.utcnow() - timedelta(days=40))
+    old.is_resolved = True
+    db.create_threat_log(old)
+    db.create_threat_log(ThreatLog('alice', 75.0, 'old unresolved', timestamp=datetime.utcnow() - timedelta(days=40)))
+    db.create_threat_log(ThreatLog('bob', 80.0, 'recent', metadata={'source': 'test'}))
+    
+    recent = db.get_recent_threat_logs(limit=2)
+    assert recent[0]['reason'] == 'recent'
+    assert recent[0]['metadata'] == {'source': 'test'}
+    assert len(recent) == 2
+    assert len(db.get_user_threat_logs('alice')) == 2
+    
+    assert db.delete_old_threat_logs(datetime.utcnow() - timedelta(days=30)) == 1
+    assert [log['reason'] for log in db.get_user_threat_logs('alice')] == ['old unresolved']
+    
+    log_id = db.get_user_threat_logs('alice')[0]['_id']
+    assert db.resolve_threat_log(log_id, 'admin') is True
+    assert db.resolve_threat_log(log_id, 'admin') is False
+    resolved = db.get_user_threat_logs('alice')[0]
+    assert resolved['is_resolved'] is True and resolved['resolved_by'] == 'admin'
+
+def test_session_keys(db):
+    db.create_session_key(SessionKey('live', 'enc-live', expires_at=datetime.utcnow() + timedelta(hours=1)))
+    db.create_session_key(SessionKey('stale', 'enc-stale', expires_at=datetime.utcnow() - timedelta(hours=1)))
+    db.create_session_key(SessionKey('manual', 'enc-manual', expires_at=datetime.utcnow() - timedelta(hours=1)))
+    
+    assert db.get_session_key('live')['encrypted_key'] == 'enc-live'
+    assert db.get_session_key('missing') is None
+    
+    db.destroy_session_key('manual')
+    assert db.get_session_key('manual')['is_destroyed'] is True
+    
+    assert db.count_expired_keys() == 1
+    assert db.cleanup_expired_keys() == 1
+    assert db.get_session_key('stale')['is_destroyed'] is True
+    assert db.get_session_key('live')['is_destroyed'] is False
+    assert db.count_expired_keys() == 0
+
+def test_system_logs(db):
+    db.log_system_event({
+        'event_type': 'message_destruction',
+        'message_id': 'm1',
+        'timestamp': datetime.utcnow() - timedelta(days=10),
+        'metadata': {'read_once': True}
+    })
+    db.log_system_event({'event_type': 'login', 'user_id': 'alice', 'timestamp': datetime.utcnow()})
+    
+    logs = db.get_recent_system_logs()
+    assert [log['event_type'] for log in logs] == ['login', 'message_destruction']
+    
+    assert db.log_system_events([
+        {'event_type': 'message_destruction', 'message_id': f"bulk-{i}",
+         'timestamp': datetime.utcnow() - timedelta(days=11)}
+        for i in range(3)
+    ]) == 3
+    assert len(db.get_recent_system_logs(event_type='message_destruction')) == 4
+    
+    destruction = db.get_recent_system_logs(event_type='message_destruction')
+    assert destruction[0]['message_id'] == 'm1'
+    assert destruction[0]['metadata'] == {'read_once': True}
+    
+    assert db.delete_old_system_logs(datetime.utcnow() - timedelta(days=7)) == 4
+    assert [log['event_type'] for log in db.get_recent_system_logs()] == ['login']
+
+def test_create_database_selects_sqlite(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('SQLITE_PATH', str(tmp_path / 'factory.db'))
+    backend = create_database()
+    try:
+        assert isinstance(backend, SQLiteDatabase)
+        assert backend.conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    finally:
+        backend.close()
+
+def test_sqlite_bulk_destruct_at_spans_statements(tmp_path):
+    backend = SQLiteDatabase(str(tmp_path / 'bulk.db'))
+    try:
+        count = 2 * BULK_UPDATE_ROWS + 3
+        ids = [send(backend, 'alice', 'bob', f"m{i}") for i in range(count)]
+        backend.delete_messages(ids[-2:])
+        soon = datetime.utcnow() + timedelta(seconds=60)
+        deadlines = {m: soon + timedelta(seconds=i) for i, m in enumerate(ids)}
+        deadlines['999999'] = soon
+        
+        # Three statements of at most 499 rows each; deleted and unknown IDs are skipped
+        assert sorted(backend.set_messages_destruct_at(deadlines), key=int) == ids[:-2]
+        pending = backend.get_messages_pending_destruction()
+        assert [m['_id'] for m in pending] == ids[:-2]
+        assert all(m['destruct_at'] == deadlines[m['_id']] for m in pending)
+    finally:
+        backend.close()
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__, '-v']))
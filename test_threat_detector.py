@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+"""
+Tests for threat model building, lazy loading and scoring
+"""
+
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from collections import deque
+
+from ai_threat import ThreatDetector, build_model, get_threat_detector
+from behavior_store import BehaviorStore, RollingMean, SharedBehaviorStore
+import model_retraining
+from forest_engine import FlatIsolationForest
+from model_retraining import FeatureReservoir, ModelRetrainer
+from models import Message
+from sqlite_database import SQLiteDatabase
+from threat_scoring import MicroBatchScorer, ThreatEvent, ThreatScoringPipeline, ThreatSweep
+
+@pytest.fixture(scope='module')
+def model_dir(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('threat_model'))
+    assert build_model(path)
+    return path
+
+def test_construction_neither_trains_nor_loads(tmp_path):
+    detector = ThreatDetector(str(tmp_path))
+    assert detector.model is None
+    assert not detector.model_loaded
+    assert list(tmp_path.iterdir()) == []
+    
+    # Without a built model scoring falls back to the rules and still never trains
+    score = detector.analyze_message_metadata('u1', 'u2', 40, datetime(2030, 1, 1, 3))
+    assert 0 <= score <= 100
+    assert detector.model_loaded and not detector.is_trained
+    assert list(tmp_path.iterdir()) == []
+
+def test_model_is_memory_mapped_on_first_score(model_dir):
+    detector = ThreatDetector(model_dir)
+    assert not detector.model_loaded
+    
+    score = detector.analyze_message_metadata('u1', 'u2', 40, datetime(2030, 1, 1, 12))
+    assert 0 <= score <= 100
+    assert detector.is_trained
+    assert isinstance(detector.pca.components_, np.memmap)
+    assert isinstance(detector.scaler.scale_, np.memmap)
+
+def test_build_keeps_existing_artifacts(model_dir):
+    detector = ThreatDetector(model_dir)
+    before = open(detector.artifact_paths()[0], 'rb').read()
+    assert build_model(model_dir)
+    assert open(detector.artifact_paths()[0], 'rb').read() == before
+
+def test_synthetic_data_uses_a_private_generator():
+    detector = ThreatDetector()
+    state = np.random.get_state()[1].copy()
+    normal = detector._generate_normal_behavior_data(200_000)
+    anomalous = detector._generate_anomalous_behavior_data(200_000)
+    assert (np.random.get_state()[1] == state).all()
+    assert np.array_equal(detector._generate_anomalous_behavior_data(200_000), anomalous)
+    
+    assert normal.shape == anomalous.shape == (200_000, 10)
+    # Message frequency, average length, response time and recipients keep their means
+    assert normal[:, [0, 1, 4, 6]].mean(axis=0) == pytest.approx([5.0, 50.1, 30.0, 3.05], rel=0.02)
+    # One in four anomalous rows is an unusual-hours session drawn from fixed hours
+    unusual = np.isin(anomalous[:, 2], [2, 3, 4, 22, 23])
+    assert unusual.mean() == pytest.approx(0.25, abs=0.01)
+    assert anomalous[:, 8:].min() >= 0 and anomalous[:, 8:].max() <= 1
+    assert anomalous[:, 4].min() >= 0.1 and anomalous[:, 6].min() >= 1
+
+def test_concurrent_scores_share_batches(model_dir):
+    detector = ThreatDetector(model_dir)
+    detector._ensure_model()
+    detector.batch_scorer.max_wait = 0.05
+    rows = detector._generate_normal_behavior_data(32)
+    scores = [None] * len(rows)
+    start = threading.Barrier(len(rows))
+    
+    def score(i):
+        start.wait()
+        scores[i] = detector.batch_scorer.score(rows[i], timeout=5)
+    
+    threads = [threading.Thread(target=score, args=(i,)) for i in range(len(rows))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    # Each caller gets its own row's score, computed in far fewer model calls
+    assert scores == pytest.approx(list(detector.score_features(rows)))
+    stats = detector.batch_scorer.get_statistics()
+    assert stats['rows_scored'] == 32 and stats['batches'] < 8
+
+def test_lone_score_waits_at_most_max_wait():
+    scorer = MicroBatchScorer(lambda rows: rows[:, 0] * 2, max_batch=64, max_wait=0.01)
+    assert scorer.score([1.5, 0.0], timeout=1) == 3.0
+    assert scorer.get_statistics()['batches'] == 1
+
+def test_batch_errors_reach_every_caller():
+    def fail(rows):
+        raise ValueError('model unavailable')
+    
+    scorer = MicroBatchScorer(fail, max_batch=2, max_wait=1)
+    futures = [scorer.submit([1.0]), scorer.submit([2.0])]
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=1)
+    assert scorer.get_statistics()['errors'] == 1
+
+def test_pipeline_scores_and_logs_off_the_send_path(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'threats.db'))
+    # No built model: the rules give 35 to a 5-character message at 03:00 and 0 at noon
+    pipeline = ThreatScoringPipeline(ThreatDetector(str(tmp_path)), db, workers=2, threshold=30)
+    assert pipeline.provisional_score('night') is None
+    
+    assert pipeline.enqueue('night', 'peer', 5, datetime(2030, 1, 1, 3), reason='flagged', message_id='m1')
+    assert pipeline.enqueue('day', 'peer', 50, datetime(2030, 1, 1, 12))
+    pipeline.stop()
+    
+    assert pipeline.provisional_score('night') == 35
+    assert pipeline.provisional_score('day') == 0
+    logs = db.get_recent_threat_logs()
+    assert [(log['user_id'], log['reason']) for log in logs] == [('night', 'flagged')]
+    assert logs[0]['metadata'] == {'message_id': 'm1'}
+    assert pipeline.detector.get_user_threat_summary('night')['suspicious_count'] == 1
+    assert pipeline.detector.get_user_threat_summary('day')['suspicious_count'] == 0
+    
+    stats = pipeline.get_statistics()
+    assert stats['scored'] == 2 and stats['threat_logs'] == 1 and stats['queue_depth'] == 0
+    assert stats['lag_seconds']['count'] == 2
+
+def test_full_pipeline_queue_drops_instead_of_blocking(tmp_path):
+    # Without workers nothing drains the queue
+    pipeline = ThreatScoringPipeline(ThreatDetector(str(tmp_path)), None, workers=0, max_queue=1)
+    assert pipeline.enqueue('u1', 'u2', 10)
+    assert not pipeline.enqueue('u1', 'u2', 10)
+    assert pipeline.get_statistics()['dropped'] == 1
+
+def test_sweep_scores_users_like_single_user_analysis(model_dir, tmp_path):
+    detector = ThreatDetector(model_dir)
+    rng = np.random.default_rng(5)
+    start = datetime(2030, 1, 1)
+    messages = {
+        f"user-{u}": [
+            {
+                'recipient_id': f"peer-{rng.integers(4)}",
+                'timestamp': start - timedelta(seconds=int(s)),
+                'content': 'x' * int(rng.integers(1, 300))
+            }
+            for s in np.sort(rng.integers(0, 86400, size=rng.integers(1, 12)))
+        ]
+        for u in range(40)
+    }
+    activity = {
+        user_id: [{**m, 'content_length': len(m['content'])} for m in user_messages]
+        for user_id, user_messages in messages.items()
+    }
+    
+    swept = detector.analyze_users_activity(activity)
+    for user_id, user_messages in messages.items():
+        assert swept[user_id] == pytest.approx(detector.analyze_user_activity(user_id, user_messages))
+    
+    db = SQLiteDatabase(str(tmp_path / 'sweep.db'))
+    for user_id, user_messages in list(messages.items())[:3]:
+        for m in user_messages:
+            db.create_message(Message(user_id, m['recipient_id'], m['content'], 'key', timestamp=m['timestamp']))
+    sweep = ThreatSweep(db, detector, limit=10, threshold=0)
+    scores = sweep.run(['user-0', 'user-1', 'user-2', 'idle'])
+    assert scores['idle'] == 0.0
+    assert scores['user-0'] == pytest.approx(detector.analyze_user_activity('user-0', messages['user-0'][:10]))
+    flagged = {log['user_id'] for log in db.get_recent_threat_logs()}
+    assert flagged == {user_id for user_id, score in scores.items() if score > 0}
+    assert sweep.get_statistics()['threat_logs'] == len(flagged)
+
+@pytest.mark.parametrize('max_features', [1.0, 0.6])
+def test_flat_forest_matches_sklearn(max_features):
+    from sklearn.ensemble import IsolationForest
+    rng = np.random.default_rng(5)
+    X = rng.normal(size=(600, 10))
+    model = IsolationForest(n_estimators=50, max_features=max_features, random_state=0).fit(X[:500])
+    forest = FlatIsolationForest.from_sklearn(model)
+    
+    # Also put rows exactly on the first tree's split points, where float32 comparison matters
+    tree = model.estimators_[0].tree_
+    splits = np.flatnonzero(tree.children_left != -1)
+    on_split = X[:len(splits)].copy()
+    on_split[np.arange(len(splits)), model.estimators_features_[0][tree.feature[splits]]] = tree.threshold[splits]
+    rows = np.vstack([X, on_split])
+    assert np.abs(forest.decision_function(rows) - model.decision_function(rows)).max() < 1e-12
+
+def test_detector_scores_small_batches_with_flat_forest(model_dir):
+    detector = ThreatDetector(model_dir)
+    detector._ensure_model()
+    assert detector.forest is not None
+    features = detector._generate_anomalous_behavior_data(20, seed=1)
+    flat = detector.score_features(features)
+    detector.flat_max_batch = 0
+    assert flat == pytest.approx(detector.score_features(features), abs=1e-9)
+
+@pytest.mark.parametrize('with_mean,whiten', [(True, False), (False, True)])
+def test_fused_preprocessing_matches_scaler_and_pca(with_mean, whiten):
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler
+    detector = ThreatDetector()
+    X = detector._generate_anomalous_behavior_data(300)
+    scaler = StandardScaler(with_mean=with_mean).fit(X)
+    pca = PCA(n_components=10, whiten=whiten).fit(scaler.transform(X))
+    
+    weights, bias = ThreatDetector._fuse_preprocessing(scaler, pca)
+    rows = detector._generate_normal_behavior_data(100)
+    assert rows @ weights + bias == pytest.approx(pca.transform(scaler.transform(rows)), rel=1e-9, abs=1e-9)
+
+def test_loaded_model_scores_through_checked_fused_preprocessing(model_dir, monkeypatch):
+    detector = ThreatDetector(model_dir)
+    detector._ensure_model()
+    features = detector._generate_anomalous_behavior_data(20, seed=2)
+    assert detector.projection is not None
+    assert detector.transform_features(features) == pytest.approx(
+        detector.pca.transform(detector.scaler.transform(features)), abs=1e-9
+    )
+    
+    # A map that disagrees with the artifacts is rejected at load time
+    monkeypatch.setattr(ThreatDetector, '_fuse_preprocessing',
+                        staticmethod(lambda scaler, pca: (np.eye(10), np.zeros(10))))
+    detector = ThreatDetector(model_dir)
+    detector._ensure_model()
+    assert detector.projection is None
+    assert detector.is_trained
+
+def test_reservoir_keeps_a_uniform_sample_in_fixed_memory():
+    reservoir = FeatureReservoir(capacity=500, n_features=1, seed=3)
+    for i in range(50_000):
+        reservoir.add([i])
+    
+    sample = reservoir.sample()[:, 0]
+    assert len(sample) == len(reservoir) == 500
+    assert len(set(sample)) == 500
+    # A uniform sample of 0..49999 has a mean near 25000 and reaches both ends
+    assert 22_000 < sample.mean() < 28_000
+    assert sample.min() < 5_000 and sample.max() > 45_000
+
+def test_retraining_publishes_versions_that_other_workers_swap_in(tmp_path, monkeypatch):
+    monkeypatch.setenv('THREAT_MODEL_KEEP_VERSIONS', '2')
+    monkeypatch.setenv('THREAT_RETRAIN_MIN_SAMPLES', '200')
+    model_dir = str(tmp_path)
+    assert build_model(model_dir)
+    trainer, worker = ThreatDetector(model_dir), ThreatDetector(model_dir)
+    trainer._ensure_model()
+    worker._ensure_model()
+    first = worker.model_version
+    assert first and trainer.model_version == first
+    assert not worker.reload_if_changed()
+    
+    assert not trainer.retrain_model()
+    start = datetime(2030, 1, 1, 9)
+    for i in range(300):
+        trainer.submit_message_metadata(f"user-{i % 7}", 'ops', 20 + i % 90, start + timedelta(minutes=i)).result()
+    
+    # Scoring carries on against whichever model is installed while retraining swaps it
+    features = trainer._generate_normal_behavior_data(16, seed=4)
+    errors, done = [], threading.Event()
+    def score():
+        while not done.is_set():
+            try:
+                trainer.score_features(features)
+            except Exception as e:
+                errors.append(e)
+    scorer = threading.Thread(target=score)
+    scorer.start()
+    for _ in range(3):
+        assert trainer.retrain_model()
+    done.set()
+    scorer.join()
+    assert errors == []
+    
+    manifest = trainer.read_manifest()
+    assert manifest['version'] == trainer.model_version != first
+    assert (manifest['source'], manifest['samples']) == ('reservoir', 300)
+    assert sorted(os.listdir(tmp_path / 'versions'))[-1] == manifest['version']
+    assert len(os.listdir(tmp_path / 'versions')) == 2
+    
+    assert worker.reload_if_changed()
+    assert worker.model_version == manifest['version']
+    assert worker.score_features(features) == pytest.approx(trainer.score_features(features))
+
+def test_one_worker_retrains_per_round(model_dir, tmp_path, monkeypatch):
+    db = SQLiteDatabase(str(tmp_path / 'leases.db'))
+    detectors = [ThreatDetector(model_dir) for _ in range(2)]
+    for detector in detectors:
+        detector.retrain_min_samples = 10 ** 9
+    retrainers = [ModelRetrainer(detector, db, retrain_interval=3600) for detector in detectors]
+    
+    retrainers[0].retrain()
+    retrainers[1].retrain()
+    assert retrainers[0].get_statistics()['retrain_failures'] == 1
+    assert retrainers[1].get_statistics()['skipped'] == 1
+    
+    # Model versions are host-local, so a worker on another host holds its own lease
+    monkeypatch.setattr(model_retraining.socket, 'gethostname', lambda: 'other-host')
+    other = ModelRetrainer(detectors[1], db, retrain_interval=3600)
+    other.retrain()
+    assert other.get_statistics()['retrain_failures'] == 1
+
+def test_retrained_model_failing_sanity_check_is_not_swapped_in(tmp_path, monkeypatch):
+    monkeypatch.setenv('THREAT_RETRAIN_MIN_SAMPLES', '50')
+    model_dir = str(tmp_path)
+    assert build_model(model_dir)
+    detector = ThreatDetector(model_dir)
+    detector._ensure_model()
+    first = detector.model_version
+    for features in detector._generate_normal_behavior_data(100, seed=5):
+        detector.reservoir.add(features)
+    
+    assert detector._check_model(detector.model, detector.scaler, detector.pca) is None
+    detector.retrain_min_recall = 1.01
+    assert not detector.retrain_model()
+    assert detector.model_version == detector.read_manifest()['version'] == first
+    assert os.listdir(tmp_path / 'versions') == [first]
+
+def test_unversioned_model_still_loads(model_dir, tmp_path):
+    for source in ThreatDetector(model_dir).artifact_paths():
+        shutil.copy(source, tmp_path)
+    detector = ThreatDetector(str(tmp_path))
+    detector._ensure_model()
+    assert detector.is_trained and detector.model_version is None
+
+def test_behavior_store_matches_full_window_statistics():
+    store = BehaviorStore(max_users=10, window=100)
+    rng = np.random.default_rng(11)
+    start = datetime(2030, 1, 1)
+    windows = {}
+    for i in range(5000):
+        user_id = f"user-{rng.integers(5)}"
+        length = int(rng.integers(0, 2000))
+        store.record(user_id, length, start + timedelta(seconds=i))
+        windows.setdefault(user_id, deque(maxlen=100)).append(length)
+        
+        count, mean, variance, last_activity = store.window_stats(user_id)
+        window = windows[user_id]
+        assert count == len(window)
+        assert mean == pytest.approx(np.mean(window))
+        assert variance == pytest.approx(np.var(window) if count > 1 else 0, abs=1e-6)
+        assert last_activity == start + timedelta(seconds=i)
+    
+    assert store.window_stats('unknown') == (0, None, 0.0, None)
+
+def test_behavior_store_evicts_idle_then_least_recent_users():
+    store = BehaviorStore(max_users=2, window=4, idle_seconds=60)
+    start = datetime(2030, 1, 1)
+    store.record('a', 10, start)
+    store.record('b', 20, start + timedelta(seconds=30))
+    store.record('a', 30, start + timedelta(seconds=40))
+    
+    # Every row is taken and nobody is idle yet: b is the least recently active
+    store.record('c', 40, start + timedelta(seconds=50))
+    assert store.window_stats('b')[0] == 0
+    assert store.window_stats('a')[:2] == (2, 20.0)
+    
+    # a has been idle for over a minute and goes first; its row starts clean
+    store.record('c', 40, start + timedelta(seconds=110))
+    store.record('d', 50, start + timedelta(seconds=120))
+    assert store.window_stats('a')[0] == 0
+    assert store.window_stats('d')[:2] == (1, 50.0)
+    assert store.get_statistics()['evicted_lru'] == 1
+    assert store.get_statistics()['evicted_idle'] == 1
+
+def test_rolling_mean_covers_last_values():
+    rolling = RollingMean(10)
+    scores = list(np.random.default_rng(2).uniform(0, 100, 35))
+    for i, score in enumerate(scores):
+        assert rolling.add(score) == pytest.approx(np.mean(scores[max(0, i - 9):i + 1]))
+
+def test_shared_behavior_store_sees_every_workers_traffic(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'behavior.db'))
+    workers = [SharedBehaviorStore(db, window=100, cache_ttl=60) for _ in range(4)]
+    local = BehaviorStore(max_users=10, window=100)
+    start = datetime(2030, 1, 1)
+    for i in range(400):
+        timestamp = start + timedelta(seconds=i)
+        workers[i % 4].record('alice', i % 37, timestamp)
+        local.record('alice', i % 37, timestamp)
+    
+    # The worker that wrote last reads the full window from its cache
+    count, mean, variance, last_activity = workers[3].window_stats('alice')
+    expected = local.window_stats('alice')
+    assert (count, last_activity) == (expected[0], expected[3])
+    assert (mean, variance) == pytest.approx(expected[1:3])
+    assert workers[3].get_statistics()['cache_hits'] == 1
+    
+    # Another worker serves its stale cached window until the TTL runs out
+    assert workers[0].window_stats('alice')[3] == start + timedelta(seconds=396)
+    workers[0].cache_ttl = 0
+    assert workers[0].window_stats('alice')[3] == last_activity
+    
+    # A restarted worker starts from the stored windows
+    assert SharedBehaviorStore(db).summary('alice')['message_count'] == 100
+    assert SharedBehaviorStore(db).window_stats('nobody') == (0, None, 0.0, None)
+    
+    # Suspicious events are counted in the stored aggregate, for tracked users only
+    workers[1].mark_suspicious('alice')
+    workers[2].mark_suspicious('alice')
+    workers[2].mark_suspicious('nobody')
+    assert workers[2].summary('alice')['suspicious_count'] == 2
+    assert SharedBehaviorStore(db).summary('alice')['suspicious_count'] == 2
+    assert SharedBehaviorStore(db).summary('nobody')['suspicious_count'] == 0
+
+def test_pipeline_records_a_batch_in_one_shared_write(tmp_path):
+    db = SQLiteDatabase(str(tmp_path / 'behavior.db'))
+    pipeline = ThreatScoringPipeline(ThreatDetector(str(tmp_path), SharedBehaviorStore(db, cache_ttl=60)), db,
+                                     workers=0, threshold=101)
+    start = datetime(2030, 1, 1, 12)
+    events = [ThreatEvent(f"user-{i % 3}", 'peer', 10 + i, start + timedelta(seconds=i), 'test') for i in range(9)]
+    assert pipeline.process(events) == 9
+    
+    behavior = pipeline.detector.behavior
+    assert behavior.get_statistics()['writes'] == 1
+    assert db.get_user_behavior('user-1')['lengths'] == [11, 14, 17]
+    # Scoring read every sender's window from what the write returned
+    assert behavior.get_statistics()['cache_misses'] == 0
+
+def test_threat_detector_is_process_wide(monkeypatch):
+    monkeypatch.setenv('THREAT_BEHAVIOR_STORE', 'memory')
+    assert get_threat_detector() is get_threat_detector()
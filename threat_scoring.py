@@ -0,0 +1,339 @@
+"""
+TacticalLink Threat Scoring
+Scores sent messages off the send path, micro-batching concurrent scores into single model calls
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence
+
+import numpy as np
+
+from destruction_metrics import LagHistogram
+from models import ThreatLog
+
+# Upper bounds in seconds of the send-to-score lag histogram buckets
+SCORING_LAG_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class MicroBatchScorer:
+    """Scores feature rows from concurrent callers in shared batches
+    
+    The first row to arrive opens a batch that closes max_wait seconds later
+    or once it holds max_batch rows, whichever comes first. The batch is
+    scored in one call to score_batch and every caller's future is resolved
+    with its own score, so a row never waits more than max_wait plus one
+    model call.
+    """
+    
+    def __init__(self, score_batch: Callable[[np.ndarray], np.ndarray],
+                 max_batch: int = 64, max_wait: float = 0.002):
+        self.score_batch = score_batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.pending = deque()
+        self.condition = threading.Condition()
+        self.worker = None
+        self.stats = {'requests': 0, 'batches': 0, 'rows_scored': 0, 'largest_batch': 0, 'errors': 0}
+    
+    def submit(self, features: Sequence[float]) -> Future:
+        """Queue one feature row; the future resolves to its score"""
+        future = Future()
+        with self.condition:
+            self.pending.append((features, future, time.monotonic()))
+            self.stats['requests'] += 1
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._run, daemon=True)
+                self.worker.start()
+            # The worker only needs waking to open a batch or close a full one
+            if len(self.pending) == 1 or len(self.pending) >= self.max_batch:
+                self.condition.notify()
+        return future
+    
+    def score(self, features: Sequence[float], timeout: float = None) -> float:
+        """Score one feature row, waiting for the batch it lands in"""
+        return self.submit(features).result(timeout)
+    
+    def _next_batch(self) -> List:
+        """Wait for a batch to fill or reach its oldest row's deadline, then take it"""
+        with self.condition:
+            while not self.pending:
+                self.condition.wait()
+            deadline = self.pending[0][2] + self.max_wait
+            while len(self.pending) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return [self.pending.popleft() for _ in range(min(self.max_batch, len(self.pending)))]
+    
+    def _run(self):
+        """Batching loop"""
+        while True:
+            self._score(self._next_batch())
+    
+    def _score(self, batch: List):
+        live = [(features, future) for features, future, _ in batch if future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        
+        try:
+            scores = self.score_batch(np.array([features for features, _ in live], dtype=float))
+            for (_, future), score in zip(live, scores):
+                future.set_result(float(score))
+            with self.condition:
+                self.stats['batches'] += 1
+                self.stats['rows_scored'] += len(live)
+                self.stats['largest_batch'] = max(self.stats['largest_batch'], len(live))
+        
+        except Exception as e:
+            print(f"Error scoring threat batch: {e}")
+            with self.condition:
+                self.stats['errors'] += 1
+            for _, future in live:
+                future.set_exception(e)
+    
+    def get_statistics(self) -> Dict:
+        """Batching statistics for monitoring"""
+        with self.condition:
+            batches = self.stats['batches']
+            return {
+                **self.stats,
+                'pending': len(self.pending),
+                'avg_batch': self.stats['rows_scored'] / batches if batches else 0.0,
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000
+            }
+
+class ThreatEvent(NamedTuple):
+    """Metadata of a sent message queued for scoring; the content itself never enters the queue"""
+    sender_id: str
+    recipient_id: str
+    message_length: int
+    timestamp: datetime
+    reason: str
+    message_id: Optional[str] = None
+    enqueued_at: float = 0.0
+
+class ThreatScoringPipeline:
+    """Scores sent messages on background workers instead of in the send request
+    
+    Send handlers enqueue a ThreatEvent and reply straight away with the
+    sender's last known score, if there is one. Workers take events off a
+    bounded queue in batches, score them through the detector's micro-batcher,
+    keep the latest score per sender, and above the threshold count a
+    suspicious event against the sender and write a threat log. A full queue
+    drops the event and counts it rather than blocking the send.
+    """
+    
+    def __init__(self, detector, db, workers: int = 2, max_queue: int = 10000,
+                 batch_size: int = 64, threshold: float = 70.0):
+        self.detector = detector
+        self.db = db
+        self.workers = workers
+        self.batch_size = batch_size
+        self.threshold = threshold
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.latest_scores = {}
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.lag = LagHistogram(SCORING_LAG_BUCKETS)
+        self.stats = {'enqueued': 0, 'dropped': 0, 'scored': 0, 'errors': 0, 'threat_logs': 0}
+    
+    def enqueue(self, sender_id: str, recipient_id: str, message_length: int,
+                timestamp: Optional[datetime] = None, reason: str = "Suspicious messaging pattern",
+                message_id: Optional[str] = None) -> bool:
+        """Queue a sent message for scoring; False when the queue is full and the event was dropped"""
+        event = ThreatEvent(sender_id, recipient_id, message_length, timestamp or datetime.utcnow(),
+                            reason, message_id, time.monotonic())
+        if not self.threads:
+            self.start()
+        
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            with self.lock:
+                self.stats['dropped'] += 1
+            return False
+        
+        with self.lock:
+            self.stats['enqueued'] += 1
+        return True
+    
+    def provisional_score(self, user_id: str) -> Optional[float]:
+        """Latest score of a user's messages, None until one has been scored"""
+        with self.lock:
+            return self.latest_scores.get(user_id)
+    
+    def process(self, events: List[ThreatEvent]) -> int:
+        """Score a batch of events, record the scores and log threats; returns the events scored
+        
+        The batch's behavior is recorded in one write before any event is
+        scored, so every event is scored against its sender's window after
+        the whole batch.
+        """
+        self.detector.record_messages([(event.sender_id, event.message_length, event.timestamp) for event in events])
+        submitted = []
+        for event in events:
+            try:
+                future = self.detector.submit_message_metadata(
+                    event.sender_id, event.recipient_id, event.message_length, event.timestamp,
+                    track_behavior=False
+                )
+                submitted.append((event, future))
+            except Exception as e:
+                print(f"Error queueing threat score for {event.sender_id}: {e}")
+        
+        scored = []
+        for event, future in submitted:
+            try:
+                scored.append((event, future.result()))
+            except Exception as e:
+                print(f"Error scoring message from {event.sender_id}: {e}")
+        
+        done = time.monotonic()
+        with self.lock:
+            for event, score in scored:
+                self.latest_scores[event.sender_id] = score
+                self.lag.record(done - event.enqueued_at)
+            self.stats['scored'] += len(scored)
+            self.stats['errors'] += len(events) - len(scored)
+        
+        for event, score in scored:
+            if score > self.threshold:
+                self.detector.mark_suspicious(event.sender_id)
+                self._log_threat(event, score)
+        return len(scored)
+    
+    def _log_threat(self, event: ThreatEvent, score: float):
+        try:
+            self.db.create_threat_log(ThreatLog(
+                user_id=event.sender_id,
+                threat_score=score,
+                reason=event.reason,
+                timestamp=event.timestamp,
+                metadata={'message_id': event.message_id} if event.message_id else None
+            ))
+            with self.lock:
+                self.stats['threat_logs'] += 1
+        
+        except Exception as e:
+            print(f"Error logging threat for {event.sender_id}: {e}")
+            with self.lock:
+                self.stats['errors'] += 1
+    
+    def start(self):
+        """Start the scoring workers"""
+        with self.lock:
+            if self.threads:
+                return
+            self.threads = [threading.Thread(target=self._run, daemon=True) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        atexit.register(self.stop)
+    
+    def stop(self):
+        """Stop the workers once they have scored everything already queued"""
+        self.stop_event.set()
+        for thread in self.threads:
+            if thread.is_alive():
+                thread.join(timeout=5)
+    
+    def _run(self):
+        """Scoring loop; exits when stopped and the queue is drained"""
+        while True:
+            try:
+                events = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                if self.stop_event.is_set():
+                    return
+                continue
+            
+            while len(events) < self.batch_size:
+                try:
+                    events.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            self.process(events)
+    
+    def get_statistics(self) -> Dict:
+        """Queue depth, send-to-score lag and counters for monitoring"""
+        with self.lock:
+            return {
+                **self.stats,
+                'queue_depth': self.queue.qsize(),
+                'queue_capacity': self.queue.maxsize,
+                'workers': self.workers,
+                'lag_seconds': self.lag.to_dict(),
+                'batching': self.detector.batch_scorer.get_statistics()
+            }
+
+class ThreatSweep:
+    """Rescores every active user from their recent activity
+    
+    A sweep is one get_users_recent_activity query and one model call for
+    all users, so its cost grows with the number of messages read rather
+    than with round trips per user.
+    """
+    
+    def __init__(self, db, detector, limit: int = 10, threshold: float = 80.0):
+        self.db = db
+        self.detector = detector
+        self.limit = limit
+        self.threshold = threshold
+        self.stats = {'sweeps': 0, 'users_scored': 0, 'threat_logs': 0, 'last_sweep_seconds': None}
+    
+    def run(self, user_ids) -> Dict[str, float]:
+        """Score the given users, logging those above the threshold; users without messages score 0"""
+        started = time.perf_counter()
+        user_ids = list(user_ids)
+        activity = self.db.get_users_recent_activity(user_ids, self.limit)
+        scored = self.detector.analyze_users_activity(activity)
+        threat_scores = {user_id: scored.get(user_id, 0.0) for user_id in user_ids}
+        
+        logged = 0
+        for user_id, score in threat_scores.items():
+            if score > self.threshold:
+                self.db.create_threat_log(ThreatLog(
+                    user_id=user_id,
+                    threat_score=score,
+                    reason="Automated threat detection - high risk",
+                    timestamp=datetime.utcnow()
+                ))
+                logged += 1
+        
+        self.stats['sweeps'] += 1
+        self.stats['users_scored'] += len(user_ids)
+        self.stats['threat_logs'] += logged
+        self.stats['last_sweep_seconds'] = time.perf_counter() - started
+        return threat_scores
+    
+    def get_statistics(self) -> Dict:
+        """Sweep statistics for monitoring"""
+        return dict(self.stats)
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+def get_threat_pipeline() -> ThreatScoringPipeline:
+    """Process-wide scoring pipeline shared by the app and blueprints"""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            # ai_threat imports this module, so its detector is looked up here
+            from ai_threat import get_threat_detector
+            from storage_backend import create_database
+            _pipeline = ThreatScoringPipeline(
+                get_threat_detector(),
+                create_database(),
+                workers=int(os.getenv('THREAT_SCORING_WORKERS', 2)),
+                max_queue=int(os.getenv('THREAT_SCORING_QUEUE_SIZE', 10000)),
+                threshold=float(os.getenv('THREAT_DETECTION_THRESHOLD', 70))
+            )
+        return _pipeline